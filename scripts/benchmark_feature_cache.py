@@ -0,0 +1,37 @@
+import os
+import sys
+import argparse
+import logging
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.generation.sd_runner import StableDiffusionRunner
+from src.generation.feature_cache import benchmark_feature_cache
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Speed/quality tradeoff of UNet feature caching")
+    parser.add_argument("image", nargs="?", default="assets/room_sample.jpg")
+    parser.add_argument("--preset", default="fast")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 2, 3, 5])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--style", default="modern")
+    args = parser.parse_args(argv)
+
+    runner = StableDiffusionRunner(feature_cache=True)
+    rows = benchmark_feature_cache(
+        runner, args.image, intervals=args.intervals, preset=args.preset, seed=args.seed, style=args.style
+    )
+
+    print(f"\n{'interval':>8} {'seconds':>8} {'speedup':>8} {'psnr':>8} {'cosine':>8} {'full/shallow':>13}")
+    for row in rows:
+        print(
+            f"{row['interval']:>8} {row['seconds']:>8.2f} {row['speedup']:>7.2f}x {row['psnr']:>8.2f} "
+            f"{row['cosine_similarity']:>8.4f} {row['full_steps']:>6}/{row['shallow_steps']:<6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+import argparse
+import logging
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.generation.sd_runner import StableDiffusionRunner
+from src.optimizations import available_memory
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Peak RSS per preset, for sizing worker counts")
+    parser.add_argument("image", nargs="?", default="assets/room_sample.jpg")
+    parser.add_argument("--presets", nargs="+", default=["fast", "balanced", "hires"])
+    parser.add_argument("--tile-size", type=int, default=768)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--style", default="modern")
+    args = parser.parse_args(argv)
+
+    runner = StableDiffusionRunner(tile_size=args.tile_size)
+    available = available_memory()
+
+    rows = []
+    for preset in args.presets:
+        start_time = time.time()
+        runner.generate_styled_image(None, args.image, preset=preset, mode="generic", seed=args.seed, style=args.style)
+        rows.append((preset, time.time() - start_time, runner.last_peak_rss))
+
+    print(f"\n{'preset':>10} {'seconds':>8} {'peak MB':>8} {'workers':>8}")
+    for preset, seconds, peak in rows:
+        if peak is None:
+            print(f"{preset:>10} {seconds:>8.2f} {'?':>8} {'?':>8}")
+            continue
+        workers = available // peak if available else "?"
+        print(f"{preset:>10} {seconds:>8.2f} {peak / 2 ** 20:>8.0f} {workers:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import os
+import sys
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(array, *extra):
+    """
+    Fast content hash of a NumPy array (plus optional extra key parts).
+    Shape and dtype are part of the key, so equal bytes in a different
+    layout never collide.
+    """
+    array = np.ascontiguousarray(array)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((array.shape, array.dtype.str) + extra).encode())
+    # memoryview cannot cast empty arrays
+    h.update(memoryview(array).cast("B") if array.size else b"")
+    return h.hexdigest()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Content hash of a file, cheaper than decoding it first.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def nbytes(value):
+    """
+    Approximate memory footprint of a cached value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values.
+    """
+
+    def __init__(self, max_bytes, name="cache"):
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        size = nbytes(value)
+
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._sizes.pop(key)
+                del self._data[key]
+
+            if size > self.max_bytes:
+                logger.warning(f"{self.name}: entry of {size} bytes exceeds the cache limit, not cached.")
+                return
+
+            self._data[key] = value
+            self._sizes[key] = size
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                old_key, _ = self._data.popitem(last=False)
+                self._bytes -= self._sizes.pop(old_key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+def pack_masks(masks):
+    """
+    Packs (N, H, W) boolean masks into 1 bit per pixel.
+    """
+    masks = np.asarray(masks, dtype=bool)
+    n, h, w = masks.shape
+    return np.packbits(masks.reshape(n, h * w), axis=1)
+
+
+def unpack_masks(packed, shape):
+    """
+    Inverse of pack_masks(); shape is the (N, H, W) mask shape.
+    """
+    n, h, w = shape
+    return np.unpackbits(packed, axis=1, count=h * w).reshape(n, h, w).astype(bool)
+
+
+class PerceptionCache:
+    """
+    Shared on-disk cache of perception results, keyed by image content hash,
+    model id and parameters, so re-styling a scan skips YOLO, SAM and MiDaS.
+
+    <cache_dir>/detections/<key>.npz  bbox / class_id / confidence arrays
+    <cache_dir>/masks/<key>.npz       bit-packed masks (1 bit per pixel)
+    <cache_dir>/depth/<key>.npy       float16 depth, memory-mapped on read
+    """
+
+    def __init__(self, cache_dir="perception_cache"):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        for kind in ("detections", "masks", "depth"):
+            os.makedirs(os.path.join(cache_dir, kind), exist_ok=True)
+
+    @staticmethod
+    def key(image, model, **params):
+        """
+        Cache key of an image for a model id and its result-affecting
+        parameters (arrays such as prompt boxes are hashed by content).
+        """
+        parts = [model]
+        for name, value in sorted(params.items()):
+            if isinstance(value, np.ndarray):
+                value = content_hash(value)
+            parts.append(f"{name}={value}")
+        return content_hash(image, *parts)
+
+    def _path(self, kind, key, ext):
+        return os.path.join(self.cache_dir, kind, f"{key}{ext}")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @staticmethod
+    def _write(path, save_fn):
+        # Written to a temporary file first, readers never see partial entries
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            save_fn(f)
+        os.replace(tmp_path, path)
+
+    # -------------------- Detections --------------------
+
+    def get_detections(self, key):
+        path = self._path("detections", key, ".npz")
+        if not os.path.exists(path):
+            self._count(False)
+            return None
+
+        with np.load(path) as data:
+            columns = {name: data[name] for name in ("bbox", "class_id", "confidence")}
+        self._count(True)
+        return columns
+
+    def put_detections(self, key, columns):
+        self._write(
+            self._path("detections", key, ".npz"),
+            lambda f: np.savez(
+                f,
+                bbox=np.asarray(columns["bbox"], dtype=np.float32),
+                class_id=np.asarray(columns["class_id"], dtype=np.int64),
+                confidence=np.asarray(columns["confidence"], dtype=np.float32)
+            )
+        )
+
+    # -------------------- Masks --------------------
+
+    def get_masks(self, key):
+        path = self._path("masks", key, ".npz")
+        if not os.path.exists(path):
+            self._count(False)
+            return None
+
+        with np.load(path) as data:
+            masks = unpack_masks(data["packed"], tuple(data["shape"]))
+        self._count(True)
+        return masks
+
+    def put_masks(self, key, masks):
+        self._write(
+            self._path("masks", key, ".npz"),
+            lambda f: np.savez(f, packed=pack_masks(masks), shape=np.asarray(np.shape(masks)))
+        )
+
+    # -------------------- Depth --------------------
+
+    def get_depth(self, key):
+        """
+        Returns the cached depth map as a read-only float16 memory map.
+        """
+        path = self._path("depth", key, ".npy")
+        if not os.path.exists(path):
+            self._count(False)
+            return None
+
+        self._count(True)
+        return np.load(path, mmap_mode="r")
+
+    def put_depth(self, key, depth):
+        self._write(
+            self._path("depth", key, ".npy"),
+            lambda f: np.save(f, np.asarray(depth, dtype=np.float16))
+        )
@@ -1,65 +1,235 @@
-import torch
-import cv2
-import numpy as np
-import os
-
-
-class MiDaSRunner:
-    def __init__(self, model_type="MiDaS_small"):
-        """
-        model_type:
-        - MiDaS_small (fast CPU)
-        - DPT_Hybrid (better quality but slower)
-        """
-        self.device = torch.device("cpu")
-
-        # Load model from torch hub
-        self.model = torch.hub.load("intel-isl/MiDaS", model_type)
-        self.model.to(self.device)
-        self.model.eval()
-
-        # Load transforms
-        midas_transforms = torch.hub.load("intel-isl/MiDaS", "transforms")
-
-        if model_type == "MiDaS_small":
-            self.transform = midas_transforms.small_transform
-        else:
-            self.transform = midas_transforms.default_transform
-
-        print(f"[INFO] Loaded {model_type} on CPU")
-
-    def run(self, image, output_path):
-        """
-        image: numpy BGR image (from cv2)
-        output_path: where to save depth.png
-        """
-
-        img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-        input_batch = self.transform(img_rgb).to(self.device)
-
-        with torch.no_grad():
-            prediction = self.model(input_batch)
-
-            prediction = torch.nn.functional.interpolate(
-                prediction.unsqueeze(1),
-                size=img_rgb.shape[:2],
-                mode="bicubic",
-                align_corners=False,
-            ).squeeze()
-
-        depth = prediction.cpu().numpy()
-
-        # Normalize depth for visualization
-        depth_min = depth.min()
-        depth_max = depth.max()
-
-        depth_norm = (depth - depth_min) / (depth_max - depth_min + 1e-8)
-        depth_img = (depth_norm * 255).astype(np.uint8)
-
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        cv2.imwrite(output_path, depth_img)
-
-        print(f"[INFO] Depth map saved at {output_path}")
-
-        return depth_img, depth_norm
+import torch
+import cv2
+import numpy as np
+import os
+
+from src.optimizations import (
+    export_onnx,
+    OnnxRunner,
+    quantize_dynamic_int8,
+    resolve_precision,
+    cpu_autocast,
+    apply_torch_compile,
+    enable_compile_cache,
+    versioned_cache_dir,
+    versioned_cache_key,
+    module_identity,
+    ONNX_OPSET
+)
+
+
+class MiDaSRunner:
+    def __init__(
+        self,
+        model_type="MiDaS_small",
+        backend="torch",
+        onnx_dir="onnx/midas",
+        quantize=False,
+        quantized_dir="quantized/midas",
+        precision="fp32",
+        torch_compile=False,
+        compile_cache_dir="compile_cache/midas",
+        warmup_size=(480, 640),
+        perception_cache=None
+    ):
+        """
+        model_type:
+        - MiDaS_small (fast CPU)
+        - DPT_Hybrid (better quality but slower)
+        backend: "torch" or "onnx" (ONNX Runtime CPU, falls back to torch)
+        onnx_dir: where the exported graph is stored and reused
+        quantize: dynamic int8 quantization of the model's linear layers
+                  (most effective on the transformer-based DPT models)
+        quantized_dir: where quantized weights are cached
+        precision: "fp32", "bf16" or "auto" (bf16 autocast on AVX512-BF16/AMX CPUs)
+        torch_compile: compile the depth model and warm it up at startup
+        compile_cache_dir: persistent inductor/FX graph cache for restarted workers
+        warmup_size: (height, width) of the frames the warmup compiles for
+        perception_cache: optional PerceptionCache shared with YOLO and SAM
+        """
+        self.device = torch.device("cpu")
+
+        # Load model from torch hub
+        self.model = torch.hub.load("intel-isl/MiDaS", model_type)
+        self.model.to(self.device)
+        self.model.eval()
+
+        # Load transforms
+        midas_transforms = torch.hub.load("intel-isl/MiDaS", "transforms")
+
+        if model_type == "MiDaS_small":
+            self.transform = midas_transforms.small_transform
+        else:
+            self.transform = midas_transforms.default_transform
+
+        # Keys the ONNX/int8/perception caches, taken before quantization changes the weights
+        model_id = None
+        if backend == "onnx" or quantize or perception_cache is not None:
+            model_id = module_identity(self.model)
+
+        self.backend = "torch"
+        self.onnx_session = None
+        if backend == "onnx":
+            onnx_dir = versioned_cache_dir(onnx_dir, model_type, model_id, ONNX_OPSET)
+            self.enable_onnx(os.path.join(onnx_dir, f"{model_type}.onnx"))
+
+        if quantize:
+            if self.backend != "torch":
+                print("[WARN] int8 quantization only applies to the torch backend, skipping")
+            else:
+                self.model = quantize_dynamic_int8(
+                    self.model,
+                    os.path.join(
+                        versioned_cache_dir(quantized_dir, model_type, model_id),
+                        f"{model_type}_int8.pt"
+                    )
+                )
+
+        if precision != "fp32" and (self.backend != "torch" or quantize):
+            print("[WARN] bf16 autocast needs the unquantized torch backend, using fp32")
+            precision = "fp32"
+        self.precision = resolve_precision(precision)
+
+        # Other weights or library versions give other depth maps; int8/bf16
+        # depth differs slightly from fp32, keep cache entries apart
+        self.perception_cache = None
+        self.cache_id = f"midas-{model_type}-{versioned_cache_key(model_type, model_id)}"
+        if quantize and self.backend == "torch":
+            self.cache_id += "-int8"
+        elif self.precision == "bf16":
+            self.cache_id += "-bf16"
+
+        if torch_compile:
+            if self.backend != "torch" or quantize:
+                print("[WARN] torch.compile needs the unquantized torch backend, skipping")
+            else:
+                self.enable_compile(compile_cache_dir, warmup_size)
+
+        # Attached after the warmup, so its blank frame is never cached
+        self.perception_cache = perception_cache
+
+        print(f"[INFO] Loaded {model_type} on CPU ({self.backend} backend, {self.precision})")
+
+    def enable_compile(self, cache_dir, warmup_size=(480, 640)):
+        """
+        Compiles the depth model with a persistent compile cache and runs one
+        warmup frame so the first real frame does not pay the compile cost.
+        """
+        enable_compile_cache(cache_dir)
+        self.model = apply_torch_compile(self.model)
+
+        self.run_batch([np.zeros((*warmup_size, 3), dtype=np.uint8)])
+        print(f"[INFO] Depth model compiled and warmed up for {warmup_size}")
+
+    def enable_onnx(self, onnx_path, example_size=(256, 256)):
+        """
+        Exports the depth model once and runs it through ONNX Runtime.
+        Keeps the PyTorch model if export or loading fails.
+        """
+        try:
+            export_onnx(
+                self.model,
+                (torch.randn(1, 3, *example_size),),
+                onnx_path,
+                input_names=["image"],
+                output_names=["depth"],
+                dynamic_axes={
+                    "image": {0: "batch", 2: "height", 3: "width"},
+                    "depth": {0: "batch", 1: "height", 2: "width"}
+                }
+            )
+            self.onnx_session = OnnxRunner(onnx_path)
+            self.backend = "onnx"
+        except Exception as e:
+            print(f"[WARN] ONNX backend unavailable ({e}), using PyTorch")
+
+    def _forward(self, input_batch):
+        if self.onnx_session is not None:
+            return self.onnx_session(input_batch.float())[0]
+
+        with cpu_autocast(self.precision):
+            return self.model(input_batch).float()
+
+    def run(self, image, output_path):
+        """
+        image: numpy BGR image (from cv2)
+        output_path: where to save depth.png
+        """
+
+        depth_imgs, depth_norms = self.run_batch([image], [output_path])
+
+        return depth_imgs[0], depth_norms[0]
+
+    def run_batch(self, images, output_paths=None, batch_size=8):
+        """
+        images: list of numpy BGR images (from cv2)
+        output_paths: optional list of depth.png paths (None skips disk writes)
+        batch_size: max frames per forward pass
+
+        Same-sized frames are stacked and pushed through the model, the
+        upsampling and the normalization together. Frames found in the
+        perception cache skip the model; their depth_norm is a read-only
+        float16 memory map.
+        Returns (depth_imgs, depth_norms), one entry per input image.
+        """
+
+        depth_imgs = [None] * len(images)
+        depth_norms = [None] * len(images)
+        keys = [None] * len(images)
+
+        cache = self.perception_cache
+        if cache is not None:
+            for idx, image in enumerate(images):
+                keys[idx] = cache.key(image, self.cache_id)
+                depth_norm = cache.get_depth(keys[idx])
+                if depth_norm is not None:
+                    depth_norms[idx] = depth_norm
+                    depth_imgs[idx] = (depth_norm * 255).astype(np.uint8)
+
+        # Group frames by size, only those can share one tensor
+        groups = {}
+        for idx, image in enumerate(images):
+            if depth_norms[idx] is None:
+                groups.setdefault(image.shape[:2], []).append(idx)
+
+        for size, indices in groups.items():
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start:start + batch_size]
+
+                input_batch = torch.cat([
+                    self.transform(cv2.cvtColor(images[idx], cv2.COLOR_BGR2RGB))
+                    for idx in chunk
+                ]).to(self.device)
+
+                with torch.no_grad():
+                    prediction = self._forward(input_batch)
+
+                    prediction = torch.nn.functional.interpolate(
+                        prediction.unsqueeze(1),
+                        size=size,
+                        mode="bicubic",
+                        align_corners=False,
+                    ).squeeze(1)
+
+                    # Normalize depth for visualization, per frame
+                    depth_min = prediction.amin(dim=(1, 2), keepdim=True)
+                    depth_max = prediction.amax(dim=(1, 2), keepdim=True)
+                    batch_norm = (prediction - depth_min) / (depth_max - depth_min + 1e-8)
+
+                batch_norm = batch_norm.cpu().numpy()
+                batch_img = (batch_norm * 255).astype(np.uint8)
+
+                for i, idx in enumerate(chunk):
+                    depth_norms[idx] = batch_norm[i]
+                    depth_imgs[idx] = batch_img[i]
+                    if cache is not None:
+                        cache.put_depth(keys[idx], batch_norm[i])
+
+        if output_paths is not None:
+            for depth_img, output_path in zip(depth_imgs, output_paths):
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                cv2.imwrite(output_path, depth_img)
+
+                print(f"[INFO] Depth map saved at {output_path}")
+
+        return depth_imgs, depth_norms
@@ -1,49 +1,104 @@
-from ultralytics import YOLO
-import os
-import json
-
-
-class YOLOv8Runner:
-    def __init__(self, model_name="yolov8n.pt"):
-        """
-        model_name:
-        - yolov8n.pt  (nano, fastest CPU)
-        - yolov8s.pt  (small, better accuracy)
-        """
-        self.model = YOLO(model_name)
-        print(f"[INFO] Loaded {model_name}")
-
-    def run(self, image, output_json_path):
-        """
-        image: numpy BGR image (from cv2)
-        output_json_path: where to save detections.json
-        """
-
-        results = self.model(image)
-
-        detections = []
-
-        for r in results:
-            boxes = r.boxes
-            if boxes is None:
-                continue
-
-            for box in boxes:
-                bbox = box.xyxy[0].tolist()   # [x1, y1, x2, y2]
-                cls = int(box.cls[0])
-                conf = float(box.conf[0])
-
-                detections.append({
-                    "bbox": bbox,
-                    "class_id": cls,
-                    "confidence": conf
-                })
-
-        os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
-
-        with open(output_json_path, "w") as f:
-            json.dump(detections, f, indent=4)
-
-        print(f"[INFO] Detections saved at {output_json_path}")
-
-        return detections
+import ultralytics
+from ultralytics import YOLO
+import os
+import json
+import numpy as np
+
+
+def detections_to_list(columns):
+    """
+    Converts columnar detections into the list-of-dicts layout used by
+    SAMRunner, SceneBuilder and detections.json.
+    """
+    return [
+        {"bbox": bbox, "class_id": cls, "confidence": conf}
+        for bbox, cls, conf in zip(
+            columns["bbox"].tolist(),
+            columns["class_id"].tolist(),
+            columns["confidence"].tolist()
+        )
+    ]
+
+
+class YOLOv8Runner:
+    def __init__(self, model_name="yolov8n.pt", perception_cache=None):
+        """
+        model_name:
+        - yolov8n.pt  (nano, fastest CPU)
+        - yolov8s.pt  (small, better accuracy)
+        perception_cache: optional PerceptionCache shared with SAM and MiDaS
+        """
+        self.model = YOLO(model_name)
+        self.perception_cache = perception_cache
+        self.cache_id = f"yolo-{os.path.basename(model_name)}-{ultralytics.__version__}"
+        print(f"[INFO] Loaded {model_name}")
+
+    def run(self, image, output_json_path=None, write_json=False):
+        """
+        image: numpy BGR image (from cv2)
+        output_json_path: where to save detections.json
+        write_json: write output_json_path (off by default, skips the serialization)
+        """
+
+        columns = self.run_batch([image], [output_json_path] if write_json else None)[0]
+
+        return detections_to_list(columns)
+
+    @staticmethod
+    def _extract(result):
+        """
+        Pulls boxes, classes and confidences of one result with a single
+        tensor-to-NumPy conversion.
+        """
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            data = np.zeros((0, 6), dtype=np.float32)
+        else:
+            data = boxes.data.cpu().numpy()   # [x1, y1, x2, y2, (track_id), conf, cls]
+
+        return {
+            "bbox": data[:, :4],
+            "class_id": data[:, -1].astype(np.int64),
+            "confidence": data[:, -2]
+        }
+
+    def run_batch(self, frames, output_json_paths=None, batch_size=16):
+        """
+        frames: list of numpy BGR images (from cv2)
+        output_json_paths: optional list of detections.json paths (None skips disk writes)
+        batch_size: max frames per model call
+
+        Frames found in the perception cache skip the model.
+        Returns one columnar dict per frame:
+        {"bbox": (N, 4) float32, "class_id": (N,) int64, "confidence": (N,) float32}
+        """
+
+        detections = [None] * len(frames)
+        keys = [None] * len(frames)
+
+        if self.perception_cache is not None:
+            for idx, frame in enumerate(frames):
+                keys[idx] = self.perception_cache.key(frame, self.cache_id)
+                detections[idx] = self.perception_cache.get_detections(keys[idx])
+
+        pending = [idx for idx, columns in enumerate(detections) if columns is None]
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            results = self.model([frames[idx] for idx in chunk])
+
+            for idx, result in zip(chunk, results):
+                detections[idx] = self._extract(result)
+                if self.perception_cache is not None:
+                    self.perception_cache.put_detections(keys[idx], detections[idx])
+
+        if output_json_paths is not None:
+            for columns, output_json_path in zip(detections, output_json_paths):
+                os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+
+                with open(output_json_path, "w") as f:
+                    json.dump(detections_to_list(columns), f, indent=4)
+
+                print(f"[INFO] Detections saved at {output_json_path}")
+
+        return detections
@@ -0,0 +1,200 @@
+import time
+import logging
+
+from diffusers.models.unets.unet_2d_condition import UNet2DConditionOutput
+
+from src.optimizations import compare_outputs
+
+logger = logging.getLogger(__name__)
+
+
+class UNetFeatureCache:
+    """
+    DeepCache-style cross-step feature reuse for a UNet + ControlNet pair.
+
+    Adjacent denoising steps produce nearly identical deep features. Every
+    `interval` steps the full UNet and ControlNet run and the input of the
+    last up block (everything below the shallowest level) and the ControlNet
+    residuals are kept. The steps in between only run conv_in, the first
+    down block and the last up block on top of the cached features, and
+    skip the ControlNet entirely.
+    """
+
+    def __init__(self, unet, controlnet=None):
+        """
+        unet: UNet2DConditionModel (SD 1.x/2.x layout, no added/class embeddings)
+        controlnet: ControlNetModel called once per step before the UNet
+        """
+        if any(getattr(unet, name, None) is not None for name in ("class_embedding", "add_embedding", "encoder_hid_proj")):
+            raise ValueError("Feature caching supports UNets without class, added or projected embeddings.")
+
+        self.unet = unet
+        self.controlnet = controlnet
+
+        self.interval = 1
+        self.step = 0
+        self.full_steps = 0
+        self.shallow_steps = 0
+
+        self._deep = None
+        self._residuals = None
+        self._recording = False
+
+        self._unet_forward = unet.forward
+        unet.forward = self._forward_unet
+        unet.up_blocks[-1].register_forward_pre_hook(self._record_deep, with_kwargs=True)
+
+        if controlnet is not None:
+            self._controlnet_forward = controlnet.forward
+            controlnet.forward = self._forward_controlnet
+
+    def reset(self, interval=None):
+        """
+        Drops cached features, call before every pipeline run.
+        interval: recompute deep features every `interval` steps (1: off)
+        """
+        if interval is not None:
+            self.interval = max(1, int(interval))
+        self.step = 0
+        self._deep = None
+        self._residuals = None
+
+    def _is_full_step(self):
+        return self.interval == 1 or self._deep is None or self.step % self.interval == 0
+
+    def _record_deep(self, module, args, kwargs):
+        if self._recording:
+            self._deep = kwargs["hidden_states"]
+
+    def _forward_controlnet(self, *args, **kwargs):
+        # Called before the UNet of the same step, self.step is not advanced yet
+        if self._is_full_step() or self._residuals is None:
+            self._residuals = self._controlnet_forward(*args, **kwargs)
+        return self._residuals
+
+    def _forward_unet(self, sample, timestep, *args, **kwargs):
+        full = self._is_full_step()
+        self.step += 1
+
+        if full:
+            self.full_steps += 1
+            self._recording = self.interval > 1
+            try:
+                return self._unet_forward(sample, timestep, *args, **kwargs)
+            finally:
+                self._recording = False
+
+        self.shallow_steps += 1
+        if args:
+            kwargs["encoder_hidden_states"] = args[0]
+        return self._shallow_forward(sample, timestep, **kwargs)
+
+    def _shallow_forward(
+        self,
+        sample,
+        timestep,
+        encoder_hidden_states=None,
+        timestep_cond=None,
+        cross_attention_kwargs=None,
+        down_block_additional_residuals=None,
+        return_dict=True,
+        **unused
+    ):
+        """
+        UNet2DConditionModel.forward() restricted to the shallowest level,
+        with the cached deep features as input of the last up block.
+        """
+        unet = self.unet
+
+        if unet.config.center_input_sample:
+            sample = 2 * sample - 1.0
+
+        emb = unet.time_embedding(unet.get_time_embed(sample=sample, timestep=timestep), timestep_cond)
+        if unet.time_embed_act is not None:
+            emb = unet.time_embed_act(emb)
+
+        attention = {"encoder_hidden_states": encoder_hidden_states, "cross_attention_kwargs": cross_attention_kwargs}
+
+        sample = unet.conv_in(sample)
+        first = unet.down_blocks[0]
+        if getattr(first, "has_cross_attention", False):
+            _, res_samples = first(hidden_states=sample, temb=emb, **attention)
+        else:
+            _, res_samples = first(hidden_states=sample, temb=emb)
+
+        # The last up block consumes the first skip connections
+        last = unet.up_blocks[-1]
+        res_samples = ((sample,) + res_samples)[:len(last.resnets)]
+        if down_block_additional_residuals is not None:
+            res_samples = tuple(r + c for r, c in zip(res_samples, down_block_additional_residuals))
+
+        if getattr(last, "has_cross_attention", False):
+            sample = last(hidden_states=self._deep, temb=emb, res_hidden_states_tuple=res_samples, **attention)
+        else:
+            sample = last(hidden_states=self._deep, temb=emb, res_hidden_states_tuple=res_samples)
+
+        if unet.conv_norm_out:
+            sample = unet.conv_act(unet.conv_norm_out(sample))
+        sample = unet.conv_out(sample)
+
+        if not return_dict:
+            return (sample,)
+        return UNet2DConditionOutput(sample=sample)
+
+
+def benchmark_feature_cache(runner, source_image_path, intervals=(1, 2, 3, 5), preset="fast", seed=0, **prompt_kwargs):
+    """
+    Runs the same generation with every cache interval and reports the
+    speed/quality tradeoff against the uncached (interval 1) output.
+
+    runner: StableDiffusionRunner built with feature_cache=True
+    Returns one dict per interval: interval, seconds, speedup, psnr,
+    cosine_similarity, full_steps, shallow_steps.
+    """
+    if runner.feature_cache is None:
+        raise ValueError("The runner was built without feature_cache=True.")
+
+    preset, config = runner._get_preset(preset)
+    presets = runner.PRESETS
+    prompt_kwargs.setdefault("mode", "generic")
+
+    def generate(interval):
+        runner.PRESETS = {**presets, preset: dict(config, cache_interval=interval)}
+        cache = runner.feature_cache
+        cache.full_steps = cache.shallow_steps = 0
+
+        start_time = time.time()
+        image, _ = runner.generate_styled_image(None, source_image_path, preset=preset, seed=seed, **prompt_kwargs)
+        return image, time.time() - start_time, cache.full_steps, cache.shallow_steps
+
+    try:
+        # Untimed run fills the latent / prompt caches, then the reference
+        generate(1)
+        results = {1: generate(1)}
+        for interval in intervals:
+            if interval not in results:
+                results[interval] = generate(interval)
+    finally:
+        runner.PRESETS = presets
+
+    reference, reference_time = results[1][:2]
+
+    rows = []
+    for interval in intervals:
+        image, seconds, full_steps, shallow_steps = results[interval]
+        metrics = compare_outputs(reference, image)
+        rows.append({
+            "interval": interval,
+            "seconds": seconds,
+            "speedup": reference_time / seconds,
+            "psnr": metrics["psnr"],
+            "cosine_similarity": metrics["cosine_similarity"],
+            "full_steps": full_steps,
+            "shallow_steps": shallow_steps
+        })
+        logger.info(
+            f"Feature cache interval {interval}: {seconds:.2f}s "
+            f"({rows[-1]['speedup']:.2f}x) | PSNR {metrics['psnr']:.2f} dB"
+        )
+
+    return rows
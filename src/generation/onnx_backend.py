@@ -0,0 +1,247 @@
+import os
+import logging
+
+import torch
+from diffusers.models.attention_processor import AttnProcessor
+
+from diffusers.models.autoencoders.vae import DecoderOutput
+from diffusers.models.unets.unet_2d_condition import UNet2DConditionOutput
+from diffusers.models.controlnets.controlnet import ControlNetOutput
+
+from src.optimizations import (
+    export_onnx,
+    OnnxRunner,
+    onnx_available,
+    versioned_cache_dir,
+    module_identity,
+    ONNX_OPSET
+)
+
+logger = logging.getLogger(__name__)
+
+
+# -------------------- Export Wrappers --------------------
+# Flat tensor-in / tensor-out signatures the ONNX exporter can trace.
+
+class _UNetExport(torch.nn.Module):
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep, encoder_hidden_states, *residuals):
+        return self.unet(
+            sample,
+            timestep,
+            encoder_hidden_states=encoder_hidden_states,
+            down_block_additional_residuals=residuals[:-1],
+            mid_block_additional_residual=residuals[-1],
+            return_dict=False
+        )[0]
+
+
+class _ControlNetExport(torch.nn.Module):
+    def __init__(self, controlnet):
+        super().__init__()
+        self.controlnet = controlnet
+
+    def forward(self, sample, timestep, encoder_hidden_states, controlnet_cond):
+        down, mid = self.controlnet(
+            sample,
+            timestep,
+            encoder_hidden_states=encoder_hidden_states,
+            controlnet_cond=controlnet_cond,
+            conditioning_scale=1.0,
+            return_dict=False
+        )
+        return (*down, mid)
+
+
+class _VaeDecoderExport(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latents):
+        return self.vae.decode(latents, return_dict=False)[0]
+
+
+class _TextEncoderExport(torch.nn.Module):
+    def __init__(self, text_encoder):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids):
+        return self.text_encoder(input_ids, return_dict=False)[0]
+
+
+def _batch_spatial(name):
+    return {0: "batch", 2: f"{name}_height", 3: f"{name}_width"}
+
+
+def _timestep(timestep):
+    return torch.as_tensor(timestep, dtype=torch.float32).reshape(-1)[:1]
+
+
+def _export_all(pipe, onnx_dir, resolution):
+    """
+    Exports text encoder, ControlNet, UNet and VAE decoder with dynamic
+    batch and spatial axes. Example inputs use the given resolution.
+    """
+    scale = pipe.vae_scale_factor
+    height, width = resolution[1] // scale, resolution[0] // scale
+
+    sample = torch.randn(2, pipe.unet.config.in_channels, height, width)
+    timestep = torch.tensor([10.0])
+    input_ids = torch.zeros(1, pipe.tokenizer.model_max_length, dtype=torch.long)
+    encoder_hidden_states = torch.randn(2, pipe.tokenizer.model_max_length, pipe.unet.config.cross_attention_dim)
+    controlnet_cond = torch.rand(2, 3, resolution[1], resolution[0])
+
+    export_onnx(
+        _TextEncoderExport(pipe.text_encoder),
+        (input_ids,),
+        os.path.join(onnx_dir, "text_encoder.onnx"),
+        input_names=["input_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={"input_ids": {0: "batch"}, "last_hidden_state": {0: "batch"}}
+    )
+
+    with torch.no_grad():
+        residuals = _ControlNetExport(pipe.controlnet)(sample, timestep, encoder_hidden_states, controlnet_cond)
+    residual_names = [f"down_{i}" for i in range(len(residuals) - 1)] + ["mid"]
+
+    export_onnx(
+        _ControlNetExport(pipe.controlnet),
+        (sample, timestep, encoder_hidden_states, controlnet_cond),
+        os.path.join(onnx_dir, "controlnet.onnx"),
+        input_names=["sample", "timestep", "encoder_hidden_states", "controlnet_cond"],
+        output_names=residual_names,
+        dynamic_axes={
+            "sample": _batch_spatial("sample"),
+            "encoder_hidden_states": {0: "batch"},
+            "controlnet_cond": _batch_spatial("cond"),
+            **{name: _batch_spatial(name) for name in residual_names}
+        }
+    )
+
+    export_onnx(
+        _UNetExport(pipe.unet),
+        (sample, timestep, encoder_hidden_states, *residuals),
+        os.path.join(onnx_dir, "unet.onnx"),
+        input_names=["sample", "timestep", "encoder_hidden_states"] + residual_names,
+        output_names=["noise_pred"],
+        dynamic_axes={
+            "sample": _batch_spatial("sample"),
+            "encoder_hidden_states": {0: "batch"},
+            "noise_pred": _batch_spatial("sample"),
+            **{name: _batch_spatial(name) for name in residual_names}
+        }
+    )
+
+    export_onnx(
+        _VaeDecoderExport(pipe.vae),
+        (sample[:1],),
+        os.path.join(onnx_dir, "vae_decoder.onnx"),
+        input_names=["latents"],
+        output_names=["image"],
+        dynamic_axes={"latents": _batch_spatial("latents"), "image": _batch_spatial("image")}
+    )
+
+
+def _install_sessions(pipe, onnx_dir, num_threads):
+    """
+    Routes the pipeline's module calls through onnxruntime sessions. The
+    torch modules stay in place so configs, dtypes and isinstance checks
+    inside diffusers keep working; only their forward/decode is replaced.
+    """
+    text_encoder = OnnxRunner(os.path.join(onnx_dir, "text_encoder.onnx"), num_threads)
+    controlnet = OnnxRunner(os.path.join(onnx_dir, "controlnet.onnx"), num_threads)
+    unet = OnnxRunner(os.path.join(onnx_dir, "unet.onnx"), num_threads)
+    vae_decoder = OnnxRunner(os.path.join(onnx_dir, "vae_decoder.onnx"), num_threads)
+
+    torch_controlnet_forward = pipe.controlnet.forward
+
+    def text_encoder_forward(input_ids, attention_mask=None, **kwargs):
+        return (text_encoder(input_ids.long())[0],)
+
+    def controlnet_forward(sample, timestep, encoder_hidden_states, controlnet_cond,
+                           conditioning_scale=1.0, guess_mode=False, return_dict=True, **kwargs):
+        if guess_mode:
+            # The exported graph bakes in the non-guess-mode residual scales
+            return torch_controlnet_forward(
+                sample, timestep, encoder_hidden_states, controlnet_cond,
+                conditioning_scale=conditioning_scale, guess_mode=guess_mode, return_dict=return_dict, **kwargs
+            )
+
+        outputs = controlnet(sample.float(), _timestep(timestep), encoder_hidden_states.float(), controlnet_cond.float())
+        outputs = [output * conditioning_scale for output in outputs]
+
+        down, mid = outputs[:-1], outputs[-1]
+        if not return_dict:
+            return down, mid
+        return ControlNetOutput(down_block_res_samples=down, mid_block_res_sample=mid)
+
+    def unet_forward(sample, timestep, encoder_hidden_states, down_block_additional_residuals=None,
+                     mid_block_additional_residual=None, return_dict=True, **kwargs):
+        residuals = [r.float() for r in down_block_additional_residuals] + [mid_block_additional_residual.float()]
+
+        noise_pred = unet(sample.float(), _timestep(timestep), encoder_hidden_states.float(), *residuals)[0]
+
+        if not return_dict:
+            return (noise_pred,)
+        return UNet2DConditionOutput(sample=noise_pred)
+
+    def vae_decode(z, return_dict=True, generator=None):
+        image = vae_decoder(z.float())[0]
+
+        if not return_dict:
+            return (image,)
+        return DecoderOutput(sample=image)
+
+    pipe.text_encoder.forward = text_encoder_forward
+    pipe.controlnet.forward = controlnet_forward
+    pipe.unet.forward = unet_forward
+    pipe.vae.decode = vae_decode
+
+
+def enable_onnx_backend(pipe, onnx_dir, resolution, num_threads=None):
+    """
+    Exports (once) and loads the SD text encoder, ControlNet, UNet and VAE
+    decoder as ONNX Runtime sessions. The VAE encoder stays on PyTorch.
+
+    Graphs are stored in a subfolder of onnx_dir keyed by the models, the
+    opset and the library versions.
+
+    Returns "onnx" on success, or "torch" when onnxruntime is missing or the
+    export fails, in which case the pipeline is left untouched.
+    """
+    if not onnx_available():
+        logger.warning("onnxruntime not installed. Falling back to PyTorch backend.")
+        return "torch"
+
+    onnx_dir = versioned_cache_dir(
+        onnx_dir,
+        *(module_identity(module) for module in (pipe.text_encoder, pipe.controlnet, pipe.unet, pipe.vae)),
+        ONNX_OPSET
+    )
+
+    # Sliced attention loops over a fixed batch size, export the plain processors
+    processors = {
+        module: module.attn_processors
+        for module in (pipe.unet, pipe.controlnet, pipe.vae)
+    }
+
+    try:
+        for module in processors:
+            module.set_attn_processor(AttnProcessor())
+
+        _export_all(pipe, onnx_dir, resolution)
+        _install_sessions(pipe, onnx_dir, num_threads)
+    except Exception as e:
+        logger.warning(f"ONNX backend unavailable ({e}). Falling back to PyTorch backend.")
+        return "torch"
+    finally:
+        for module, attn_processors in processors.items():
+            module.set_attn_processor(attn_processors)
+
+    logger.info(f"Stable Diffusion running on ONNX Runtime | Graphs: {onnx_dir}")
+    return "onnx"
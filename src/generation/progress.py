@@ -0,0 +1,83 @@
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Linear map from the 4 SD 1.x latent channels to RGB in [-1, 1]
+LATENT_RGB_FACTORS = torch.tensor([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177]
+])
+
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is aborted through its CancellationToken."""
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation flag, checked by the runner before and between
+    denoising steps. cancel() may be called from any thread.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled("Generation cancelled.")
+
+
+def latents_to_preview(latents, decoder=None):
+    """
+    Cheap RGB preview of the first latent in a batch, at latent resolution.
+
+    decoder: optional tiny VAE (e.g. diffusers AutoencoderTiny / TAESD) for a
+             sharper full-size preview; the linear projection is used otherwise
+    """
+    latents = latents[:1].detach().float()
+
+    if decoder is not None:
+        with torch.no_grad():
+            image = decoder.decode(latents.to(decoder.dtype)).sample[0].float().permute(1, 2, 0)
+    else:
+        image = latents[0].permute(1, 2, 0) @ LATENT_RGB_FACTORS
+
+    image = ((image + 1) / 2).clamp(0, 1)
+    return Image.fromarray((image.cpu().numpy() * 255).round().astype(np.uint8))
+
+
+def step_callback(callback=None, cancel_token=None, preview_every=1, decoder=None):
+    """
+    Builds a diffusers callback_on_step_end that checks the cancellation
+    token after every step and calls callback(step, num_steps, preview)
+    every preview_every steps. Returns None when there is nothing to do.
+    """
+    if callback is None and cancel_token is None:
+        return None
+
+    def on_step_end(pipe, index, timestep, callback_kwargs):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
+        step = index + 1
+        if callback is not None and (step % preview_every == 0 or step == pipe.num_timesteps):
+            callback(step, pipe.num_timesteps, latents_to_preview(callback_kwargs["latents"], decoder))
+
+            # The callback itself may have cancelled the job
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+
+        return callback_kwargs
+
+    return on_step_end
@@ -1,16 +1,40 @@
 import os
+import math
 import torch
 import logging
 import time
+import threading
 from PIL import Image
 from diffusers import (
     StableDiffusionControlNetImg2ImgPipeline,
     ControlNetModel,
-    UniPCMultistepScheduler
+    UniPCMultistepScheduler,
+    LCMScheduler
+)
+from diffusers.models.attention_processor import AttnProcessor2_0
+
+from src.cache import LRUCache, file_hash
+from src.optimizations import (
+    set_cpu_optimizations,
+    enable_channels_last,
+    quantize_dynamic_int8,
+    resolve_precision,
+    cpu_autocast,
+    apply_torch_compile,
+    enable_compile_cache,
+    available_memory,
+    attention_memory_estimate,
+    start_peak_rss_measurement,
+    finish_peak_rss_measurement,
+    versioned_cache_dir,
+    module_identity
 )
-
-from src.optimizations import set_cpu_optimizations, enable_channels_last
 from src.prompt.prompt_generator import PromptGenerator
+from src.generation.onnx_backend import enable_onnx_backend
+from src.generation.feature_cache import UNetFeatureCache
+from src.generation.token_merging import TokenMerging
+from src.generation.tiled_diffusion import TiledDiffusion
+from src.generation.progress import step_callback
 
 
 # -------------------- Logging --------------------
@@ -28,62 +52,324 @@ class StableDiffusionRunner:
             "resolution": (512, 512),
             "steps": 20,
             "guidance_scale": 7.5,
-            "controlnet_type": "depth"
+            "controlnet_type": "depth",
+            "cache_interval": 3,
+            "token_merge_ratio": 0.3
         },
         "balanced": {
             "resolution": (768, 768),
             "steps": 25,
             "guidance_scale": 7.5,
-            "controlnet_type": "depth"
+            "controlnet_type": "depth",
+            "cache_interval": 3,
+            "token_merge_ratio": 0.5
         },
         "quality": {
-            # Safer CPU max resolution
+            # Largest resolution denoised in one piece (see tile_size)
             "resolution": (768, 768),
             "steps": 40,
             "guidance_scale": 8.0,
-            "controlnet_type": "depth"
+            "controlnet_type": "depth",
+            "cache_interval": 4,
+            "token_merge_ratio": 0.4
+        },
+        "hires": {
+            # Tiled VAE and UNet/ControlNet, memory bounded by the tile size
+            "resolution": (1536, 1536),
+            "steps": 25,
+            "guidance_scale": 7.5,
+            "controlnet_type": "depth",
+            "token_merge_ratio": 0.5
+        },
+        "turbo": {
+            # Latent consistency (LCM-LoRA): a few steps, no classifier-free guidance
+            "resolution": (512, 512),
+            "steps": 6,
+            "guidance_scale": 1.0,
+            "controlnet_type": "depth",
+            "scheduler": "lcm",
+            "adapter": "lcm"
+        },
+        "preview": {
+            # Interactive preview tier, 2 denoising steps at strength 0.7
+            "resolution": (384, 384),
+            "steps": 3,
+            "guidance_scale": 1.0,
+            "controlnet_type": "depth",
+            "scheduler": "lcm",
+            "adapter": "lcm"
         }
     }
 
+    SCHEDULERS = {
+        "unipc": UniPCMultistepScheduler,
+        "lcm": LCMScheduler
+    }
+
+    # LoRA adapters presets can switch on, loaded on first use
+    ADAPTERS = {
+        "lcm": "latent-consistency/lcm-lora-sdv1-5"
+    }
+
     def __init__(
         self,
         model_id="runwayml/stable-diffusion-v1-5",
-        controlnet_id="lllyasviel/sd-controlnet-depth"
+        controlnet_id="lllyasviel/sd-controlnet-depth",
+        pipe=None,
+        cache_mb=512,
+        backend="torch",
+        onnx_dir="onnx/sd",
+        quantize=False,
+        quantized_dir="quantized/sd",
+        precision="fp32",
+        torch_compile=False,
+        compile_cache_dir="compile_cache/sd",
+        warmup_presets=("fast",),
+        adapters=None,
+        feature_cache=False,
+        attention="auto",
+        token_merging=False,
+        preview_decoder=None,
+        tile_size=768,
+        tile_overlap=128
     ):
+        """
+        pipe: already-built StableDiffusionControlNetImg2ImgPipeline
+              (skips loading model_id / controlnet_id)
+        cache_mb: LRU budget for prompt embeddings, VAE latents and control images
+        backend: "torch" or "onnx" (ONNX Runtime CPU, falls back to torch)
+        onnx_dir: where exported ONNX graphs are stored and reused
+        quantize: dynamic int8 quantization of the UNet/ControlNet linear layers
+        quantized_dir: where quantized weights are cached (one subfolder per
+                       model weights and library versions)
+        precision: "fp32", "bf16" or "auto"; bf16 runs UNet, ControlNet and VAE
+                   under CPU autocast on AVX512-BF16/AMX CPUs
+        torch_compile: compile UNet, ControlNet and VAE decoder and warm them up
+        compile_cache_dir: persistent inductor/FX graph cache for restarted workers
+        warmup_presets: presets whose resolution is compiled at startup
+        adapters: LoRA adapter name -> repo id or path, overrides ADAPTERS
+                  (e.g. {"lcm": "latent-consistency/lcm-lora-sdxl"} for other bases)
+        feature_cache: reuse deep UNet features and ControlNet residuals across
+                       steps, recomputed every preset "cache_interval" steps
+        attention: "sdpa" (PyTorch scaled_dot_product_attention), "sliced"
+                   (attention slicing, lower peak memory but slower on CPU) or
+                   "auto" (SDPA when the largest preset's attention fits in memory)
+        token_merging: ToMe token merging in the full-resolution UNet
+                       self-attention, merging the preset "token_merge_ratio"
+        preview_decoder: optional tiny VAE (AutoencoderTiny) for step previews,
+                         a linear latent-to-RGB projection is used otherwise
+        tile_size: largest image side run in one piece; larger images are
+                   VAE-encoded/decoded and denoised in overlapping tiles of
+                   this size (None disables tiling)
+        tile_overlap: overlap between neighbouring tiles, in image pixels
+        """
         self.device = "cpu"
         set_cpu_optimizations()
 
-        logger.info(f"Loading ControlNet: {controlnet_id}")
-        self.controlnet = ControlNetModel.from_pretrained(
-            controlnet_id,
-            torch_dtype=torch.float32
-        ).to(self.device)
-
-        logger.info(f"Loading Stable Diffusion Pipeline: {model_id}")
-        self.pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(
-            model_id,
-            controlnet=self.controlnet,
-            torch_dtype=torch.float32,
-            safety_checker=None
-        ).to(self.device)
-
-        self.pipe.scheduler = UniPCMultistepScheduler.from_config(
-            self.pipe.scheduler.config
-        )
+        if pipe is not None:
+            self.controlnet = pipe.controlnet
+            self.pipe = pipe.to(self.device)
+        else:
+            logger.info(f"Loading ControlNet: {controlnet_id}")
+            self.controlnet = ControlNetModel.from_pretrained(
+                controlnet_id,
+                torch_dtype=torch.float32
+            ).to(self.device)
+
+            logger.info(f"Loading Stable Diffusion Pipeline: {model_id}")
+            self.pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(
+                model_id,
+                controlnet=self.controlnet,
+                torch_dtype=torch.float32,
+                safety_checker=None
+            ).to(self.device)
+
+        # Schedulers are built once from the base config and swapped per preset
+        self._scheduler_config = self.pipe.scheduler.config
+        self._schedulers = {}
+        self._set_scheduler("unipc")
+
+        self.adapters = {**self.ADAPTERS, **(adapters or {})}
+        self._loaded_adapters = set()
+        self._unavailable_adapters = set()
+        self._active_adapter = None
 
         # CPU optimizations
         self.pipe.unet = enable_channels_last(self.pipe.unet)
         self.pipe.vae = enable_channels_last(self.pipe.vae)
-        self.pipe.enable_attention_slicing()
+        self.tile_size = tile_size
+        self.attention = self._configure_attention(attention)
+
+        self.backend = "torch"
+        if backend == "onnx":
+            self.backend = enable_onnx_backend(
+                self.pipe,
+                onnx_dir,
+                self.PRESETS["fast"]["resolution"]
+            )
 
+        self.quantized = False
+        if quantize:
+            if self.backend != "torch":
+                logger.warning("int8 quantization only applies to the torch backend. Skipping.")
+            else:
+                self.pipe.unet = quantize_dynamic_int8(
+                    self.pipe.unet,
+                    os.path.join(
+                        versioned_cache_dir(quantized_dir, module_identity(self.pipe.unet)),
+                        "unet_int8.pt"
+                    )
+                )
+                self.pipe.controlnet = quantize_dynamic_int8(
+                    self.pipe.controlnet,
+                    os.path.join(
+                        versioned_cache_dir(quantized_dir, module_identity(self.pipe.controlnet)),
+                        "controlnet_int8.pt"
+                    )
+                )
+                self.controlnet = self.pipe.controlnet
+                self.quantized = True
+                logger.info("Applied dynamic int8 quantization to UNet and ControlNet.")
+
+        self.token_merging = None
+        if token_merging:
+            if self.backend != "torch":
+                logger.warning("Token merging needs the torch backend. Skipping.")
+            else:
+                self.token_merging = TokenMerging(self.pipe.unet)
+
+        if precision != "fp32" and (self.backend != "torch" or quantize):
+            logger.warning("bf16 autocast needs the unquantized torch backend. Using fp32.")
+            precision = "fp32"
+        self.precision = resolve_precision(precision)
+
+        self.compiled = False
+        if torch_compile:
+            if self.backend != "torch" or quantize:
+                logger.warning("torch.compile needs the unquantized torch backend. Skipping.")
+            else:
+                enable_compile_cache(compile_cache_dir)
+                self.pipe.unet = apply_torch_compile(self.pipe.unet)
+                self.pipe.controlnet = apply_torch_compile(self.pipe.controlnet)
+                self.pipe.vae.decoder = apply_torch_compile(self.pipe.vae.decoder)
+                self.controlnet = self.pipe.controlnet
+                self.compiled = True
+
+        self.feature_cache = None
+        if feature_cache:
+            if self.backend != "torch" or self.compiled:
+                logger.warning("Feature caching needs the eager torch backend. Skipping.")
+            else:
+                self.feature_cache = UNetFeatureCache(self.pipe.unet, self.pipe.controlnet)
+
+        self.tiling = None
+        if tile_size:
+            if self.backend != "torch" or self.compiled:
+                logger.warning("Tiled generation needs the eager torch backend. Skipping.")
+                self.tile_size = None
+            else:
+                self._enable_tiling(tile_size, tile_overlap)
+
+        self.preview_decoder = preview_decoder
+        self.last_peak_rss = None
         self.prompt_gen = PromptGenerator()
 
-        logger.info("StableDiffusionRunner initialized successfully on CPU.")
+        # Content-addressed cache of everything reused across generations
+        self.cache = LRUCache(cache_mb * 1024 * 1024, name="Generation cache")
 
+        # The pipeline is not thread-safe, serialize calls sharing self.pipe
+        self._lock = threading.Lock()
 
-    def _load_control_image(self, source_image_path, resolution, control_type):
+        if self.compiled:
+            self.warmup(warmup_presets)
+
+        logger.info(
+            f"StableDiffusionRunner initialized successfully on CPU "
+            f"({self.backend} backend, {self.precision})."
+        )
+
+    def _configure_attention(self, attention):
         """
-        Loads control image depending on preset type.
+        Picks SDPA or sliced attention for the UNet and ControlNet.
+        """
+        if attention not in ("auto", "sdpa", "sliced"):
+            raise ValueError(f"Unknown attention mode '{attention}', expected 'auto', 'sdpa' or 'sliced'.")
+
+        if attention == "auto":
+            # Tiled presets only ever attend over one tile
+            largest = max(
+                (tuple(min(side, self.tile_size or side) for side in c["resolution"]) for c in self.PRESETS.values()),
+                key=lambda resolution: resolution[0] * resolution[1]
+            )
+            heads = self.pipe.unet.config.attention_head_dim
+            heads = max(heads) if isinstance(heads, (list, tuple)) else heads
+
+            needed = attention_memory_estimate(largest, heads)
+            available = available_memory()
+            attention = "sdpa" if available is not None and needed < available / 2 else "sliced"
+
+        if attention == "sdpa":
+            self.pipe.unet.set_attn_processor(AttnProcessor2_0())
+            self.pipe.controlnet.set_attn_processor(AttnProcessor2_0())
+        else:
+            self.pipe.enable_attention_slicing()
+
+        logger.info(f"Attention: {attention}")
+        return attention
+
+    def _enable_tiling(self, tile_size, tile_overlap):
+        """
+        Tiled VAE encode/decode (diffusers' overlap-blended tiling) and tiled
+        UNet/ControlNet denoising for images larger than tile_size.
+        """
+        if not 0 <= tile_overlap < tile_size // 2:
+            raise ValueError(
+                f"tile_overlap must be below half the tile size, got {tile_overlap} for {tile_size}px tiles."
+            )
+
+        scale = self.pipe.vae_scale_factor
+
+        vae = self.pipe.vae
+        vae.enable_tiling()
+        vae.tile_sample_min_size = tile_size
+        vae.tile_latent_min_size = tile_size // scale
+        vae.tile_overlap_factor = tile_overlap / tile_size
+
+        self.tiling = TiledDiffusion(self.pipe.unet, self.pipe.controlnet, tile_size // scale, tile_overlap // scale)
+        logger.info(f"Tiling above {tile_size}px ({tile_overlap}px overlap)")
+
+    def _is_tiled(self, config):
+        return self.tiling is not None and max(config["resolution"]) > self.tile_size
+
+    def warmup(self, presets=("fast",)):
+        """
+        Runs a short dummy generation per preset so compiled graphs for its
+        resolution are built (or loaded from the compile cache) at startup
+        rather than on the first user request.
+        """
+        for preset in presets:
+            preset, config = self._get_preset(preset)
+            start_time = time.time()
+
+            image = Image.new("RGB", config["resolution"], (127, 127, 127))
+
+            with self._lock, torch.no_grad(), cpu_autocast(self.precision):
+                self._use_preset(config)
+                self.pipe(
+                    prompt="",
+                    image=image,
+                    control_image=image,
+                    num_inference_steps=2,
+                    guidance_scale=config["guidance_scale"],
+                    strength=1.0,
+                )
+
+            logger.info(f"Warmup for preset '{preset}' done in {time.time() - start_time:.2f}s")
+
+
+    def _control_image_path(self, source_image_path, control_type):
+        """
+        Picks the control image file depending on preset type.
         """
         base_name = os.path.splitext(source_image_path)[0]
 
@@ -92,13 +378,169 @@ class StableDiffusionRunner:
 
             if os.path.exists(depth_path):
                 logger.info(f"Using depth map: {depth_path}")
-                return Image.open(depth_path).convert("RGB").resize(resolution)
+                return depth_path
 
             logger.warning("Depth map not found. Falling back to source image.")
 
         # Fallback
-        return Image.open(source_image_path).convert("RGB").resize(resolution)
+        return source_image_path
+
+    def _load_control_image(self, source_image_path, resolution, control_type):
+        """
+        Loads control image depending on preset type.
+        """
+        control_path = self._control_image_path(source_image_path, control_type)
+        return Image.open(control_path).convert("RGB").resize(resolution)
+
+    # -------------------- Cached Conditioning --------------------
+
+    def _get_control_image(self, source_image_path, resolution, control_type):
+        """
+        Preprocessed control tensor, cached by file content + resolution.
+        """
+        control_path = self._control_image_path(source_image_path, control_type)
+        key = ("control", file_hash(control_path), tuple(resolution))
+
+        control = self.cache.get(key)
+        if control is None:
+            image = Image.open(control_path).convert("RGB").resize(resolution)
+            control = self.pipe.control_image_processor.preprocess(
+                image, height=resolution[1], width=resolution[0]
+            ).to(dtype=torch.float32)
+            self.cache.put(key, control)
+
+        return control
+
+    def _get_init_latents(self, source_image_path, resolution):
+        """
+        VAE init latents, cached by file content + resolution.
+        """
+        key = ("latents", file_hash(source_image_path), tuple(resolution))
 
+        latents = self.cache.get(key)
+        if latents is None:
+            init_image = Image.open(source_image_path).convert("RGB").resize(resolution)
+            latents = self._encode_init_latents(init_image)
+            self.cache.put(key, latents)
+
+        return latents
+
+    def _get_prompt_embeds(self, prompts, guidance_scale):
+        """
+        CLIP embeddings for a list of prompts (plus the empty negative prompt
+        when classifier-free guidance is on), cached by prompt text.
+        """
+        def encode(text):
+            key = ("prompt", text)
+            embeds = self.cache.get(key)
+            if embeds is None:
+                with torch.no_grad():
+                    embeds = self.pipe.encode_prompt(text, self.device, 1, False)[0]
+                self.cache.put(key, embeds)
+            return embeds
+
+        prompt_embeds = torch.cat([encode(p) for p in prompts])
+
+        negative_prompt_embeds = None
+        if guidance_scale > 1:
+            negative_prompt_embeds = encode("").repeat(len(prompts), 1, 1)
+
+        return prompt_embeds, negative_prompt_embeds
+
+
+    def _get_preset(self, preset):
+        preset = preset.lower()
+        config = self.PRESETS.get(preset, self.PRESETS["fast"])
+
+        if preset in ("quality", "hires") and self.device == "cpu":
+            logger.warning("High preset selected. CPU generation may be slow.")
+
+        return preset, config
+
+    # -------------------- Schedulers & Adapters --------------------
+
+    def _set_scheduler(self, name):
+        scheduler = self._schedulers.get(name)
+        if scheduler is None:
+            scheduler = self.SCHEDULERS[name].from_config(self._scheduler_config)
+            self._schedulers[name] = scheduler
+        self.pipe.scheduler = scheduler
+
+    def _load_adapter(self, name):
+        """
+        Loads a LoRA adapter into the pipeline once. Returns False (and
+        never retries) when it cannot be used.
+        """
+        if name in self._unavailable_adapters:
+            return False
+
+        if self.backend != "torch" or self.quantized or self.compiled:
+            logger.warning(f"LoRA adapter '{name}' needs the eager, unquantized torch backend. Skipping.")
+            self._unavailable_adapters.add(name)
+            return False
+
+        try:
+            start_time = time.time()
+            self.pipe.load_lora_weights(self.adapters[name], adapter_name=name)
+        except Exception as e:
+            logger.warning(f"Could not load LoRA adapter '{name}' ({e}). Using base weights.")
+            self._unavailable_adapters.add(name)
+            return False
+
+        self._loaded_adapters.add(name)
+        logger.info(f"Loaded LoRA adapter '{name}' in {time.time() - start_time:.2f}s")
+        return True
+
+    def _set_adapter(self, name):
+        """
+        Activates a LoRA adapter (None: base weights only). Adapters stay
+        loaded and are only toggled, the base pipeline is never reloaded.
+        """
+        if name is not None and name not in self._loaded_adapters and not self._load_adapter(name):
+            name = None
+
+        if name == self._active_adapter:
+            return
+
+        if name is None:
+            self.pipe.disable_lora()
+        else:
+            self.pipe.enable_lora()
+            self.pipe.set_adapters([name])
+
+        self._active_adapter = name
+
+    def _use_preset(self, config):
+        """
+        Hot-swaps the scheduler and adapter a preset needs and resets the
+        feature cache.
+        Call with self._lock held, the pipeline is shared.
+        """
+        self._set_scheduler(config.get("scheduler", "unipc"))
+        self._set_adapter(config.get("adapter"))
+
+        if self.feature_cache is not None:
+            # Cached deep features would span tiles, tiled presets run uncached
+            self.feature_cache.reset(1 if self._is_tiled(config) else config.get("cache_interval", 1))
+        if self.token_merging is not None:
+            self.token_merging.ratio = config.get("token_merge_ratio", 0.0)
+
+    def _encode_init_latents(self, init_image):
+        """
+        VAE-encodes the init image once, scaled like the pipeline's own
+        prepare_latents() so it can be passed straight back as `image`.
+        """
+        image = self.pipe.image_processor.preprocess(init_image).to(self.device, dtype=self.pipe.vae.dtype)
+
+        with torch.no_grad(), cpu_autocast(self.precision):
+            latents = self.pipe.vae.encode(image).latent_dist.mode()
+
+        return latents * self.pipe.vae.config.scaling_factor
+
+    def _peak_rss_message(self):
+        if self.last_peak_rss is None:
+            return ""
+        return f" | Peak RSS: {self.last_peak_rss / 2 ** 20:.0f} MB"
 
     def generate_styled_image(
         self,
@@ -106,22 +548,33 @@ class StableDiffusionRunner:
         source_image_path,
         preset="fast",
         mode="auto_design",
+        seed=None,
+        callback=None,
+        preview_every=1,
+        cancel_token=None,
         **kwargs
     ):
+        """
+        callback: called as callback(step, num_steps, preview) after denoising
+                  steps, preview being a cheap PIL image of the current latents
+        preview_every: call callback every this many steps (and on the last one)
+        cancel_token: CancellationToken checked before and between steps;
+                      raises GenerationCancelled once cancelled
+        """
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
         start_time = time.time()
+        peak_rss_token = start_peak_rss_measurement()
 
         # -------- 1. Preset Config --------
-        preset = preset.lower()
-        config = self.PRESETS.get(preset, self.PRESETS["fast"])
+        preset, config = self._get_preset(preset)
 
         resolution = config["resolution"]
         steps = config["steps"]
         guidance_scale = config["guidance_scale"]
         control_type = config["controlnet_type"]
 
-        if preset == "quality" and self.device == "cpu":
-            logger.warning("High preset selected. CPU generation may be slow.")
-
         # -------- 2. Prompt Generation --------
         prompt = self.prompt_gen.get_prompt(
             mode,
@@ -133,26 +586,37 @@ class StableDiffusionRunner:
         logger.info(f"Final Prompt: {prompt}")
 
         # -------- 3. Image Preparation --------
-        init_image = Image.open(source_image_path).convert("RGB").resize(resolution)
-        control_image = self._load_control_image(
+        init_latents = self._get_init_latents(source_image_path, resolution)
+        control_image = self._get_control_image(
             source_image_path,
             resolution,
             control_type
         )
+        prompt_embeds, negative_prompt_embeds = self._get_prompt_embeds([prompt], guidance_scale)
+
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=self.device).manual_seed(seed)
 
         logger.info(
             f"Generation Start | Preset: {preset} | Res: {resolution} | Steps: {steps}"
         )
 
         # -------- 4. Inference --------
-        with torch.no_grad():
+        with self._lock, torch.no_grad(), cpu_autocast(self.precision):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            self._use_preset(config)
             result = self.pipe(
-                prompt=prompt,
-                image=init_image,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                image=init_latents,
                 control_image=control_image,
                 num_inference_steps=steps,
                 guidance_scale=guidance_scale,
                 strength=0.7,
+                generator=generator,
+                callback_on_step_end=step_callback(callback, cancel_token, preview_every, self.preview_decoder),
             )
 
         output_image = result.images[0]
@@ -167,15 +631,190 @@ class StableDiffusionRunner:
         output_image.save(output_path)
 
         total_time = time.time() - start_time
-        logger.info(f"Generation completed in {total_time:.2f}s")
+        self.last_peak_rss = finish_peak_rss_measurement(peak_rss_token)
+        logger.info(f"Generation completed in {total_time:.2f}s{self._peak_rss_message()}")
         logger.info(f"Saved to: {output_path}")
 
         return output_image, output_path
 
+    def style_image(
+        self,
+        image,
+        prompt,
+        preset="fast",
+        init_image=None,
+        strength=0.7,
+        steps=None,
+        seed=None,
+        callback=None,
+        preview_every=1,
+        cancel_token=None
+    ):
+        """
+        In-memory counterpart of generate_styled_image(), used for video frames.
+
+        image: PIL image giving the structure (ControlNet input and default init image)
+        prompt: final prompt text
+        init_image: optional PIL image to denoise from (e.g. the previous styled frame)
+        strength: img2img strength
+        steps: denoising steps actually run (default: the preset's steps * strength);
+               num_inference_steps is scaled up so low strengths still run `steps`
+        callback / preview_every / cancel_token: see generate_styled_image()
+
+        Returns a PIL image at the preset resolution. Nothing is written to disk.
+        """
+        preset, config = self._get_preset(preset)
+        resolution = config["resolution"]
+        guidance_scale = config["guidance_scale"]
+
+        image = image.convert("RGB").resize(resolution)
+        init_image = image if init_image is None else init_image.convert("RGB").resize(resolution)
+
+        num_inference_steps = config["steps"]
+        if steps is not None:
+            num_inference_steps = max(steps, math.ceil(steps / strength))
+
+        control_image = self.pipe.control_image_processor.preprocess(
+            image, height=resolution[1], width=resolution[0]
+        ).to(dtype=torch.float32)
+        prompt_embeds, negative_prompt_embeds = self._get_prompt_embeds([prompt], guidance_scale)
+
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=self.device).manual_seed(seed)
+
+        with self._lock, torch.no_grad(), cpu_autocast(self.precision):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            self._use_preset(config)
+            result = self.pipe(
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                image=self._encode_init_latents(init_image),
+                control_image=control_image,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                strength=strength,
+                generator=generator,
+                callback_on_step_end=step_callback(callback, cancel_token, preview_every, self.preview_decoder),
+            )
+
+        return result.images[0]
+
+    def generate_variants(
+        self,
+        scene_json_path,
+        source_image_path,
+        variants=("modern", "minimal", "luxury"),
+        preset="fast",
+        mode="generic",
+        seeds=None,
+        output_paths=None,
+        callback=None,
+        preview_every=1,
+        cancel_token=None,
+        **kwargs
+    ):
+        """
+        Generates several variants of the same room in a single batched
+        pipeline call. The init latents and control image are prepared once
+        and shared by every variant.
+
+        variants: styles (generic mode) or dicts of prompt kwargs per variant
+        seeds: optional per-variant seeds
+        output_paths: optional per-variant output paths
+        callback / preview_every / cancel_token: see generate_styled_image(),
+            previews show the first variant
+        """
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
+        start_time = time.time()
+        peak_rss_token = start_peak_rss_measurement()
+
+        preset, config = self._get_preset(preset)
+        resolution = config["resolution"]
+
+        variants = [
+            v if isinstance(v, dict) else {"style": v}
+            for v in variants
+        ]
+        n = len(variants)
+
+        if seeds is not None and len(seeds) != n:
+            raise ValueError(f"Expected {n} seeds, got {len(seeds)}.")
+        if output_paths is not None and len(output_paths) != n:
+            raise ValueError(f"Expected {n} output paths, got {len(output_paths)}.")
+
+        # -------- Prompts --------
+        prompts = [
+            self.prompt_gen.get_prompt(
+                mode,
+                scene_json_path=scene_json_path,
+                **{**kwargs, **variant}
+            )
+            for variant in variants
+        ]
+
+        # -------- Shared Conditioning --------
+        init_latents = self._get_init_latents(source_image_path, resolution)
+        control_image = self._get_control_image(
+            source_image_path,
+            resolution,
+            config["controlnet_type"]
+        )
+        prompt_embeds, negative_prompt_embeds = self._get_prompt_embeds(prompts, config["guidance_scale"])
+
+        generator = None
+        if seeds is not None:
+            generator = [torch.Generator(device=self.device).manual_seed(seed) for seed in seeds]
+
+        logger.info(
+            f"Variant Generation Start | Preset: {preset} | Variants: {n} | "
+            f"Res: {resolution} | Steps: {config['steps']}"
+        )
+
+        with self._lock, torch.no_grad(), cpu_autocast(self.precision):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            self._use_preset(config)
+            result = self.pipe(
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                image=init_latents.repeat(n, 1, 1, 1),
+                control_image=control_image,
+                num_inference_steps=config["steps"],
+                guidance_scale=config["guidance_scale"],
+                strength=0.7,
+                generator=generator,
+                callback_on_step_end=step_callback(callback, cancel_token, preview_every, self.preview_decoder),
+            )
+
+        # -------- Save Outputs --------
+        if output_paths is None:
+            output_dir = "outputs"
+            filename = os.path.basename(source_image_path).split(".")[0]
+            output_paths = [
+                os.path.join(output_dir, f"{filename}_{variant.get('style', i + 1)}_styled.png")
+                for i, variant in enumerate(variants)
+            ]
+
+        for output_image, output_path in zip(result.images, output_paths):
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            output_image.save(output_path)
+            logger.info(f"Saved to: {output_path}")
+
+        total_time = time.time() - start_time
+        self.last_peak_rss = finish_peak_rss_measurement(peak_rss_token)
+        logger.info(f"Generated {n} variants in {total_time:.2f}s{self._peak_rss_message()}")
+
+        return list(zip(result.images, output_paths))
+
 
 # -------------------- Singleton Wrapper --------------------
 
 _runner_instance = None
+_runner_lock = threading.Lock()
 
 
 def generate_styled_image(
@@ -187,11 +826,13 @@ def generate_styled_image(
     """
     Integration-ready optimized wrapper.
     Prevents model reload on every call.
+    For parallel generation use GenerationWorkerPool instead.
     """
     global _runner_instance
 
-    if _runner_instance is None:
-        _runner_instance = StableDiffusionRunner()
+    with _runner_lock:
+        if _runner_instance is None:
+            _runner_instance = StableDiffusionRunner()
 
     return _runner_instance.generate_styled_image(
         scene_json_path,
@@ -0,0 +1,205 @@
+import logging
+
+import torch
+from diffusers.models.controlnets.controlnet import ControlNetOutput
+from diffusers.models.unets.unet_2d_condition import UNet2DConditionOutput
+
+logger = logging.getLogger(__name__)
+
+
+def tile_spans(size, tile, overlap, align=1):
+    """
+    (start, end) spans of overlapping tiles covering [0, size). Starts are
+    multiples of align; the last tile is flush with the end.
+    size, tile: multiples of align
+    """
+    if size <= tile:
+        return [(0, size)]
+
+    stride = max(align, (tile - overlap) // align * align)
+    starts = list(range(0, size - tile, stride)) + [size - tile]
+    return [(start, start + tile) for start in starts]
+
+
+def blend_weights(height, width, overlap):
+    """
+    (height, width) weights ramping up over `overlap` pixels from each tile
+    edge, so overlapping tiles cross-fade instead of leaving seams.
+    """
+    def ramp(size):
+        position = torch.arange(size)
+        distance = torch.minimum(position, position.flip(0)) + 1
+        return distance.clamp(max=overlap + 1).float() / (overlap + 1)
+
+    return ramp(height)[:, None] * ramp(width)[None, :]
+
+
+class _TileBlender:
+    """
+    Weighted accumulation of per-tile outputs into full-size tensors, one
+    per output index. Outputs of deeper UNet levels are placed at their own
+    (downsampled) resolution.
+    """
+
+    def __init__(self, height, width, overlap):
+        self.height = height
+        self.width = width
+        self.overlap = overlap
+        self._outputs = {}
+        self._weights = {}
+
+    def add(self, index, tile, box):
+        y0, y1, x0, x1 = box
+        scale = (y1 - y0) // tile.shape[-2]
+
+        if index not in self._outputs:
+            size = (self.height // scale, self.width // scale)
+            self._outputs[index] = tile.new_zeros(*tile.shape[:-2], *size)
+            self._weights[index] = tile.new_zeros(size)
+
+        weights = blend_weights(tile.shape[-2], tile.shape[-1], self.overlap // scale).to(tile)
+        region = (..., slice(y0 // scale, y1 // scale), slice(x0 // scale, x1 // scale))
+        self._outputs[index][region] += tile * weights
+        self._weights[index][region] += weights
+
+    def result(self, index):
+        return self._outputs[index] / self._weights[index]
+
+
+class TiledDiffusion:
+    """
+    MultiDiffusion-style tiled denoising for a UNet + ControlNet pair.
+
+    Latents larger than tile_size are split into overlapping tiles; the
+    ControlNet and the UNet run on one tile at a time (with the matching
+    slice of the control image and of every ControlNet residual) and the
+    outputs are cross-faded back together at every step. Peak activation
+    memory, which attention makes grow quadratically with the tile, is
+    bounded by the tile size instead of the output size. Smaller latents
+    go through untouched.
+    """
+
+    def __init__(self, unet, controlnet=None, tile_size=96, overlap=16):
+        """
+        unet: UNet2DConditionModel
+        controlnet: ControlNetModel called once per step before the UNet
+        tile_size: tile side in latent pixels
+        overlap: overlap between neighbouring tiles in latent pixels
+        """
+        # Tiles must line up with every downsampled UNet level
+        self.align = 2 ** sum(1 for block in unet.down_blocks if getattr(block, "downsamplers", None))
+        self.tile_size = max(self.align, tile_size // self.align * self.align)
+        self.overlap = overlap
+
+        self.unet = unet
+        self.controlnet = controlnet
+        self.tiled_calls = 0
+        self._misaligned = set()
+
+        self._unet_forward = unet.forward
+        unet.forward = self._forward_unet
+
+        if controlnet is not None:
+            self._controlnet_forward = controlnet.forward
+            controlnet.forward = self._forward_controlnet
+
+    def tiles(self, height, width):
+        """
+        (y0, y1, x0, x1) latent boxes for a height x width latent, or None
+        when it fits in one tile (or cannot be split on the UNet grid).
+        """
+        if height <= self.tile_size and width <= self.tile_size:
+            return None
+
+        if height % self.align or width % self.align:
+            if (height, width) not in self._misaligned:
+                self._misaligned.add((height, width))
+                logger.warning(
+                    f"Latent size {height}x{width} is not a multiple of {self.align}, running untiled."
+                )
+            return None
+
+        return [
+            (y0, y1, x0, x1)
+            for y0, y1 in tile_spans(height, self.tile_size, self.overlap, self.align)
+            for x0, x1 in tile_spans(width, self.tile_size, self.overlap, self.align)
+        ]
+
+    def _forward_controlnet(self, sample, timestep, encoder_hidden_states=None, controlnet_cond=None, *args,
+                            return_dict=True, **kwargs):
+        height, width = sample.shape[-2:]
+        tiles = self.tiles(height, width)
+        if tiles is None:
+            return self._controlnet_forward(
+                sample, timestep, encoder_hidden_states, controlnet_cond, *args, return_dict=return_dict, **kwargs
+            )
+
+        scale = controlnet_cond.shape[-1] // width
+        blender = _TileBlender(height, width, self.overlap)
+
+        for box in tiles:
+            y0, y1, x0, x1 = box
+            down, mid = self._controlnet_forward(
+                sample[..., y0:y1, x0:x1],
+                timestep,
+                encoder_hidden_states,
+                controlnet_cond[..., y0 * scale:y1 * scale, x0 * scale:x1 * scale],
+                *args,
+                return_dict=False,
+                **kwargs
+            )
+            for index, residual in enumerate(down):
+                blender.add(index, residual, box)
+            blender.add("mid", mid, box)
+
+        down = tuple(blender.result(index) for index in range(len(down)))
+        mid = blender.result("mid")
+
+        if not return_dict:
+            return down, mid
+        return ControlNetOutput(down_block_res_samples=down, mid_block_res_sample=mid)
+
+    def _forward_unet(self, sample, timestep, encoder_hidden_states=None, *args,
+                      down_block_additional_residuals=None, mid_block_additional_residual=None,
+                      return_dict=True, **kwargs):
+        height, width = sample.shape[-2:]
+        tiles = self.tiles(height, width)
+        if tiles is None:
+            return self._unet_forward(
+                sample, timestep, encoder_hidden_states, *args,
+                down_block_additional_residuals=down_block_additional_residuals,
+                mid_block_additional_residual=mid_block_additional_residual,
+                return_dict=return_dict,
+                **kwargs
+            )
+
+        def crop(residual, box):
+            if residual is None:
+                return None
+            y0, y1, x0, x1 = box
+            scale = height // residual.shape[-2]
+            return residual[..., y0 // scale:y1 // scale, x0 // scale:x1 // scale]
+
+        self.tiled_calls += 1
+        blender = _TileBlender(height, width, self.overlap)
+
+        for box in tiles:
+            y0, y1, x0, x1 = box
+            down = None
+            if down_block_additional_residuals is not None:
+                down = tuple(crop(residual, box) for residual in down_block_additional_residuals)
+
+            noise = self._unet_forward(
+                sample[..., y0:y1, x0:x1], timestep, encoder_hidden_states, *args,
+                down_block_additional_residuals=down,
+                mid_block_additional_residual=crop(mid_block_additional_residual, box),
+                return_dict=False,
+                **kwargs
+            )[0]
+            blender.add(0, noise, box)
+
+        sample = blender.result(0)
+
+        if not return_dict:
+            return (sample,)
+        return UNet2DConditionOutput(sample=sample)
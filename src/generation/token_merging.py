@@ -0,0 +1,134 @@
+import math
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def bipartite_soft_matching(x, h, w, r, stride=(2, 2)):
+    """
+    ToMe-style merge/unmerge functions for (B, h*w, C) tokens on an h x w grid.
+
+    One destination token is kept per stride cell; the r source tokens most
+    similar (cosine) to a destination are averaged into it. unmerge() copies
+    every merged token back to the positions it came from.
+    """
+    batch, tokens, channels = x.shape
+    sy, sx = stride
+
+    grid = torch.arange(tokens, device=x.device).view(h, w)
+    is_dst = torch.zeros(h, w, dtype=torch.bool, device=x.device)
+    is_dst[::sy, ::sx] = True
+    dst_idx = grid[is_dst]
+    src_idx = grid[~is_dst]
+    r = min(r, len(src_idx))
+
+    with torch.no_grad():
+        metric = x / x.norm(dim=-1, keepdim=True).clamp_min(1e-6)
+        scores = metric[:, src_idx] @ metric[:, dst_idx].transpose(-1, -2)
+
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx = edge_idx[:, r:]
+        src_merged = edge_idx[:, :r]
+        dst_merged = node_idx[..., None].gather(1, src_merged)
+
+    def merge(x):
+        channels = x.shape[-1]
+        src, dst = x[:, src_idx], x[:, dst_idx]
+        unm = src.gather(1, unm_idx.expand(-1, -1, channels))
+        src = src.gather(1, src_merged.expand(-1, -1, channels))
+        dst = dst.scatter_reduce(1, dst_merged.expand(-1, -1, channels), src, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x):
+        channels = x.shape[-1]
+        num_unm = unm_idx.shape[1]
+        unm, dst = x[:, :num_unm], x[:, num_unm:]
+        src = dst.gather(1, dst_merged.expand(-1, -1, channels))
+
+        out = x.new_zeros(batch, tokens, channels)
+        out[:, dst_idx] = dst
+        out.scatter_(1, src_idx[unm_idx].expand(-1, -1, channels), unm)
+        out.scatter_(1, src_idx[src_merged].expand(-1, -1, channels), src)
+        return out
+
+    return merge, unmerge
+
+
+class ToMeAttnProcessor:
+    """
+    Wraps a self-attention processor: tokens are merged before attention
+    (fewer queries, keys and values) and unmerged after.
+    """
+
+    def __init__(self, controller, processor):
+        self.controller = controller
+        self.processor = processor
+
+    def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, *args, **kwargs):
+        functions = None
+        if encoder_hidden_states is None and attention_mask is None and hidden_states.ndim == 3:
+            functions = self.controller.merge_functions(hidden_states)
+
+        if functions is None:
+            return self.processor(attn, hidden_states, encoder_hidden_states, attention_mask, *args, **kwargs)
+
+        merge, unmerge = functions
+        out = self.processor(attn, merge(hidden_states), None, None, *args, **kwargs)
+        return unmerge(out)
+
+
+class TokenMerging:
+    """
+    Patches ToMe token merging into the self-attention processors of a UNet.
+    Only levels downsampled at most max_downsample times are merged: the
+    highest-resolution level is where attention over h*w tokens dominates.
+    """
+
+    def __init__(self, unet, ratio=0.5, max_downsample=1, stride=(2, 2)):
+        """
+        unet: UNet2DConditionModel
+        ratio: fraction of tokens merged away (0 disables merging)
+        max_downsample: deepest UNet level merged (1: full latent resolution only)
+        stride: destination token grid, one kept token per stride cell
+        """
+        self.ratio = ratio
+        self.max_downsample = max_downsample
+        self.stride = stride
+        self._latent_size = None
+
+        # conv_in sees every latent the UNet runs on, including single tiles
+        unet.conv_in.register_forward_pre_hook(self._record_latent_size)
+
+        self.num_patched = 0
+        for module in unet.modules():
+            if hasattr(module, "set_processor") and not getattr(module, "is_cross_attention", True):
+                module.set_processor(ToMeAttnProcessor(self, module.processor))
+                self.num_patched += 1
+
+        logger.info(f"Token merging patched into {self.num_patched} self-attention layer(s)")
+
+    def _record_latent_size(self, module, args):
+        self._latent_size = tuple(args[0].shape[-2:])
+
+    def merge_functions(self, hidden_states):
+        """
+        merge/unmerge for a (B, N, C) self-attention input, or None when the
+        layer is too deep or merging is off.
+        """
+        if self.ratio <= 0 or self._latent_size is None:
+            return None
+
+        height, width = self._latent_size
+        tokens = hidden_states.shape[1]
+        downsample = round(math.sqrt(height * width / tokens))
+        if downsample > self.max_downsample:
+            return None
+
+        h, w = math.ceil(height / downsample), math.ceil(width / downsample)
+        if h * w != tokens:
+            return None
+
+        return bipartite_soft_matching(hidden_states, h, w, int(tokens * self.ratio), self.stride)
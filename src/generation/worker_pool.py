@@ -0,0 +1,360 @@
+import os
+import queue
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+
+# torch/diffusers are imported inside the workers, after the thread
+# environment for their core slice has been set.
+
+logger = logging.getLogger(__name__)
+
+_STOP = None
+
+# Seconds between liveness checks of the workers while no result arrives
+_POLL_INTERVAL = 1.0
+
+
+def _default_runner_factory(**runner_kwargs):
+    from src.generation.sd_runner import StableDiffusionRunner
+    return StableDiffusionRunner(**runner_kwargs)
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(cores, num_workers):
+    """
+    Splits a list of core ids into num_workers contiguous, non-empty slices.
+    """
+    num_workers = max(1, min(num_workers, len(cores)))
+    size, extra = divmod(len(cores), num_workers)
+
+    slices = []
+    start = 0
+    for i in range(num_workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+class _JobCancellationToken:
+    """
+    CancellationToken of a job inside a worker: the pool cancels it by
+    writing the job id into the worker's shared cancel flag.
+    """
+
+    def __init__(self, flag, job_id):
+        self.flag = flag
+        self.job_id = job_id
+
+    @property
+    def cancelled(self):
+        return self.flag.value == self.job_id
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            from src.generation.progress import GenerationCancelled
+            raise GenerationCancelled("Generation cancelled.")
+
+
+def _worker_main(worker_id, cores, runner_factory, runner_kwargs, job_queue, result_queue, cancel_flag):
+    num_threads = len(cores)
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    os.environ["MKL_NUM_THREADS"] = str(num_threads)
+
+    import torch
+    torch.set_num_threads(num_threads)
+
+    from src.generation.progress import GenerationCancelled
+
+    try:
+        runner = runner_factory(**runner_kwargs)
+    except Exception as e:
+        result_queue.put(("failed", worker_id, repr(e)))
+        return
+
+    result_queue.put(("ready", worker_id, None))
+
+    while True:
+        job = job_queue.get()
+        if job is _STOP:
+            return
+
+        job_id, args, kwargs = job
+        result_queue.put(("started", job_id, worker_id))
+        try:
+            result = runner.generate_styled_image(
+                *args, cancel_token=_JobCancellationToken(cancel_flag, job_id), **kwargs
+            )
+            result_queue.put(("done", job_id, result))
+        except GenerationCancelled:
+            result_queue.put(("cancelled", job_id, None))
+        except Exception as e:
+            result_queue.put(("error", job_id, repr(e)))
+
+
+class GenerationWorkerPool:
+    """
+    Pool of warm StableDiffusionRunner processes.
+
+    Every worker preloads its own pipeline at startup, is pinned to its own
+    slice of cores with a matching torch thread count, and pulls generation
+    jobs from a shared queue. submit() returns a concurrent.futures.Future;
+    cancel() drops a queued job or stops a running one between steps.
+    """
+
+    def __init__(
+        self,
+        num_workers=None,
+        cores_per_worker=4,
+        runner_factory=None,
+        runner_kwargs=None,
+        wait_ready=True
+    ):
+        """
+        num_workers: pipelines to preload (default: cores // cores_per_worker)
+        cores_per_worker: core slice size when num_workers is not given
+        runner_factory: picklable callable returning a runner (default: StableDiffusionRunner)
+        runner_kwargs: keyword arguments for runner_factory
+        wait_ready: block until every worker has loaded its pipeline
+        """
+        cores = available_cores()
+        if num_workers is None:
+            num_workers = max(1, len(cores) // max(1, cores_per_worker))
+
+        self.core_slices = split_cores(cores, num_workers)
+        self.num_workers = len(self.core_slices)
+
+        ctx = multiprocessing.get_context("spawn")
+        self._job_queue = ctx.Queue()
+        self._result_queue = ctx.Queue()
+
+        self._futures = {}
+        self._running = {}
+        self._cancel_flags = [ctx.Value("q", -1, lock=False) for _ in self.core_slices]
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Semaphore(0)
+        self._alive = self.num_workers
+        self._ready_workers = set()
+        self._lost_workers = set()
+        self._closed = False
+
+        self._workers = [
+            ctx.Process(
+                target=_worker_main,
+                args=(
+                    worker_id,
+                    cores,
+                    runner_factory or _default_runner_factory,
+                    runner_kwargs or {},
+                    self._job_queue,
+                    self._result_queue,
+                    self._cancel_flags[worker_id]
+                ),
+                daemon=True
+            )
+            for worker_id, cores in enumerate(self.core_slices)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+        logger.info(f"GenerationWorkerPool started {self.num_workers} worker(s) | Cores: {self.core_slices}")
+
+        if wait_ready:
+            self.wait_ready()
+
+    def _collect(self):
+        while True:
+            try:
+                message = self._result_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if message is _STOP:
+                return
+
+            kind, key, payload = message
+
+            if kind == "ready":
+                logger.info(f"Generation worker {key} ready.")
+                with self._lock:
+                    self._ready_workers.add(key)
+                self._ready.release()
+                continue
+
+            if kind == "failed":
+                logger.error(f"Generation worker {key} failed to load: {payload}")
+                self._lose_worker(key, "No generation worker could be started.")
+                continue
+
+            if kind == "started":
+                with self._lock:
+                    future = self._futures.get(key)
+                    if future is None:
+                        continue
+                    if future.set_running_or_notify_cancel():
+                        self._running[key] = payload
+                    else:
+                        # Cancelled while queued: stop it at the first check
+                        self._cancel_flags[payload].value = key
+                continue
+
+            with self._lock:
+                future = self._futures.pop(key, None)
+                self._running.pop(key, None)
+            if future is None or future.done():
+                continue
+
+            if kind == "done":
+                future.set_result(payload)
+            elif kind == "cancelled":
+                from src.generation.progress import GenerationCancelled
+                future.set_exception(GenerationCancelled("Generation cancelled."))
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _check_workers(self):
+        """
+        Finds workers that exited without being asked to (killed, crashed in
+        native code, out of memory) and fails the job they were running.
+        """
+        if self._closed:
+            return
+
+        for worker_id, worker in enumerate(self._workers):
+            if worker_id in self._lost_workers or worker.is_alive():
+                continue
+
+            logger.error(f"Generation worker {worker_id} died (exit code {worker.exitcode}).")
+
+            with self._lock:
+                lost_jobs = [job_id for job_id, running_on in self._running.items() if running_on == worker_id]
+                futures = [self._futures.pop(job_id, None) for job_id in lost_jobs]
+                for job_id in lost_jobs:
+                    self._running.pop(job_id)
+            self._lose_worker(worker_id, "No generation worker is available.")
+
+            for future in futures:
+                if future is not None and not future.done():
+                    future.set_exception(
+                        RuntimeError(f"Generation worker {worker_id} died (exit code {worker.exitcode}).")
+                    )
+
+    def _lose_worker(self, worker_id, reason):
+        with self._lock:
+            if worker_id in self._lost_workers:
+                return
+            self._lost_workers.add(worker_id)
+            self._alive -= 1
+            no_workers = self._alive == 0
+            was_ready = worker_id in self._ready_workers
+
+        # wait_ready() counts every worker once, ready or not
+        if not was_ready:
+            self._ready.release()
+        if no_workers:
+            self._fail_pending(reason)
+
+    def _fail_pending(self, reason):
+        with self._lock:
+            pending = list(self._futures.values())
+            self._futures.clear()
+            self._running.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError(reason))
+
+    def wait_ready(self):
+        """
+        Blocks until every worker reported ready (or failed to load).
+        """
+        for _ in range(self.num_workers):
+            self._ready.acquire()
+        for _ in range(self.num_workers):
+            self._ready.release()
+
+    def submit(
+        self,
+        scene_json_path,
+        source_image_path,
+        preset="fast",
+        mode="auto_design",
+        **kwargs
+    ):
+        """
+        Queues a generation job. The future resolves to (output_image, output_path).
+        """
+        future = Future()
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("GenerationWorkerPool is shut down.")
+            if self._alive == 0:
+                raise RuntimeError("No generation worker is available.")
+
+            job_id = next(self._job_ids)
+            self._futures[job_id] = future
+
+        kwargs.update(preset=preset, mode=mode)
+        self._job_queue.put((job_id, (scene_json_path, source_image_path), kwargs))
+        return future
+
+    def cancel(self, future):
+        """
+        Cancels a submitted job. A queued job is dropped, a running one stops
+        at its next denoising step and its future raises GenerationCancelled.
+        Returns False when the job already finished.
+        """
+        if future.cancel():
+            return True
+
+        with self._lock:
+            for job_id, job_future in self._futures.items():
+                if job_future is future and job_id in self._running:
+                    self._cancel_flags[self._running[job_id]].value = job_id
+                    return True
+        return False
+
+    def shutdown(self, wait=True):
+        """
+        Stops the workers once the queued jobs are done (wait=True) or right away.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        for _ in self._workers:
+            self._job_queue.put(_STOP)
+
+        for worker in self._workers:
+            if wait:
+                worker.join()
+            else:
+                worker.terminate()
+
+        self._result_queue.put(_STOP)
+        self._collector.join()
+        self._fail_pending("GenerationWorkerPool shut down before the job finished.")
+
+        logger.info("GenerationWorkerPool shut down.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,268 @@
+import os
+import queue
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v")
+
+_STOP = object()
+
+
+def is_video(path):
+    return isinstance(path, str) and path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def perceptual_hash(gray):
+    """
+    64-bit DCT hash of a (32, 32) float32 grayscale thumbnail, packed into
+    8 bytes. Robust to small shifts, exposure changes and compression noise.
+    """
+    low = cv2.dct(gray)[:8, :8].reshape(-1)
+    # Compare against the median of the low frequencies, skipping the DC term
+    return np.packbits(low > np.median(low[1:]))
+
+
+def hash_distance(hash_a, hash_b):
+    """
+    Number of differing bits between two perceptual hashes.
+    """
+    return int(np.unpackbits(np.bitwise_xor(hash_a, hash_b)).sum())
+
+
+def ssim_lite(gray_a, gray_b, block=8):
+    """
+    Mean SSIM over non-overlapping blocks of two equally sized float32
+    grayscale thumbnails (0–255). No Gaussian window, so it is a handful of
+    reshapes and means instead of a full filtering pass.
+    """
+    h, w = gray_a.shape
+    shape = (h // block, block, w // block, block)
+    a = gray_a[:shape[0] * block, :shape[2] * block].reshape(shape)
+    b = gray_b[:shape[0] * block, :shape[2] * block].reshape(shape)
+
+    mu_a = a.mean(axis=(1, 3))
+    mu_b = b.mean(axis=(1, 3))
+    var_a = a.var(axis=(1, 3))
+    var_b = b.var(axis=(1, 3))
+    cov = (a * b).mean(axis=(1, 3)) - mu_a * mu_b
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    ssim = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim.mean())
+
+
+def frame_signature(frame, size=32):
+    """
+    Cheap fingerprint of a BGR frame, computed on a downscaled copy:
+    hue/saturation histogram, grayscale thumbnail and perceptual hash.
+    """
+    thumb = cv2.resize(frame, (size, size), interpolation=cv2.INTER_AREA)
+
+    hsv = cv2.cvtColor(thumb, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256])
+    cv2.normalize(hist, hist)
+
+    gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+    return {"histogram": hist, "gray": gray, "hash": perceptual_hash(gray)}
+
+
+def compare_signatures(sig_a, sig_b):
+    """
+    Returns the three similarity metrics between two frame signatures:
+    histogram (Bhattacharyya distance, 0 = identical), ssim (1 = identical)
+    and hash (differing hash bits, 0 = identical).
+    """
+    return {
+        "histogram": float(cv2.compareHist(sig_a["histogram"], sig_b["histogram"], cv2.HISTCMP_BHATTACHARYYA)),
+        "ssim": ssim_lite(sig_a["gray"], sig_b["gray"]),
+        "hash": hash_distance(sig_a["hash"], sig_b["hash"])
+    }
+
+
+class FrameSampler:
+    """
+    Input stage that drops near-duplicate frames before perception.
+
+    Every frame is compared (on a downscaled copy) with the last forwarded
+    frame; it is forwarded only if the color histogram, the block SSIM or the
+    perceptual hash says it changed meaningfully. On top of that, a frame
+    budget (per second of video and/or per scan) spaces out forwarded frames,
+    and frames inside the budget gap are skipped without being decoded.
+    """
+
+    def __init__(
+        self,
+        histogram_threshold=0.15,
+        ssim_threshold=0.85,
+        hash_threshold=10,
+        max_fps=None,
+        max_frames=None,
+        thumb_size=32,
+        queue_size=8
+    ):
+        """
+        histogram_threshold: histogram distance above which a frame is new
+        ssim_threshold: block SSIM below which a frame is new
+        hash_threshold: differing hash bits (of 64) at which a frame is new
+        max_fps: at most this many forwarded frames per second of video
+        max_frames: at most this many forwarded frames per scan; when the
+                    frame count is known they are spread over the whole scan
+        thumb_size: side of the square thumbnail the metrics run on
+        queue_size: decoded frames buffered ahead of the consumer (video input)
+        """
+        self.histogram_threshold = histogram_threshold
+        self.ssim_threshold = ssim_threshold
+        self.hash_threshold = hash_threshold
+        self.max_fps = max_fps
+        self.max_frames = max_frames
+        self.thumb_size = thumb_size
+        self.queue_size = max(1, queue_size)
+
+        self.reset()
+
+    def reset(self):
+        self._reference = None
+        self._last_index = None
+        self.num_read = 0
+        self.num_forwarded = 0
+
+    def is_novel(self, signature, reference):
+        """
+        Whether a frame differs meaningfully from the reference frame.
+        """
+        metrics = compare_signatures(signature, reference)
+        return (
+            metrics["histogram"] > self.histogram_threshold
+            or metrics["ssim"] < self.ssim_threshold
+            or metrics["hash"] >= self.hash_threshold
+        )
+
+    def min_gap(self, fps=None, total_frames=None):
+        """
+        Minimum number of source frames between two forwarded frames.
+        """
+        gap = 1.0
+        if self.max_fps and fps:
+            gap = max(gap, fps / self.max_fps)
+        if self.max_frames and total_frames:
+            gap = max(gap, total_frames / self.max_frames)
+        return gap
+
+    def _select(self, candidates, min_gap):
+        """
+        candidates: (index, load) pairs, load() returns the decoded frame
+        Yields the (index, frame) pairs worth processing.
+        """
+        for index, load in candidates:
+            if self.max_frames is not None and self.num_forwarded >= self.max_frames:
+                return
+
+            self.num_read += 1
+            if self._last_index is not None and index - self._last_index < min_gap:
+                continue
+
+            frame = load()
+            if frame is None:
+                continue
+
+            signature = frame_signature(frame, self.thumb_size)
+            if self._reference is not None and not self.is_novel(signature, self._reference):
+                continue
+
+            self._reference, self._last_index = signature, index
+            self.num_forwarded += 1
+            yield index, frame
+
+    def sample(self, frames, fps=None, total_frames=None):
+        """
+        frames: iterable of BGR frames
+        fps: source frame rate, needed for max_fps
+        total_frames: source length, lets max_frames spread over the scan
+
+        Yields (index, frame) for every forwarded frame.
+        """
+        self.reset()
+        candidates = ((index, lambda frame=frame: frame) for index, frame in enumerate(frames))
+        yield from self._select(candidates, self.min_gap(fps, total_frames))
+
+    def sample_video(self, path, prefix="frame"):
+        """
+        Decodes a video on a background thread and yields (frame_id, frame)
+        for every forwarded frame, ready for PipelineOrchestrator.run().
+        frame_id keeps the source frame number ("<prefix>_0042").
+        """
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video: {path}")
+
+        self.reset()
+        min_gap = self.min_gap(cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+
+        out = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors = []
+
+        def candidates():
+            index = 0
+            # grab() only demuxes, frames skipped by the budget are never decoded
+            while not stop.is_set() and cap.grab():
+                yield index, lambda: cap.retrieve()[1]
+                index += 1
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def reader():
+            try:
+                for item in self._select(candidates(), min_gap):
+                    put(item)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                cap.release()
+                put(_STOP)
+
+        thread = threading.Thread(target=reader, name="frame-sampler", daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                item = out.get()
+                if item is _STOP:
+                    break
+                index, frame = item
+                yield f"{prefix}_{index + 1:04d}", frame
+        finally:
+            stop.set()
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+        logger.info(f"Frame sampler: forwarded {self.num_forwarded}/{self.num_read} frame(s) of {os.path.basename(path)}")
+
+
+def iter_inputs(inputs, sampler=None):
+    """
+    Expands a list of image and video paths into pipeline frames: images
+    pass through as paths, videos are decoded and filtered by the sampler.
+    """
+    sampler = sampler or FrameSampler()
+
+    for path in inputs:
+        if is_video(path):
+            prefix = os.path.splitext(os.path.basename(path))[0]
+            yield from sampler.sample_video(path, prefix=prefix)
+        else:
+            yield path
@@ -0,0 +1,68 @@
+import argparse
+import logging
+
+from src.cache import PerceptionCache
+from src.input import FrameSampler, iter_inputs
+from src.orchestrator import PipelineOrchestrator
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="AI Room Scan & Interior Styling pipeline (CPU)"
+    )
+    parser.add_argument("inputs", nargs="+", help="Room images or scan videos to process")
+    parser.add_argument("--output-dir", default="outputs/pipeline")
+    parser.add_argument("--preset", default="fast", help="fast | balanced | quality | turbo | preview")
+    parser.add_argument("--mode", default="auto_design", help="generic | prompt_based | auto_design")
+    parser.add_argument("--style", default="modern", help="Style for generic mode")
+    parser.add_argument("--user-input", default="", help="Prompt for prompt_based mode")
+    parser.add_argument("--no-generate", action="store_true", help="Run perception only")
+    parser.add_argument("--queue-size", type=int, default=2, help="Frames buffered between stages")
+    parser.add_argument("--perception-cache", default=None,
+                        help="Folder caching detections, masks and depth across runs")
+    parser.add_argument("--write-detections", action="store_true",
+                        help="Also write a detections.json per frame")
+    parser.add_argument("--scene-format", default="json", choices=("json", "npz"),
+                        help="Scene file format (npz also stores depth and packed masks)")
+    parser.add_argument("--max-fps", type=float, default=None,
+                        help="Video input: at most this many frames per second of video")
+    parser.add_argument("--max-frames", type=int, default=None,
+                        help="Video input: at most this many frames per scan")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    orchestrator = PipelineOrchestrator(
+        output_dir=args.output_dir,
+        preset=args.preset,
+        mode=args.mode,
+        generate=not args.no_generate,
+        queue_size=args.queue_size,
+        perception_cache=PerceptionCache(args.perception_cache) if args.perception_cache else None,
+        scene_format=args.scene_format,
+        write_detections=args.write_detections,
+        style=args.style,
+        user_input=args.user_input
+    )
+
+    # Videos are decoded in the background and near-duplicate frames dropped
+    sampler = FrameSampler(max_fps=args.max_fps, max_frames=args.max_frames)
+
+    processed = failed = 0
+    with orchestrator:
+        for result in orchestrator.run(iter_inputs(args.inputs, sampler)):
+            processed += 1
+            if result["error"]:
+                failed += 1
+
+    logger.info(f"Processed {processed} frame(s), {failed} failed.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
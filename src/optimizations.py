@@ -1,8 +1,24 @@
+import os
+import sys
+import copy
+import hashlib
+import inspect
+import functools
+import threading
+import contextlib
 import torch
 import logging
+import numpy as np
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
 
 logger = logging.getLogger(__name__)
 
+ONNX_OPSET = 17
+
 def enable_channels_last(model):
     """
     Sets the model memory format to channels_last for better CPU performance.
@@ -12,24 +28,420 @@ def enable_channels_last(model):
         logger.info("Enabled channels_last memory format for model.")
     return model
 
-def apply_torch_compile(model):
+def apply_torch_compile(model, mode=None, dynamic=False):
     """
     Applies torch.compile to the model if available (PyTorch 2.0+).
+    dynamic=False specializes on the first input shapes, which suits the
+    fixed per-preset resolutions.
     """
     try:
         if hasattr(torch, 'compile'):
-            model = torch.compile(model)
+            model = torch.compile(model, mode=mode, dynamic=dynamic)
             logger.info("Applied torch.compile to model.")
     except Exception as e:
         logger.warning(f"Could not apply torch.compile: {e}")
     return model
 
-def onnx_export_stub():
+
+def enable_compile_cache(cache_dir):
+    """
+    Persists the inductor and FX graph caches in cache_dir, so restarted
+    workers reuse compiled kernels and graphs instead of recompiling.
+    Call before the first compiled forward pass.
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+    os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
+    os.environ["TORCHINDUCTOR_AUTOGRAD_CACHE"] = "1"
+
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except (ImportError, AttributeError):
+        pass
+
+    logger.info(f"torch.compile cache directory: {cache_dir}")
+    return cache_dir
+
+def library_versions():
+    """
+    Versions of the libraries exported/quantized artifacts depend on.
+    """
+    from importlib import metadata
+
+    versions = {"torch": torch.__version__}
+    for name in ("diffusers", "transformers", "segment-anything", "timm"):
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            pass
+    return versions
+
+
+def module_identity(module):
+    """
+    Where a diffusers/transformers module was loaded from (its config's
+    _name_or_path), or a hash of its weights for modules built in memory.
+    """
+    name = getattr(getattr(module, "config", None), "_name_or_path", None)
+    if name:
+        return name
+
+    h = hashlib.blake2b(digest_size=16)
+    for key, tensor in module.state_dict().items():
+        h.update(key.encode())
+        h.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy())
+    return f"{type(module).__name__}:{h.hexdigest()}"
+
+
+def versioned_cache_key(*identity):
+    """
+    Short hash of the model identity parts and the installed library
+    versions, so a different model or upgrade never reuses cached results.
+    """
+    key = repr((identity, sorted(library_versions().items())))
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+
+def versioned_cache_dir(base_dir, *identity):
+    """
+    Subfolder of base_dir for artifacts derived from a model (ONNX graphs,
+    int8 weights), named by versioned_cache_key() of the model identity.
+    """
+    return os.path.join(base_dir, versioned_cache_key(*identity))
+
+
+def export_onnx(module, example_inputs, output_path, input_names, output_names, dynamic_axes=None, opset=ONNX_OPSET):
+    """
+    Exports a module to ONNX (TorchScript exporter, which handles the
+    diffusers/MiDaS/SAM graphs without extra dependencies).
+    Skips the export when output_path already exists, so output_path should
+    sit in a versioned_cache_dir() of the model and opset.
+    """
+    if os.path.exists(output_path):
+        logger.info(f"Reusing ONNX graph: {output_path}")
+        return output_path
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+
+    tmp_path = f"{output_path}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            tuple(example_inputs),
+            tmp_path,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True,
+            **kwargs
+        )
+    os.replace(tmp_path, output_path)
+
+    logger.info(f"Exported ONNX graph: {output_path}")
+    return output_path
+
+
+class OnnxRunner:
+    """
+    Runs an exported graph with onnxruntime's CPU execution provider.
+    Takes and returns torch tensors so it can stand in for a module's forward.
+    """
+
+    def __init__(self, onnx_path, num_threads=None):
+        if ort is None:
+            raise ImportError("onnxruntime is not installed.")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+
+        self.session = ort.InferenceSession(
+            onnx_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.output_names = [o.name for o in self.session.get_outputs()]
+
+        logger.info(f"Loaded ONNX Runtime session: {onnx_path}")
+
+    def __call__(self, *inputs):
+        feeds = {
+            name: tensor.detach().cpu().contiguous().numpy()
+            for name, tensor in zip(self.input_names, inputs)
+        }
+        outputs = self.session.run(self.output_names, feeds)
+        return [torch.from_numpy(output) for output in outputs]
+
+
+def onnx_available():
+    return ort is not None
+
+def _empty_dynamic_int8(model):
+    """
+    Replaces the model's Linear layers in place by empty dynamic int8 Linear
+    layers, ready for load_state_dict() (the float weights are not
+    quantized). Returns (parent, name, original) triples to undo the swap.
+    """
+    swapped = []
+    for parent in list(model.modules()):
+        for name, child in parent.named_children():
+            if type(child) is torch.nn.Linear:
+                setattr(parent, name, torch.ao.nn.quantized.dynamic.Linear(
+                    child.in_features,
+                    child.out_features,
+                    bias_=child.bias is not None,
+                    dtype=torch.qint8
+                ))
+                swapped.append((parent, name, child))
+    return swapped
+
+
+def quantize_dynamic_int8(model, cache_path=None):
+    """
+    Post-training dynamic int8 quantization of the model's Linear layers
+    (int8 weights, activations quantized on the fly). Quantizes in place.
+
+    With cache_path, the quantized state_dict is saved on first use; later
+    startups load it into empty int8 layers instead of quantizing again
+    (tensors only, no pickled modules). Put cache_path in a
+    versioned_cache_dir() of the model, the file is not checked against
+    the weights it came from.
+    """
+    if cache_path and os.path.exists(cache_path):
+        swapped = []
+        try:
+            state_dict = torch.load(cache_path, weights_only=True)
+            swapped = _empty_dynamic_int8(model)
+            model.load_state_dict(state_dict)
+            logger.info(f"Loaded cached int8 weights: {cache_path}")
+            return model
+        except Exception as e:
+            for parent, name, child in swapped:
+                setattr(parent, name, child)
+            logger.warning(f"Could not load cached int8 weights ({e}), re-saving.")
+
+    quantized = torch.ao.quantization.quantize_dynamic(
+        model,
+        {torch.nn.Linear},
+        dtype=torch.qint8,
+        inplace=True
+    )
+
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        torch.save(quantized.state_dict(), tmp_path)
+        os.replace(tmp_path, cache_path)
+        logger.info(f"Saved int8 weights: {cache_path}")
+
+    return quantized
+
+
+def compare_outputs(reference, candidate):
+    """
+    Quality metrics of a candidate output against an fp32 reference.
+    Accepts tensors, arrays or PIL images of the same shape.
+    """
+    def to_array(x):
+        if isinstance(x, torch.Tensor):
+            x = x.detach().float().cpu().numpy()
+        return np.asarray(x, dtype=np.float64)
+
+    ref = to_array(reference)
+    out = to_array(candidate)
+    diff = out - ref
+
+    mse = float(np.mean(diff ** 2))
+    data_range = float(ref.max() - ref.min()) or 1.0
+    psnr = float("inf") if mse == 0 else 10 * np.log10(data_range ** 2 / mse)
+
+    ref_flat, out_flat = ref.ravel(), out.ravel()
+    denom = np.linalg.norm(ref_flat) * np.linalg.norm(out_flat)
+    cosine = float(ref_flat @ out_flat / denom) if denom > 0 else 1.0
+
+    return {
+        "max_abs_error": float(np.abs(diff).max()),
+        "mean_abs_error": float(np.abs(diff).mean()),
+        "psnr": psnr,
+        "cosine_similarity": cosine
+    }
+
+
+def quantization_quality_check(model, example_inputs, output_fn=None):
+    """
+    Runs a copy of the model in fp32 and int8 on the same inputs and reports
+    compare_outputs() metrics. output_fn picks the tensor to compare from
+    the model output (default: first element of tuples).
+    """
+    output_fn = output_fn or (lambda out: out[0] if isinstance(out, (tuple, list)) else out)
+
+    fp32_model = copy.deepcopy(model).eval()
+    int8_model = quantize_dynamic_int8(copy.deepcopy(model).eval())
+
+    with torch.no_grad():
+        reference = output_fn(fp32_model(*example_inputs))
+        candidate = output_fn(int8_model(*example_inputs))
+
+    report = compare_outputs(reference, candidate)
+    logger.info(f"int8 vs fp32: {report}")
+    return report
+
+
+@functools.lru_cache(maxsize=None)
+def bf16_supported():
+    """
+    True if the CPU has native bf16 instructions (AVX512-BF16 or AMX-BF16).
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    return bool(flags & {"avx512_bf16", "amx_bf16"})
+    except OSError:
+        pass
+    return False
+
+
+def resolve_precision(precision="fp32"):
+    """
+    precision:
+    - fp32 (default)
+    - bf16 (bf16 autocast, falls back to fp32 on CPUs without bf16 support)
+    - auto (bf16 when supported, fp32 otherwise)
+    Returns the precision actually used and logs the choice.
+    """
+    precision = precision.lower()
+    if precision not in ("fp32", "bf16", "auto"):
+        raise ValueError(f"Unknown precision '{precision}'. Use fp32, bf16 or auto.")
+
+    if precision == "fp32":
+        logger.info("Precision: fp32.")
+        return "fp32"
+
+    if bf16_supported():
+        logger.info("Precision: bf16 autocast (CPU supports AVX512-BF16/AMX).")
+        return "bf16"
+
+    if precision == "bf16":
+        logger.warning("bf16 requested but this CPU has no AVX512-BF16/AMX support. Using fp32.")
+    else:
+        logger.info("Precision: fp32 (no AVX512-BF16/AMX support detected).")
+    return "fp32"
+
+
+def cpu_autocast(precision):
+    """
+    Autocast context for the resolved precision (no-op for fp32).
+    """
+    if precision == "bf16":
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def available_memory():
+    """
+    Physical memory available to new allocations, in bytes (None if unknown).
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size (VmHWM) of this process, so the next
+    peak_rss() covers only what ran since. Linux only, returns False elsewhere.
+    The counter is process-wide: measure one thing at a time per process
+    (see start_peak_rss_measurement).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError as e:
+        logger.warning(f"Could not reset the peak RSS ({e}), it will cover the whole process lifetime.")
+        return False
+
+
+_peak_rss_lock = threading.Lock()
+_peak_rss_epoch = 0
+
+
+def start_peak_rss_measurement():
+    """
+    Resets the peak RSS and returns a token for finish_peak_rss_measurement().
+    Starting a measurement invalidates the ones still running in this process,
+    whose peak would otherwise mix in (or lose) each other's memory.
+    """
+    global _peak_rss_epoch
+    with _peak_rss_lock:
+        _peak_rss_epoch += 1
+        reset_peak_rss()
+        return _peak_rss_epoch
+
+
+def finish_peak_rss_measurement(token):
+    """
+    Peak RSS in bytes since start_peak_rss_measurement() returned token, or
+    None when another measurement started in between (or it is unknown).
+    """
+    with _peak_rss_lock:
+        if token != _peak_rss_epoch:
+            logger.warning("Peak RSS not recorded: another measurement started in this process meanwhile.")
+            return None
+        return peak_rss()
+
+
+def peak_rss():
     """
-    Stub for future ONNX export functionality.
+    Peak resident set size of this process in bytes, since the last
+    reset_peak_rss() on Linux and since startup elsewhere (None if unknown).
     """
-    logger.info("ONNX export stub called. Functionality not yet implemented.")
-    pass
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def attention_memory_estimate(resolution, heads, batch=2, bytes_per_element=4, downsample=8):
+    """
+    Bytes of the attention score matrices of one unsliced self-attention
+    layer at the full latent resolution (batch 2: classifier-free guidance).
+    """
+    tokens = (resolution[0] // downsample) * (resolution[1] // downsample)
+    return batch * heads * tokens * tokens * bytes_per_element
+
 
 def set_cpu_optimizations():
     """
@@ -0,0 +1,320 @@
+import os
+import queue
+import logging
+import threading
+
+import cv2
+import torch
+
+from src.detection.yolov8_runner import YOLOv8Runner
+from src.segmentation.sam_runner import SAMRunner
+from src.depth.midas_runner import MiDaSRunner
+from src.scene.scene_builder import SceneBuilder
+from src.generation.sd_runner import StableDiffusionRunner
+from src.perception import PerceptionRunner
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("perception", "segmentation", "scene", "generation")
+
+_STOP = object()
+
+
+def default_stage_threads(cpu_count=None):
+    """
+    Splits the available cores into a torch intra-op thread budget per stage.
+    Generation dominates wall-clock time, so it gets half of the cores.
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+
+    generation = max(1, cpu_count // 2)
+    perception = max(1, cpu_count // 4)
+    segmentation = max(1, cpu_count - generation - perception)
+
+    return {
+        "perception": perception,
+        "segmentation": segmentation,
+        "scene": 1,
+        "generation": generation
+    }
+
+
+class PipelineOrchestrator:
+    """
+    Streaming perception-to-generation pipeline.
+
+    Every stage runs in its own worker thread(s) and hands frames to the next
+    stage through a bounded queue, so detection and depth on frame N+1 run
+    while SAM and Stable Diffusion work on frame N.
+    """
+
+    def __init__(
+        self,
+        output_dir="outputs/pipeline",
+        preset="fast",
+        mode="auto_design",
+        detector=None,
+        segmenter=None,
+        depth_estimator=None,
+        scene_builder=None,
+        generator=None,
+        generate=True,
+        save_masks=False,
+        queue_size=2,
+        stage_threads=None,
+        stage_workers=None,
+        perception_cache=None,
+        scene_format="json",
+        write_detections=False,
+        **prompt_kwargs
+    ):
+        """
+        detector / segmenter / depth_estimator / scene_builder / generator:
+            runner instances; default ones are loaded when omitted
+        generate: run the Stable Diffusion stage
+        save_masks: also export per-object mask PNGs (written in the background)
+        queue_size: max frames waiting between two stages (backpressure)
+        stage_threads: torch intra-op threads per stage (default: from CPU count)
+        stage_workers: worker threads per stage (model stages default to 1,
+            since the runners hold stateful predictors)
+        perception_cache: PerceptionCache handed to the default detector,
+            segmenter and depth estimator
+        scene_format: "json" or "npz" (binary scene with depth map and packed masks)
+        write_detections: also write a detections.json per frame
+        """
+        self.output_dir = output_dir
+        self.preset = preset
+        self.mode = mode
+        self.generate = generate
+        self.save_masks = save_masks
+        self.scene_format = scene_format
+        self.write_detections = write_detections
+        self.queue_size = max(1, queue_size)
+        self.prompt_kwargs = prompt_kwargs
+
+        self.detector = detector or YOLOv8Runner(perception_cache=perception_cache)
+        self.segmenter = segmenter or SAMRunner(perception_cache=perception_cache)
+        self.depth_estimator = depth_estimator or MiDaSRunner(perception_cache=perception_cache)
+        self.scene_builder = scene_builder or SceneBuilder()
+        self.generator = None
+        if generate:
+            self.generator = generator or StableDiffusionRunner()
+
+        self.stage_threads = default_stage_threads()
+        self.stage_threads.update(stage_threads or {})
+
+        self.stage_workers = {stage: 1 for stage in STAGES}
+        self.stage_workers.update(stage_workers or {})
+
+        # Detection and depth run side by side within the perception budget
+        self.perception = PerceptionRunner(
+            self.detector,
+            self.depth_estimator,
+            threads=self.stage_threads["perception"]
+        )
+
+        self._lock = threading.Lock()
+
+        logger.info(
+            f"PipelineOrchestrator ready | Threads: {self.stage_threads} | "
+            f"Workers: {self.stage_workers} | Queue size: {self.queue_size}"
+        )
+
+    # -------------------- Stages --------------------
+
+    def _frame_dir(self, frame_id):
+        return os.path.join(self.output_dir, frame_id)
+
+    def _perception(self, item):
+        frame_dir = self._frame_dir(item["frame_id"])
+        os.makedirs(frame_dir, exist_ok=True)
+
+        # SD looks for "<source>_depth.png" next to the source image
+        item["image_path"] = os.path.join(frame_dir, f"{item['frame_id']}.png")
+        item["depth_path"] = os.path.join(frame_dir, f"{item['frame_id']}_depth.png")
+        cv2.imwrite(item["image_path"], item["image"])
+
+        item["detections"], _, item["depth_norm"] = self.perception.run(
+            item["image"],
+            os.path.join(frame_dir, "detections.json"),
+            item["depth_path"],
+            write_detections=self.write_detections
+        )
+
+    def _segmentation(self, item):
+        mask_dir = None
+        if self.save_masks:
+            mask_dir = os.path.join(self._frame_dir(item["frame_id"]), "masks")
+
+        item["masks"] = self.segmenter.run_batch(
+            item["image"],
+            item["detections"],
+            output_dir=mask_dir
+        )
+
+    def _scene(self, item):
+        item["scene"] = self.scene_builder.build_scene(
+            item["depth_norm"],
+            item["detections"],
+            item["masks"]
+        )
+
+        # The auto-design prompt reads the scene from disk
+        item["scene_path"] = self.scene_builder.save_scene(
+            item["scene"],
+            os.path.join(self._frame_dir(item["frame_id"]), f"scene.{self.scene_format}"),
+            depth_norm=item["depth_norm"],
+            masks=item["masks"]
+        )
+
+    def _generation(self, item):
+        _, item["styled_path"] = self.generator.generate_styled_image(
+            item["scene_path"],
+            item["image_path"],
+            preset=self.preset,
+            mode=self.mode,
+            **self.prompt_kwargs
+        )
+
+    # -------------------- Workers --------------------
+
+    def _stage_loop(self, name, fn, in_q, out_q, remaining):
+        while True:
+            item = in_q.get()
+
+            if item is _STOP:
+                # Wake sibling workers, the last one forwards the stop marker
+                in_q.put(_STOP)
+                with self._lock:
+                    remaining[name] -= 1
+                    last = remaining[name] == 0
+                if last:
+                    out_q.put(_STOP)
+                return
+
+            if item["error"] is None:
+                try:
+                    # Set before every item: a thread's intra-op pool follows the
+                    # last process-wide value when first used. MKL's setting is
+                    # process-wide regardless, so MKL-bound ops share one budget.
+                    torch.set_num_threads(self.stage_threads[name])
+                    fn(item)
+                except Exception as e:
+                    logger.error(f"Stage '{name}' failed on {item['frame_id']}: {e}")
+                    item["error"] = f"{name}: {e}"
+
+            out_q.put(item)
+
+    def _feed(self, frames, in_q, errors):
+        try:
+            for index, frame in enumerate(frames):
+                if isinstance(frame, tuple):
+                    frame_id, image = frame
+                else:
+                    frame_id, image = f"frame_{index + 1:04d}", frame
+
+                error = None
+                if isinstance(image, str):
+                    path = image
+                    image = cv2.imread(path)
+                    if image is None:
+                        error = f"input: could not read image {path}"
+
+                in_q.put({
+                    "index": index,
+                    "frame_id": frame_id,
+                    "image": image,
+                    "error": error
+                })
+        except Exception as e:
+            # Raised from run() once the frames already queued have drained
+            logger.error(f"Reading input frames failed: {e}")
+            errors.append(e)
+        finally:
+            in_q.put(_STOP)
+
+    def run(self, frames):
+        """
+        frames: iterable of BGR images, image paths or (frame_id, image) tuples
+
+        Yields one result dict per frame, in input order, as soon as the frame
+        leaves the last stage. Background mask writes are flushed before run()
+        returns. An exception raised by the frames iterable is re-raised after
+        the frames read before it have been yielded.
+        """
+        stages = [
+            ("perception", self._perception),
+            ("segmentation", self._segmentation),
+            ("scene", self._scene)
+        ]
+        if self.generate:
+            stages.append(("generation", self._generation))
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(stages) + 1)]
+        remaining = {name: self.stage_workers[name] for name, _ in stages}
+        feed_errors = []
+
+        threads = [threading.Thread(target=self._feed, args=(frames, queues[0], feed_errors), daemon=True)]
+        for i, (name, fn) in enumerate(stages):
+            for _ in range(remaining[name]):
+                threads.append(threading.Thread(
+                    target=self._stage_loop,
+                    args=(name, fn, queues[i], queues[i + 1], remaining),
+                    daemon=True
+                ))
+
+        for t in threads:
+            t.start()
+
+        # Workers may finish out of order, re-sequence before yielding
+        pending = {}
+        next_index = 0
+
+        while True:
+            item = queues[-1].get()
+            if item is _STOP:
+                break
+
+            pending[item["index"]] = item
+            while next_index in pending:
+                yield self._finalize(pending.pop(next_index))
+                next_index += 1
+
+        for t in threads:
+            t.join()
+        self.segmenter.flush()
+
+        if feed_errors:
+            raise feed_errors[0]
+
+    def run_all(self, frames):
+        """
+        Runs the pipeline to completion and returns the list of results.
+        """
+        return list(self.run(frames))
+
+    def close(self):
+        """
+        Waits for pending mask writes and stops the perception thread pool.
+        """
+        self.segmenter.flush()
+        self.perception.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _finalize(self, item):
+        # Drop the large in-memory arrays, everything is on disk by now
+        item.pop("image", None)
+        item.pop("depth_norm", None)
+        item.pop("masks", None)
+
+        if item["error"]:
+            logger.warning(f"Frame {item['frame_id']} failed: {item['error']}")
+        else:
+            logger.info(f"Frame {item['frame_id']} completed")
+
+        return item
@@ -0,0 +1,81 @@
+import os
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def split_thread_budget(total_threads, depth_share=0.5):
+    """
+    Splits a torch intra-op thread budget between depth and detection.
+    Both sides always get at least one thread.
+    """
+    total_threads = max(2, total_threads)
+    depth_threads = min(total_threads - 1, max(1, round(total_threads * depth_share)))
+    return depth_threads, total_threads - depth_threads
+
+
+class PerceptionRunner:
+    """
+    Runs MiDaS depth and YOLOv8 detection concurrently on the same frame.
+
+    The two models are independent, so they are dispatched together on two
+    dedicated threads, each capped to its share of the intra-op thread budget
+    instead of both grabbing every core.
+    """
+
+    def __init__(self, detector, depth_estimator, threads=None, depth_share=0.5):
+        """
+        detector: YOLOv8Runner
+        depth_estimator: MiDaSRunner
+        threads: total torch intra-op threads for both models (default: all cores)
+        depth_share: fraction of the thread budget given to MiDaS
+        """
+        self.detector = detector
+        self.depth_estimator = depth_estimator
+
+        total = threads or os.cpu_count() or 1
+        self.depth_threads, self.detection_threads = split_thread_budget(total, depth_share)
+
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="perception")
+
+        logger.info(
+            f"PerceptionRunner ready | Depth threads: {self.depth_threads} | "
+            f"Detection threads: {self.detection_threads}"
+        )
+
+    @staticmethod
+    def _with_threads(num_threads, fn, *args):
+        # torch thread settings are per calling thread with the OpenMP backend
+        torch.set_num_threads(num_threads)
+        return fn(*args)
+
+    def run(self, image, detections_json_path, depth_output_path, write_detections=False):
+        """
+        image: numpy BGR image (from cv2)
+        detections_json_path: where to save detections.json
+        depth_output_path: where to save depth.png
+        write_detections: also write detections_json_path
+
+        Returns (detections, depth_img, depth_norm).
+        """
+        depth_future = self.executor.submit(
+            self._with_threads, self.depth_threads,
+            self.depth_estimator.run, image, depth_output_path
+        )
+        detection_future = self.executor.submit(
+            self._with_threads, self.detection_threads,
+            functools.partial(self.detector.run, write_json=write_detections),
+            image, detections_json_path
+        )
+
+        detections = detection_future.result()
+        depth_img, depth_norm = depth_future.result()
+
+        return detections, depth_img, depth_norm
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -2,6 +2,8 @@ import json
 import logging
 from typing import Optional, Dict, Any
 
+from src.scene.scene_format import SceneFile
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -38,21 +40,36 @@ class PromptGenerator:
         logger.info(f"Generated Prompt-Based: {prompt}")
         return prompt
 
+    @staticmethod
+    def _load_scene_summary(scene_path: str):
+        """
+        Reads only what the auto-design prompt needs: object labels and the
+        scene-level metadata. Binary .npz scenes are read field by field,
+        so objects, depth and masks are never decoded.
+        """
+        if scene_path.endswith(".npz"):
+            with SceneFile(scene_path) as scene:
+                labels = [] if scene.labels is None else scene.labels.tolist()
+                return labels, scene.meta
+
+        with open(scene_path, 'r') as f:
+            scene_data = json.load(f)
+        labels = [obj.get("label", "") for obj in scene_data.get("objects", [])]
+        return labels, scene_data
+
     def generate_auto_design_prompt(self, scene_json_path: str) -> str:
         """
-        Mode 3: Auto-Design based on scene analysis.
+        Mode 3: Auto-Design based on scene analysis (.json or binary .npz scene).
         """
         try:
-            with open(scene_json_path, 'r') as f:
-                scene_data = json.load(f)
+            labels, scene_data = self._load_scene_summary(scene_json_path)
         except Exception as e:
             logger.error(f"Failed to load scene JSON: {e}")
             return f"professional interior design, {self.SAFETY_SUFFIX}"
 
         # 1. Detect dominant object/room type
-        objects = scene_data.get("objects", [])
         room_type = "room"
-        object_labels = [obj.get("label", "").lower() for obj in objects]
+        object_labels = [label.lower() for label in labels]
         
         if any(label in ["sofa", "couch", "tv", "coffee table"] for label in object_labels):
             room_type = "living room"
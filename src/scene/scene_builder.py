@@ -1,57 +1,471 @@
-import os
-import json
-import numpy as np
-import cv2
-
-
-class SceneBuilder:
-    def __init__(self):
-        print("[INFO] SceneBuilder initialized")
-
-    def build_scene(self, depth_norm, detections, mask_paths, output_path):
-        """
-        depth_norm: normalized depth map (0–1 float array)
-        detections: YOLO detections list
-        mask_paths: list of mask image paths
-        """
-
-        scene_objects = []
-
-        for idx, det in enumerate(detections):
-            mask = cv2.imread(mask_paths[idx], cv2.IMREAD_GRAYSCALE)
-
-            # Resize mask if needed
-            if mask.shape != depth_norm.shape:
-                mask = cv2.resize(mask, (depth_norm.shape[1], depth_norm.shape[0]))
-
-            mask_binary = mask > 0
-
-            # Compute average depth inside mask
-            if np.sum(mask_binary) > 0:
-                avg_depth = float(np.mean(depth_norm[mask_binary]))
-            else:
-                avg_depth = 0.0
-
-            obj_data = {
-                "object_id": idx + 1,
-                "bbox": det["bbox"],
-                "class_id": det["class_id"],
-                "confidence": det["confidence"],
-                "average_depth": avg_depth
-            }
-
-            scene_objects.append(obj_data)
-
-        scene = {
-            "frame_id": "frame_0001",
-            "objects": scene_objects
-        }
-
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-        with open(output_path, "w") as f:
-            json.dump(scene, f, indent=4)
-
-        print(f"[INFO] Scene saved at {output_path}")
-
-        return scene
+import os
+import json
+import numpy as np
+import cv2
+from scipy.optimize import linear_sum_assignment
+
+from src.scene.scene_format import save_scene_npz
+
+
+def object_depth_stats(depth_norm, masks):
+    """
+    depth_norm: (H, W) normalized depth map
+    masks: (N, H, W) boolean masks, may overlap
+
+    Computes per-object depth statistics for all masks in one vectorized pass.
+    Returns a dict of (N,) arrays: mean, median, min, max, area.
+    """
+    n = len(masks)
+    depth = depth_norm.reshape(-1)
+
+    # (object, pixel) pairs for every masked pixel, grouped by object
+    obj_idx, pix_idx = np.nonzero(masks.reshape(n, depth_norm.size))
+    values = depth[pix_idx]
+
+    area = np.bincount(obj_idx, minlength=n)
+    stats = {
+        "mean": np.zeros(n),
+        "median": np.zeros(n),
+        "min": np.zeros(n),
+        "max": np.zeros(n),
+        "area": area
+    }
+
+    present = area > 0
+    if not present.any():
+        return stats
+
+    sums = np.bincount(obj_idx, weights=values, minlength=n)
+    stats["mean"][present] = sums[present] / area[present]
+
+    starts = np.concatenate(([0], np.cumsum(area)[:-1]))[present]
+    stats["min"][present] = np.minimum.reduceat(values, starts)
+    stats["max"][present] = np.maximum.reduceat(values, starts)
+
+    # Sort depth within each object's group, then pick the middle element(s)
+    values = values[np.lexsort((values, obj_idx))]
+    lower = values[starts + (area[present] - 1) // 2]
+    upper = values[starts + area[present] // 2]
+    stats["median"][present] = (lower + upper) / 2
+
+    return stats
+
+
+def object_depth_histograms(depth_norm, masks, bins=64):
+    """
+    (N, bins) histograms of the depth values under each mask, computed in
+    one bincount. Histograms can be summed across frames, which gives an
+    incremental (binned) median.
+    """
+    n = len(masks)
+    obj_idx, pix_idx = np.nonzero(masks.reshape(n, depth_norm.size))
+    bin_idx = np.clip((depth_norm.reshape(-1)[pix_idx] * bins).astype(np.int64), 0, bins - 1)
+    return np.bincount(obj_idx * bins + bin_idx, minlength=n * bins).reshape(n, bins)
+
+
+def histogram_median(hist):
+    """
+    Median of a 0–1 value histogram, interpolated within the median bin.
+    """
+    total = hist.sum()
+    if total == 0:
+        return 0.0
+
+    cumulative = np.cumsum(hist)
+    idx = int(np.searchsorted(cumulative, total / 2))
+    before = cumulative[idx - 1] if idx > 0 else 0
+    fraction = (total / 2 - before) / hist[idx]
+    return float((idx + fraction) / len(hist))
+
+
+def box_iou(a, b):
+    """
+    Pairwise IoU of (N, 4) and (M, 4) [x1, y1, x2, y2] boxes, shape (N, M).
+    """
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def _box_slice(bbox, shape):
+    h, w = shape
+    x1, y1, x2, y2 = np.round(bbox).astype(int)
+    x1, x2 = np.clip([x1, x2], 0, w)
+    y1, y2 = np.clip([y1, y2], 0, h)
+    return slice(y1, y2), slice(x1, x2)
+
+
+def _paste_mask(crop, bbox, shape):
+    """
+    Places a mask crop into bbox on an empty (H, W) canvas, rescaling it to
+    the box size. Used to carry a track's mask to frames it was not
+    segmented in.
+    """
+    mask = np.zeros(shape, dtype=bool)
+    rows, cols = _box_slice(bbox, shape)
+    height, width = rows.stop - rows.start, cols.stop - cols.start
+    if height <= 0 or width <= 0 or crop.size == 0:
+        return mask
+
+    resized = cv2.resize(crop.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+    mask[rows, cols] = resized > 0
+    return mask
+
+
+def _detection_columns(detections):
+    """
+    Accepts YOLO detections as a list of dicts or as columnar arrays.
+    """
+    if isinstance(detections, dict):
+        bbox = detections["bbox"]
+        class_id = detections["class_id"]
+        confidence = detections["confidence"]
+    else:
+        bbox = [det["bbox"] for det in detections]
+        class_id = [det["class_id"] for det in detections]
+        confidence = [det["confidence"] for det in detections]
+
+    return (
+        np.asarray(bbox, dtype=np.float32).reshape(-1, 4),
+        np.asarray(class_id, dtype=np.int64).reshape(-1),
+        np.asarray(confidence, dtype=np.float32).reshape(-1)
+    )
+
+
+class SceneBuilder:
+    def __init__(self):
+        print("[INFO] SceneBuilder initialized")
+
+    @staticmethod
+    def _stack_masks(masks, shape):
+        """
+        Accepts a stacked (N, H, W) mask array or a list of mask PNG paths and
+        returns boolean masks matching the depth map shape.
+        """
+        if isinstance(masks, np.ndarray):
+            stacked = masks
+        else:
+            stacked = [cv2.imread(path, cv2.IMREAD_GRAYSCALE) for path in masks]
+
+        if len(stacked) == 0:
+            return np.zeros((0,) + shape, dtype=bool)
+
+        if stacked[0].shape != shape:
+            # Resize mask if needed
+            stacked = [
+                cv2.resize(mask.astype(np.uint8) * 255 if mask.dtype == bool else mask, (shape[1], shape[0]))
+                for mask in stacked
+            ]
+
+        return np.asarray(stacked) > 0
+
+    def build_scene(self, depth_norm, detections, masks, output_path=None, frame_id="frame_0001"):
+        """
+        depth_norm: normalized depth map (0–1 float array)
+        detections: YOLO detections (list of dicts or columnar arrays)
+        masks: stacked (N, H, W) mask array from SAMRunner.run_batch,
+               or a list of mask image paths
+        output_path: optional scene.json (or binary scene.npz) path; when
+                     omitted nothing is written and save_scene() can be called later
+        frame_id: id stored in the scene
+        """
+
+        bbox, class_id, confidence = _detection_columns(detections)
+        masks = self._stack_masks(masks, depth_norm.shape)
+        stats = object_depth_stats(depth_norm, masks)
+
+        scene_objects = []
+
+        for idx, (box, cls, conf) in enumerate(zip(bbox.tolist(), class_id.tolist(), confidence.tolist())):
+            obj_data = {
+                "object_id": idx + 1,
+                "bbox": box,
+                "class_id": cls,
+                "confidence": conf,
+                "average_depth": float(stats["mean"][idx]),
+                "median_depth": float(stats["median"][idx]),
+                "min_depth": float(stats["min"][idx]),
+                "max_depth": float(stats["max"][idx]),
+                "pixel_area": int(stats["area"][idx])
+            }
+
+            scene_objects.append(obj_data)
+
+        scene = {
+            "frame_id": frame_id,
+            "objects": scene_objects
+        }
+
+        if output_path is not None:
+            self.save_scene(scene, output_path, depth_norm=depth_norm, masks=masks)
+
+        return scene
+
+    def save_scene(self, scene, output_path, depth_norm=None, masks=None):
+        """
+        Writes a scene dict as JSON, or as a binary .npz container when
+        output_path ends in ".npz" (which also stores the depth map and
+        bit-packed masks when given).
+        """
+        if output_path.endswith(".npz"):
+            save_scene_npz(output_path, scene, depth=depth_norm, masks=masks)
+            print(f"[INFO] Scene saved at {output_path}")
+            return output_path
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        with open(output_path, "w") as f:
+            json.dump(scene, f, indent=4)
+
+        print(f"[INFO] Scene saved at {output_path}")
+
+        return output_path
+
+
+class _Track:
+    """
+    One physical object followed across frames, with running statistics.
+    """
+
+    def __init__(self, track_id, class_id, bins):
+        self.track_id = track_id
+        self.class_id = class_id
+        self.bbox = None
+        self.mask_crop = None
+        self.mask_frame = -1
+
+        self.hits = 0
+        self.missed = 0
+        self.first_frame = None
+        self.last_frame = None
+        self.confidence_sum = 0.0
+
+        self.depth_sum = 0.0
+        self.pixels = 0
+        self.min_depth = np.inf
+        self.max_depth = -np.inf
+        self.histogram = np.zeros(bins, dtype=np.int64)
+
+    def update_box(self, bbox, confidence, frame_id):
+        self.bbox = bbox
+        self.hits += 1
+        self.missed = 0
+        self.confidence_sum += float(confidence)
+        self.last_frame = frame_id
+        if self.first_frame is None:
+            self.first_frame = frame_id
+
+    def set_mask(self, mask, frame_index):
+        rows, cols = _box_slice(self.bbox, mask.shape)
+        self.mask_crop = mask[rows, cols].copy()
+        self.mask_frame = frame_index
+
+    def update_depth(self, mean, area, min_depth, max_depth, histogram):
+        if area == 0:
+            return
+        self.depth_sum += mean * area
+        self.pixels += int(area)
+        self.min_depth = min(self.min_depth, float(min_depth))
+        self.max_depth = max(self.max_depth, float(max_depth))
+        self.histogram += histogram
+
+    def to_object(self):
+        seen = self.pixels > 0
+        return {
+            "object_id": self.track_id,
+            "bbox": [float(v) for v in self.bbox],
+            "class_id": int(self.class_id),
+            "confidence": self.confidence_sum / self.hits,
+            "average_depth": self.depth_sum / self.pixels if seen else 0.0,
+            "median_depth": histogram_median(self.histogram),
+            "min_depth": self.min_depth if seen else 0.0,
+            "max_depth": self.max_depth if seen else 0.0,
+            "pixel_area": self.pixels // self.hits,
+            "frames_seen": self.hits,
+            "first_frame": self.first_frame,
+            "last_frame": self.last_frame
+        }
+
+
+class ScanSceneBuilder:
+    """
+    Builds one consolidated room scene from a stream of frames.
+
+    Detections are associated with existing tracks by IoU (Hungarian
+    assignment per class). Segmentation only runs for detections that start
+    a new track (or whose mask is older than refresh_every frames); other
+    tracks reuse their last mask, rescaled to the current box. Per-object
+    depth statistics are accumulated incrementally, the median through a
+    running depth histogram.
+    """
+
+    def __init__(
+        self,
+        segmenter=None,
+        iou_threshold=0.3,
+        max_missed=15,
+        min_hits=2,
+        refresh_every=None,
+        depth_bins=256,
+        scan_id="scan_0001"
+    ):
+        """
+        segmenter: SAMRunner (or anything with run_batch(image, detections));
+                   without one, box-shaped masks are used
+        iou_threshold: minimum IoU to continue a track
+        max_missed: frames a track may go undetected before it can no longer be matched
+        min_hits: frames an object must be seen in to appear in the scene (drops flicker)
+        refresh_every: re-segment a track after this many frames (None: never)
+        depth_bins: histogram resolution of the running median
+        scan_id: id stored in the consolidated scene
+        """
+        self.scene_builder = SceneBuilder()
+        self.segmenter = segmenter
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        self.refresh_every = refresh_every
+        self.depth_bins = depth_bins
+        self.scan_id = scan_id
+
+        self.tracks = []
+        self.num_frames = 0
+        self.num_detections = 0
+        self.num_segmented = 0
+
+    def _associate(self, bbox, class_id):
+        """
+        Returns a track (or None) per detection.
+        """
+        active = [t for t in self.tracks if t.missed <= self.max_missed]
+        assigned = [None] * len(bbox)
+
+        if not active or len(bbox) == 0:
+            return assigned
+
+        iou = box_iou(bbox, np.array([t.bbox for t in active]))
+        # Objects never change class, forbid cross-class matches
+        iou[class_id[:, None] != np.array([t.class_id for t in active])[None, :]] = 0
+
+        rows, cols = linear_sum_assignment(-iou)
+        for row, col in zip(rows, cols):
+            if iou[row, col] >= self.iou_threshold:
+                assigned[row] = active[col]
+
+        return assigned
+
+    def add_frame(self, image, detections, depth_norm, masks=None, frame_id=None):
+        """
+        image: numpy BGR frame (only needed when segmentation runs)
+        detections: YOLO detections of the frame (list of dicts or columnar arrays)
+        depth_norm: normalized depth map of the frame
+        masks: optional (N, H, W) masks for every detection; skips the segmenter
+
+        Returns the track id of every detection.
+        """
+        frame_index = self.num_frames
+        frame_id = frame_id or f"frame_{frame_index + 1:04d}"
+        self.num_frames += 1
+
+        bbox, class_id, confidence = _detection_columns(detections)
+        self.num_detections += len(bbox)
+        shape = depth_norm.shape
+
+        tracks = self._associate(bbox, class_id)
+        matched = {id(track) for track in tracks if track is not None}
+        for track in self.tracks:
+            if id(track) not in matched:
+                track.missed += 1
+
+        for idx, track in enumerate(tracks):
+            if track is None:
+                track = _Track(len(self.tracks) + 1, class_id[idx], self.depth_bins)
+                self.tracks.append(track)
+                tracks[idx] = track
+            track.update_box(bbox[idx], confidence[idx], frame_id)
+
+        if len(tracks) == 0:
+            return []
+
+        if masks is None:
+            masks = self._track_masks(image, tracks, frame_index, shape)
+        else:
+            masks = SceneBuilder._stack_masks(masks, shape)
+            for track, mask in zip(tracks, masks):
+                track.set_mask(mask, frame_index)
+
+        stats = object_depth_stats(depth_norm, masks)
+        histograms = object_depth_histograms(depth_norm, masks, self.depth_bins)
+        for idx, track in enumerate(tracks):
+            track.update_depth(
+                stats["mean"][idx], stats["area"][idx],
+                stats["min"][idx], stats["max"][idx], histograms[idx]
+            )
+
+        return [track.track_id for track in tracks]
+
+    def _track_masks(self, image, tracks, frame_index, shape):
+        """
+        Segments new (or stale) tracks in one batch and carries every other
+        track's last mask over to its current box.
+        """
+        stale = [
+            idx for idx, track in enumerate(tracks)
+            if track.mask_crop is None
+            or (self.refresh_every is not None and frame_index - track.mask_frame >= self.refresh_every)
+        ]
+        stale_set = set(stale)
+
+        masks = np.zeros((len(tracks),) + shape, dtype=bool)
+
+        if stale:
+            boxes = np.array([tracks[idx].bbox for idx in stale])
+            if self.segmenter is not None:
+                fresh = SceneBuilder._stack_masks(self.segmenter.run_batch(image, {"bbox": boxes}), shape)
+                self.num_segmented += len(stale)
+            else:
+                fresh = np.zeros((len(stale),) + shape, dtype=bool)
+                for mask, box in zip(fresh, boxes):
+                    mask[_box_slice(box, shape)] = True
+
+            for idx, mask in zip(stale, fresh):
+                tracks[idx].set_mask(mask, frame_index)
+                masks[idx] = mask
+
+        for idx, track in enumerate(tracks):
+            if idx not in stale_set:
+                masks[idx] = _paste_mask(track.mask_crop, track.bbox, shape)
+
+        return masks
+
+    def build_scene(self, output_path=None):
+        """
+        Consolidated scene of every object seen in at least min_hits frames.
+        object_id is the track id; depth statistics cover all frames.
+        """
+        objects = [t.to_object() for t in self.tracks if t.hits >= self.min_hits]
+
+        scene = {
+            "scan_id": self.scan_id,
+            "num_frames": self.num_frames,
+            "objects": objects
+        }
+
+        print(
+            f"[INFO] Scan scene: {len(objects)} object(s) from {self.num_frames} frame(s), "
+            f"{self.num_segmented}/{self.num_detections} detections segmented"
+        )
+
+        if output_path is not None:
+            self.scene_builder.save_scene(scene, output_path)
+
+        return scene
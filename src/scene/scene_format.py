@@ -0,0 +1,190 @@
+import os
+import json
+import numpy as np
+
+from src.cache import pack_masks, unpack_masks
+
+
+# One row per scene object, same fields as the JSON "objects" entries
+OBJECT_DTYPE = np.dtype([
+    ("object_id", np.int32),
+    ("bbox", np.float32, (4,)),
+    ("class_id", np.int32),
+    ("confidence", np.float32),
+    ("average_depth", np.float32),
+    ("median_depth", np.float32),
+    ("min_depth", np.float32),
+    ("max_depth", np.float32),
+    ("pixel_area", np.int64)
+])
+
+_JSON_DEFAULTS = {"object_id": 0, "bbox": [0, 0, 0, 0], "class_id": -1, "confidence": 0.0}
+
+
+def scene_to_arrays(scene):
+    """
+    Splits a scene dict (JSON layout) into a structured object array,
+    a label array (None when no object has a label), the remaining
+    scene-level metadata and the object fields the scene actually uses.
+    Per-object keys outside OBJECT_DTYPE (other than "label") are dropped.
+    """
+    objects = scene.get("objects", [])
+    fields = [name for name in OBJECT_DTYPE.names if any(name in obj for obj in objects)]
+
+    table = np.array(
+        [tuple(obj.get(name, _JSON_DEFAULTS.get(name, 0)) for name in OBJECT_DTYPE.names) for obj in objects],
+        dtype=OBJECT_DTYPE
+    )
+
+    labels = None
+    if any("label" in obj for obj in objects):
+        labels = np.array([obj.get("label", "") for obj in objects], dtype=str)
+
+    meta = {k: v for k, v in scene.items() if k != "objects"}
+    return table, labels, meta, fields
+
+
+def _to_json_value(value):
+    if value.dtype == np.float32:
+        # Shortest decimal that round-trips the float32 (0.95, not 0.949999988)
+        return [float(str(v)) for v in value] if value.ndim else float(str(value))
+    return value.tolist()
+
+
+def arrays_to_scene(table, labels=None, meta=None, fields=None):
+    """
+    Inverse of scene_to_arrays(), rebuilds the JSON layout.
+    fields: object fields to emit (default: all of OBJECT_DTYPE)
+    """
+    fields = OBJECT_DTYPE.names if fields is None else fields
+
+    objects = []
+    for idx in range(len(table)):
+        obj = {name: _to_json_value(table[name][idx]) for name in fields}
+        if labels is not None:
+            obj["label"] = str(labels[idx])
+        objects.append(obj)
+
+    return {**(meta or {}), "objects": objects}
+
+
+def save_scene_npz(path, scene, depth=None, masks=None):
+    """
+    Writes a scene as an uncompressed .npz container:
+    objects (structured array), labels, meta (JSON bytes), and optionally
+    the depth map (float16) and bit-packed masks.
+    """
+    table, labels, meta, fields = scene_to_arrays(scene)
+
+    arrays = {
+        "objects": table,
+        "fields": np.array(fields, dtype=str),
+        "meta": np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    }
+    if labels is not None:
+        arrays["labels"] = labels
+    if depth is not None:
+        arrays["depth"] = np.asarray(depth, dtype=np.float16)
+    if masks is not None:
+        arrays["masks"] = pack_masks(masks)
+        arrays["mask_shape"] = np.asarray(np.shape(masks))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # np.savez appends ".npz" to names without it, write through a handle instead
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+class SceneFile:
+    """
+    Lazy reader for .npz scenes: each field is only read (and decoded)
+    when it is first accessed, so reading the labels of a frame never
+    touches its depth map or masks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._npz = np.load(path, allow_pickle=False)
+        self._cache = {}
+
+    def _field(self, name, decode=lambda value: value):
+        if name not in self._cache:
+            self._cache[name] = decode(self._npz[name]) if name in self._npz.files else None
+        return self._cache[name]
+
+    @property
+    def objects(self):
+        return self._field("objects")
+
+    @property
+    def labels(self):
+        return self._field("labels")
+
+    @property
+    def meta(self):
+        return self._field("meta", lambda value: json.loads(value.tobytes().decode()))
+
+    @property
+    def depth(self):
+        return self._field("depth")
+
+    @property
+    def masks(self):
+        if "masks" not in self._cache:
+            packed = self._field("masks")
+            shape = self._field("mask_shape")
+            self._cache["masks"] = None if packed is None else unpack_masks(packed, tuple(shape))
+        return self._cache["masks"]
+
+    def to_dict(self):
+        """
+        The scene in the JSON layout (objects and metadata only).
+        """
+        return arrays_to_scene(self.objects, self.labels, self.meta, self._field("fields").tolist())
+
+    def close(self):
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_scene(path):
+    """
+    Loads a scene dict from either a .json or a .npz scene file.
+    """
+    if path.endswith(".npz"):
+        with SceneFile(path) as scene:
+            return scene.to_dict()
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def json_to_npz(json_path, npz_path=None):
+    """
+    Converts a scene JSON file to the binary container.
+    """
+    npz_path = npz_path or os.path.splitext(json_path)[0] + ".npz"
+    with open(json_path, "r") as f:
+        return save_scene_npz(npz_path, json.load(f))
+
+
+def npz_to_json(npz_path, json_path=None):
+    """
+    Converts a binary scene back to the JSON layout (depth and masks are
+    not part of the JSON format and are dropped).
+    """
+    json_path = json_path or os.path.splitext(npz_path)[0] + ".json"
+    os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+    with open(json_path, "w") as f:
+        json.dump(load_scene(npz_path), f, indent=4)
+    return json_path
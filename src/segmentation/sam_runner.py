@@ -1,57 +1,338 @@
-import os
-import cv2
-import torch
-import numpy as np
-from segment_anything import sam_model_registry, SamPredictor
-
-
-class SAMRunner:
-    def __init__(self, checkpoint_path="sam_vit_b_01ec64.pth", model_type="vit_b"):
-        """
-        model_type:
-        - vit_b (recommended for CPU)
-        """
-
-        self.device = "cpu"
-
-        sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
-        sam.to(self.device)
-        sam.eval()
-
-        self.predictor = SamPredictor(sam)
-
-        print(f"[INFO] Loaded SAM {model_type} on CPU")
-
-    def run(self, image, detections, output_dir):
-        """
-        image: numpy BGR image
-        detections: list from YOLO (bbox format: [x1, y1, x2, y2])
-        output_dir: folder to save masks
-        """
-
-        os.makedirs(output_dir, exist_ok=True)
-
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        self.predictor.set_image(image_rgb)
-
-        mask_paths = []
-
-        for idx, det in enumerate(detections):
-            bbox = det["bbox"]
-            input_box = np.array(bbox)
-
-            masks, scores, logits = self.predictor.predict(
-                box=input_box,
-                multimask_output=False
-            )
-
-            mask = masks[0].astype(np.uint8) * 255
-
-            mask_filename = os.path.join(output_dir, f"obj_{idx+1:02d}.png")
-            cv2.imwrite(mask_filename, mask)
-
-            mask_paths.append(mask_filename)
-
-            print(f"[INFO] Saved mask: {mask_filename}")
-
-        return mask_paths
+import os
+import cv2
+import queue
+import threading
+import torch
+import numpy as np
+from segment_anything import sam_model_registry, SamPredictor
+
+from src.cache import LRUCache, content_hash, file_hash
+from src.optimizations import (
+    export_onnx,
+    OnnxRunner,
+    quantize_dynamic_int8,
+    resolve_precision,
+    cpu_autocast,
+    versioned_cache_dir,
+    versioned_cache_key,
+    module_identity,
+    ONNX_OPSET
+)
+
+
+class _MaskDecoderExport(torch.nn.Module):
+    """
+    Single-mask decoder call with a flat signature for the ONNX exporter.
+    """
+
+    def __init__(self, mask_decoder):
+        super().__init__()
+        self.mask_decoder = mask_decoder
+
+    def forward(self, image_embeddings, image_pe, sparse_prompt_embeddings, dense_prompt_embeddings):
+        return self.mask_decoder(
+            image_embeddings=image_embeddings,
+            image_pe=image_pe,
+            sparse_prompt_embeddings=sparse_prompt_embeddings,
+            dense_prompt_embeddings=dense_prompt_embeddings,
+            multimask_output=False
+        )
+
+
+class MaskWriter:
+    """
+    Background PNG writer so mask encoding never blocks segmentation.
+    """
+
+    def __init__(self, max_pending=64):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            path, mask = self.queue.get()
+            try:
+                cv2.imwrite(path, mask.astype(np.uint8) * 255)
+                print(f"[INFO] Saved mask: {path}")
+            except Exception as e:
+                print(f"[ERROR] Could not save mask {path}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def submit(self, path, mask):
+        self.queue.put((path, mask))
+
+    def flush(self):
+        """
+        Blocks until every submitted mask is on disk.
+        """
+        self.queue.join()
+
+
+class SAMRunner:
+    def __init__(
+        self,
+        checkpoint_path="sam_vit_b_01ec64.pth",
+        model_type="vit_b",
+        embedding_cache_mb=256,
+        embedding_cache_dir=None,
+        backend="torch",
+        onnx_dir="onnx/sam",
+        quantize=False,
+        quantized_dir="quantized/sam",
+        precision="fp32",
+        perception_cache=None
+    ):
+        """
+        model_type:
+        - vit_b (recommended for CPU)
+        embedding_cache_mb: in-memory LRU budget for image embeddings
+        embedding_cache_dir: optional folder persisting embeddings as .npy
+        backend: "torch" or "onnx" (mask decoder on ONNX Runtime, falls back to torch)
+        onnx_dir: where the exported decoder graph is stored and reused
+        quantize: dynamic int8 quantization of the ViT image encoder
+        quantized_dir: where quantized weights are cached
+        precision: "fp32", "bf16" or "auto" (image encoder under bf16 autocast
+                   on AVX512-BF16/AMX CPUs)
+        perception_cache: optional PerceptionCache shared with YOLO and MiDaS
+                          (masks keyed by image, boxes, weights and embedding_key)
+        """
+
+        self.device = "cpu"
+        self.model_type = model_type
+
+        if precision != "fp32" and quantize:
+            print("[WARN] bf16 autocast needs the unquantized encoder, using fp32")
+            precision = "fp32"
+        self.precision = resolve_precision(precision)
+
+        # Quantized/bf16 encoders produce different embeddings, keep their cache entries apart
+        self.embedding_key = model_type
+        if quantize:
+            self.embedding_key = f"{model_type}-int8"
+        elif self.precision == "bf16":
+            self.embedding_key = f"{model_type}-bf16"
+
+        sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
+        sam.to(self.device)
+        sam.eval()
+
+        # Keys the ONNX/int8/embedding/perception caches, taken before quantization changes the weights
+        model_id = None
+        if quantize or backend == "onnx" or embedding_cache_dir or perception_cache is not None:
+            model_id = file_hash(checkpoint_path) if checkpoint_path else module_identity(sam)
+
+        if quantize:
+            sam.image_encoder = quantize_dynamic_int8(
+                sam.image_encoder,
+                os.path.join(
+                    versioned_cache_dir(quantized_dir, model_type, model_id),
+                    f"{model_type}_image_encoder_int8.pt"
+                )
+            )
+
+        self.predictor = SamPredictor(sam)
+        self.writer = None
+        self.perception_cache = perception_cache
+        self.weights_key = versioned_cache_key(model_type, model_id)
+        self.cache_id = f"sam-{self.embedding_key}-{self.weights_key}"
+
+        self.embedding_cache = LRUCache(embedding_cache_mb * 1024 * 1024, name="SAM embeddings")
+        self.embedding_cache_dir = embedding_cache_dir
+        if embedding_cache_dir:
+            os.makedirs(embedding_cache_dir, exist_ok=True)
+
+        self.backend = "torch"
+        if backend == "onnx":
+            onnx_dir = versioned_cache_dir(onnx_dir, model_type, model_id, ONNX_OPSET)
+            self.enable_onnx(os.path.join(onnx_dir, f"{model_type}_mask_decoder.onnx"))
+
+        print(f"[INFO] Loaded SAM {model_type} on CPU ({self.backend} backend)")
+
+    def enable_onnx(self, onnx_path):
+        """
+        Exports the mask decoder once and routes single-mask decoder calls
+        through ONNX Runtime. Keeps the PyTorch decoder if export fails.
+        """
+        sam = self.predictor.model
+        decoder = sam.mask_decoder
+        embed_dim = sam.prompt_encoder.embed_dim
+        embed_size = sam.prompt_encoder.image_embedding_size
+
+        example = (
+            torch.randn(1, embed_dim, *embed_size),
+            torch.randn(1, embed_dim, *embed_size),
+            torch.randn(2, 2, embed_dim),
+            torch.randn(2, embed_dim, *embed_size)
+        )
+
+        try:
+            export_onnx(
+                _MaskDecoderExport(decoder),
+                example,
+                onnx_path,
+                input_names=["image_embeddings", "image_pe", "sparse_prompt_embeddings", "dense_prompt_embeddings"],
+                output_names=["low_res_masks", "iou_predictions"],
+                dynamic_axes={
+                    "sparse_prompt_embeddings": {0: "boxes", 1: "tokens"},
+                    "dense_prompt_embeddings": {0: "boxes"},
+                    "low_res_masks": {0: "boxes"},
+                    "iou_predictions": {0: "boxes"}
+                }
+            )
+            session = OnnxRunner(onnx_path)
+        except Exception as e:
+            print(f"[WARN] ONNX backend unavailable ({e}), using PyTorch")
+            return
+
+        torch_forward = decoder.forward
+
+        def forward(image_embeddings, image_pe, sparse_prompt_embeddings, dense_prompt_embeddings, multimask_output):
+            if multimask_output:
+                return torch_forward(image_embeddings, image_pe, sparse_prompt_embeddings,
+                                     dense_prompt_embeddings, multimask_output)
+            low_res_masks, iou_predictions = session(
+                image_embeddings, image_pe, sparse_prompt_embeddings, dense_prompt_embeddings
+            )
+            return low_res_masks, iou_predictions
+
+        decoder.forward = forward
+        self.backend = "onnx"
+
+    def run(self, image, detections, output_dir):
+        """
+        image: numpy BGR image
+        detections: list from YOLO (bbox format: [x1, y1, x2, y2])
+        output_dir: folder to save masks
+        """
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        masks = self.run_batch(image, detections)
+
+        mask_paths = []
+
+        for idx, mask in enumerate(masks):
+            mask_filename = os.path.join(output_dir, f"obj_{idx+1:02d}.png")
+            cv2.imwrite(mask_filename, mask.astype(np.uint8) * 255)
+
+            mask_paths.append(mask_filename)
+
+            print(f"[INFO] Saved mask: {mask_filename}")
+
+        return mask_paths
+
+    @staticmethod
+    def _boxes(detections):
+        """
+        Accepts YOLO detections as a list of dicts or as columnar arrays.
+        """
+        if isinstance(detections, dict):
+            return np.asarray(detections["bbox"], dtype=np.float32).reshape(-1, 4)
+        return np.asarray([det["bbox"] for det in detections], dtype=np.float32).reshape(-1, 4)
+
+    def set_image(self, image_rgb):
+        """
+        Sets the predictor image, reusing a cached embedding when the same
+        frame content was encoded before (in memory or in the disk store).
+        """
+        key = content_hash(image_rgb, self.embedding_key, self.weights_key)
+
+        features = self.embedding_cache.get(key)
+
+        if features is None and self.embedding_cache_dir:
+            path = os.path.join(self.embedding_cache_dir, f"{key}.npy")
+            if os.path.exists(path):
+                # Copy-on-write mapping, pages are only read when the decoder needs them
+                features = torch.from_numpy(np.load(path, mmap_mode="c"))
+                self.embedding_cache.put(key, features)
+
+        if features is None:
+            with cpu_autocast(self.precision):
+                self.predictor.set_image(image_rgb)
+
+            # The mask decoder runs in fp32
+            features = self.predictor.features.float()
+            self.predictor.features = features
+            self.embedding_cache.put(key, features)
+            if self.embedding_cache_dir:
+                path = os.path.join(self.embedding_cache_dir, f"{key}.npy")
+                # Unique per writer, concurrent writers of the same key never share it
+                tmp_path = os.path.join(
+                    self.embedding_cache_dir, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+                )
+                np.save(tmp_path, features.cpu().numpy())
+                os.replace(tmp_path, path)
+            return
+
+        # Restore the predictor state set_image() would have produced
+        self.predictor.reset_image()
+        self.predictor.original_size = tuple(image_rgb.shape[:2])
+        self.predictor.input_size = self.predictor.transform.get_preprocess_shape(
+            image_rgb.shape[0], image_rgb.shape[1], self.predictor.transform.target_length
+        )
+        self.predictor.features = features
+        self.predictor.is_image_set = True
+
+    def _predict_masks(self, image, boxes):
+        if len(boxes) == 0:
+            return np.zeros((0,) + image.shape[:2], dtype=bool)
+
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        self.set_image(image_rgb)
+
+        input_boxes = torch.as_tensor(boxes, device=self.predictor.device)
+        input_boxes = self.predictor.transform.apply_boxes_torch(input_boxes, image_rgb.shape[:2])
+
+        with torch.no_grad():
+            masks, scores, logits = self.predictor.predict_torch(
+                point_coords=None,
+                point_labels=None,
+                boxes=input_boxes,
+                multimask_output=False
+            )
+
+        return masks[:, 0].cpu().numpy()
+
+    def run_batch(self, image, detections, output_dir=None):
+        """
+        image: numpy BGR image
+        detections: YOLO detections (list of dicts or columnar arrays)
+        output_dir: optional folder; masks are then written as PNGs by a
+                    background writer (call flush() to wait for them)
+
+        All boxes go through the mask decoder in a single call. Masks found
+        in the perception cache skip the encoder and the decoder.
+        Returns a stacked boolean array of shape (N, H, W).
+        """
+
+        boxes = self._boxes(detections)
+
+        masks = key = None
+        if self.perception_cache is not None:
+            key = self.perception_cache.key(image, self.cache_id, boxes=boxes)
+            masks = self.perception_cache.get_masks(key)
+
+        if masks is None:
+            masks = self._predict_masks(image, boxes)
+            if key is not None:
+                self.perception_cache.put_masks(key, masks)
+
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+            if self.writer is None:
+                self.writer = MaskWriter()
+
+            for idx, mask in enumerate(masks):
+                self.writer.submit(os.path.join(output_dir, f"obj_{idx+1:02d}.png"), mask)
+
+        return masks
+
+    def flush(self):
+        """
+        Waits for pending background mask writes.
+        """
+        if self.writer is not None:
+            self.writer.flush()
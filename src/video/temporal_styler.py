@@ -0,0 +1,241 @@
+import cv2
+import numpy as np
+import logging
+from PIL import Image
+
+from src.video.video_maker import VideoMaker
+
+logger = logging.getLogger(__name__)
+
+
+def histogram_distance(frame_a, frame_b, bins=(16, 16)):
+    """
+    Bhattacharyya distance between the hue/saturation histograms of two
+    BGR frames: 0 for identical color content, 1 for disjoint.
+    """
+    hists = []
+    for frame in (frame_a, frame_b):
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, list(bins), [0, 180, 0, 256])
+        hists.append(cv2.normalize(hist, hist))
+    return float(cv2.compareHist(hists[0], hists[1], cv2.HISTCMP_BHATTACHARYYA))
+
+
+def depth_distance(depth_a, depth_b, size=(64, 64)):
+    """
+    Mean absolute difference of two normalized (0–1) depth maps.
+    """
+    a = cv2.resize(depth_a.astype(np.float32), size, interpolation=cv2.INTER_AREA)
+    b = cv2.resize(depth_b.astype(np.float32), size, interpolation=cv2.INTER_AREA)
+    return float(np.abs(a - b).mean())
+
+
+def compute_flow(prev_gray, next_gray):
+    """
+    Dense backward flow: for every pixel of next_gray, the offset of the
+    matching pixel in prev_gray.
+    """
+    return cv2.calcOpticalFlowFarneback(
+        next_gray, prev_gray, None,
+        pyr_scale=0.5, levels=3, winsize=15,
+        iterations=3, poly_n=5, poly_sigma=1.2, flags=0
+    )
+
+
+def warp_with_flow(image, flow):
+    """
+    Warps image (aligned with the previous frame) onto the next frame
+    using the backward flow from compute_flow().
+    """
+    h, w = flow.shape[:2]
+    grid_x, grid_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+    map_x = grid_x + flow[..., 0]
+    map_y = grid_y + flow[..., 1]
+    return cv2.remap(image, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+class TemporalStyler:
+    """
+    Styles a video by running the full diffusion pipeline only on keyframes
+    and carrying the style to the frames in between.
+
+    Keyframes are picked where the scene changed too much since the last
+    keyframe (hue/saturation histogram and, when given, depth difference).
+    In-between frames are propagated with one of two methods:
+    - "flow": the previous styled frame is warped with Farneback optical flow
+    - "img2img": the warped previous styled frame is refined by a few-step,
+      low-strength img2img pass with the current frame as ControlNet input
+    """
+
+    METHODS = ("flow", "img2img")
+
+    def __init__(
+        self,
+        runner,
+        method="flow",
+        preset="fast",
+        keyframe_threshold=0.3,
+        depth_threshold=0.15,
+        max_keyframe_gap=48,
+        propagation_steps=4,
+        propagation_strength=0.3,
+        seed=None
+    ):
+        """
+        runner: StableDiffusionRunner (or anything with PRESETS, style_image() and prompt_gen)
+        method: "flow" or "img2img" propagation for in-between frames
+        keyframe_threshold: histogram distance to the last keyframe that starts a new keyframe
+        depth_threshold: depth difference to the last keyframe that starts a new keyframe
+        max_keyframe_gap: force a keyframe this many frames after the last one (limits drift)
+        propagation_steps: denoising steps per in-between frame ("img2img" only)
+        propagation_strength: img2img strength per in-between frame ("img2img" only)
+        seed: fixed seed for every diffusion call, keeps the style consistent
+        """
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown propagation method '{method}', expected one of {self.METHODS}.")
+
+        self.runner = runner
+        self.method = method
+        self.preset = preset
+        self.keyframe_threshold = keyframe_threshold
+        self.depth_threshold = depth_threshold
+        self.max_keyframe_gap = max_keyframe_gap
+        self.propagation_steps = propagation_steps
+        self.propagation_strength = propagation_strength
+        self.seed = seed
+
+    def is_keyframe(self, frame, keyframe, depth=None, keyframe_depth=None, gap=0):
+        """
+        Whether frame should be styled from scratch rather than propagated.
+        """
+        if keyframe is None or gap >= self.max_keyframe_gap:
+            return True
+        if histogram_distance(frame, keyframe) > self.keyframe_threshold:
+            return True
+        if depth is not None and keyframe_depth is not None:
+            return depth_distance(depth, keyframe_depth) > self.depth_threshold
+        return False
+
+    def select_keyframes(self, frames, depths=None):
+        """
+        Indices of the frames style_frames() would style from scratch.
+        """
+        keyframes = []
+        keyframe = keyframe_depth = None
+
+        for idx, frame in enumerate(frames):
+            depth = depths[idx] if depths is not None else None
+            gap = idx - keyframes[-1] if keyframes else 0
+
+            if self.is_keyframe(frame, keyframe, depth, keyframe_depth, gap):
+                keyframes.append(idx)
+                keyframe, keyframe_depth = frame, depth
+
+        return keyframes
+
+    def _style(self, frame, prompt, init=None):
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+        if init is None:
+            styled = self.runner.style_image(image, prompt, preset=self.preset, seed=self.seed)
+        else:
+            styled = self.runner.style_image(
+                image,
+                prompt,
+                preset=self.preset,
+                init_image=Image.fromarray(cv2.cvtColor(init, cv2.COLOR_BGR2RGB)),
+                strength=self.propagation_strength,
+                steps=self.propagation_steps,
+                seed=self.seed
+            )
+
+        return cv2.cvtColor(np.asarray(styled), cv2.COLOR_RGB2BGR)
+
+    def style_frames(self, frames, prompt, depths=None):
+        """
+        frames: iterable of BGR frames (all the same size)
+        prompt: final prompt text, shared by every frame
+        depths: optional normalized depth maps aligned with frames
+
+        Yields (styled_bgr, is_keyframe) per frame, at the input frame size.
+        Frames are processed one at a time, so long videos stream through.
+        """
+        keyframe = keyframe_depth = None
+        prev_gray = prev_styled = None
+        gap = 0
+        num_keyframes = 0
+
+        # Work at the diffusion resolution so flow and styled frames line up
+        presets = self.runner.PRESETS
+        resolution = presets.get(self.preset.lower(), presets["fast"])["resolution"]
+
+        for idx, frame in enumerate(frames):
+            depth = depths[idx] if depths is not None else None
+            size = (frame.shape[1], frame.shape[0])
+
+            work = cv2.resize(frame, resolution, interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(work, cv2.COLOR_BGR2GRAY)
+
+            key = self.is_keyframe(frame, keyframe, depth, keyframe_depth, gap)
+
+            if key:
+                styled = self._style(work, prompt)
+                keyframe, keyframe_depth = frame, depth
+                gap = 1
+                num_keyframes += 1
+            else:
+                styled = warp_with_flow(prev_styled, compute_flow(prev_gray, gray))
+                if self.method == "img2img":
+                    styled = self._style(work, prompt, init=styled)
+                gap += 1
+
+            prev_gray, prev_styled = gray, styled
+
+            yield cv2.resize(styled, size, interpolation=cv2.INTER_LINEAR), key
+
+        logger.info(f"Styled {num_keyframes} keyframe(s), propagated the rest with '{self.method}'.")
+
+    def style_video(
+        self,
+        input_path,
+        output_path,
+        scene_json_path=None,
+        mode="generic",
+        video_backend="opencv",
+        **prompt_kwargs
+    ):
+        """
+        Styles a video file frame by frame and streams the result into a
+        VideoMaker (encoded on its background writer thread).
+        video_backend: "opencv" or "ffmpeg", see VideoMaker
+        Returns the output path and the number of keyframes styled.
+        """
+        prompt = self.runner.prompt_gen.get_prompt(mode, scene_json_path=scene_json_path, **prompt_kwargs)
+
+        cap = cv2.VideoCapture(input_path)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video: {input_path}")
+
+        fps = cap.get(cv2.CAP_PROP_FPS) or 24
+        num_keyframes = 0
+
+        def read_frames():
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    return
+                yield frame
+
+        def styled_frames():
+            nonlocal num_keyframes
+            for styled, key in self.style_frames(read_frames(), prompt):
+                num_keyframes += key
+                yield styled
+
+        try:
+            VideoMaker(output_path, fps, backend=video_backend).write_frames(styled_frames())
+        finally:
+            cap.release()
+
+        logger.info(f"Styled video saved to {output_path}")
+        return output_path, num_keyframes
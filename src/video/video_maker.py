@@ -1,59 +1,277 @@
 import cv2
 import numpy as np
 import os
+import queue
+import shutil
 import logging
+import collections
+import threading
+import subprocess
 
 logger = logging.getLogger(__name__)
 
+_STOP = None
+
+
+class _FrameWriter:
+    """
+    Encodes frames on a background thread fed through a bounded queue, so
+    blending (or generation) never waits on the encoder and memory stays flat.
+    Items are (frame, repeat) pairs; a held frame is queued once.
+    """
+
+    def __init__(self, encoder, max_pending=32):
+        self.encoder = encoder
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            if self.error is not None:
+                continue   # keep draining so producers never block
+
+            frame, repeat = item
+            try:
+                self.encoder.write(frame, repeat)
+            except Exception as e:
+                self.error = e
+
+    def submit(self, frame, repeat=1):
+        if self.error is not None:
+            raise RuntimeError(f"Video encoding failed: {self.error}")
+        self.queue.put((frame, repeat))
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.encoder.close()
+        if self.error is not None:
+            raise RuntimeError(f"Video encoding failed: {self.error}")
+
+
+class _OpenCVEncoder:
+    def __init__(self, output_path, fps, size):
+        self.out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+        if not self.out.isOpened():
+            raise IOError(f"Could not open video writer: {output_path}")
+
+    def write(self, frame, repeat):
+        for _ in range(repeat):
+            self.out.write(frame)
+
+    def close(self):
+        self.out.release()
+
+
+class _FFmpegEncoder:
+    """
+    Pipes raw BGR frames into an ffmpeg subprocess (libx264, multithreaded).
+    """
+
+    def __init__(self, output_path, fps, size, ffmpeg_path="ffmpeg", crf=23, preset="veryfast", threads=0):
+        command = [
+            ffmpeg_path, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{size[0]}x{size[1]}", "-r", str(fps),
+            "-i", "-",
+            "-c:v", "libx264", "-preset", preset, "-crf", str(crf),
+            "-threads", str(threads), "-pix_fmt", "yuv420p",
+            output_path
+        ]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        # Drained continuously: a full stderr pipe would block ffmpeg, and with
+        # it our stdin writes. Only the tail is kept for the error message.
+        self.stderr_tail = collections.deque(maxlen=50)
+        self.stderr_reader = threading.Thread(target=self._drain_stderr, daemon=True)
+        self.stderr_reader.start()
+
+    def _drain_stderr(self):
+        for line in iter(self.process.stderr.readline, b""):
+            self.stderr_tail.append(line)
+
+    def write(self, frame, repeat):
+        data = np.ascontiguousarray(frame).data
+        for _ in range(repeat):
+            self.process.stdin.write(data)
+
+    def close(self):
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        self.stderr_reader.join()
+        if returncode != 0:
+            stderr = b"".join(self.stderr_tail).decode(errors="replace")
+            raise RuntimeError(f"ffmpeg exited with code {returncode}: {stderr}")
+
+
+def _load_frame(frame):
+    if isinstance(frame, np.ndarray):
+        return frame
+    image = cv2.imread(frame)
+    if image is None:
+        logger.error(f"Could not read image: {frame}")
+    return image
+
+
 class VideoMaker:
     """
     Creates a video from styled keyframes using cross-dissolve transitions.
+
+    Frames can come from disk or straight from memory (arrays or a
+    generator), and are encoded on a background thread with OpenCV or,
+    when available, an ffmpeg H.264 subprocess.
     """
-    
-    def __init__(self, output_path="outputs/video.mp4", fps=24):
+
+    def __init__(
+        self,
+        output_path="outputs/video.mp4",
+        fps=24,
+        backend="opencv",
+        queue_size=32,
+        ffmpeg_path="ffmpeg",
+        crf=23,
+        ffmpeg_preset="veryfast",
+        ffmpeg_threads=0
+    ):
+        """
+        backend: "opencv" (mp4v) or "ffmpeg" (libx264, falls back to opencv
+                 when no ffmpeg binary is found)
+        queue_size: frames buffered between the producer and the encoder thread
+        crf / ffmpeg_preset / ffmpeg_threads: x264 quality, speed and thread count
+                                              (0 lets ffmpeg use every core)
+        """
         self.output_path = output_path
         self.fps = fps
-        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+        self.queue_size = queue_size
+        self.ffmpeg_path = ffmpeg_path
+        self.crf = crf
+        self.ffmpeg_preset = ffmpeg_preset
+        self.ffmpeg_threads = ffmpeg_threads
 
-    def create_video(self, keyframe_paths, transition_frames=12, hold_frames=24):
+        self.backend = backend
+        if backend == "ffmpeg" and shutil.which(ffmpeg_path) is None:
+            logger.warning(f"ffmpeg not found at '{ffmpeg_path}', using the OpenCV encoder.")
+            self.backend = "opencv"
+
+        self.size = None
+        self._writer = None
+
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+
+    # -------------------- Streaming API --------------------
+
+    def open(self, size):
         """
-        Creates a video by blending keyframes.
+        Starts the encoder for frames of size (width, height).
         """
-        if not keyframe_paths:
-            logger.error("No keyframes provided for video creation.")
-            return None
+        self.size = tuple(size)
+
+        if self.backend == "ffmpeg":
+            encoder = _FFmpegEncoder(
+                self.output_path, self.fps, self.size, self.ffmpeg_path,
+                self.crf, self.ffmpeg_preset, self.ffmpeg_threads
+            )
+        else:
+            encoder = _OpenCVEncoder(self.output_path, self.fps, self.size)
 
-        # Read first image to get dimensions
-        first_img = cv2.imread(keyframe_paths[0])
-        if first_img is None:
-            logger.error(f"Could not read image: {keyframe_paths[0]}")
+        self._writer = _FrameWriter(encoder, self.queue_size)
+        logger.info(f"Creating video: {self.output_path} | Size: {self.size} | FPS: {self.fps} | Encoder: {self.backend}")
+
+    def write(self, frame, repeat=1):
+        """
+        Queues a BGR frame, shown `repeat` times. Opens the encoder on the
+        first frame; later frames of another size are resized to match.
+        """
+        if self._writer is None:
+            self.open((frame.shape[1], frame.shape[0]))
+        elif (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size)
+
+        self._writer.submit(frame, repeat)
+
+    def close(self):
+        """
+        Waits for the encoder to finish and returns the output path.
+        """
+        if self._writer is None:
             return None
-            
-        height, width, layers = first_img.shape
-        size = (width, height)
-
-        # Initialize VideoWriter
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(self.output_path, fourcc, self.fps, size)
-
-        logger.info(f"Creating video: {self.output_path} | Size: {size} | FPS: {self.fps}")
-
-        for i in range(len(keyframe_paths)):
-            img_current = cv2.imread(keyframe_paths[i])
-            
-            # 1. Hold current keyframe
-            for _ in range(hold_frames):
-                out.write(img_current)
-            
-            # 2. Transition to next keyframe (if not last)
-            if i < len(keyframe_paths) - 1:
-                img_next = cv2.imread(keyframe_paths[i+1])
-                if img_next is not None:
-                    for f in range(transition_frames):
-                        alpha = f / transition_frames
-                        blended = cv2.addWeighted(img_current, 1 - alpha, img_next, alpha, 0)
-                        out.write(blended)
-
-        out.release()
+
+        writer, self._writer = self._writer, None
+        writer.close()
+
         logger.info(f"Video saved successfully to {self.output_path}")
         return self.output_path
+
+    def write_frames(self, frames):
+        """
+        Encodes an iterable of BGR frames (or (frame, repeat) pairs), e.g.
+        a generator fed directly by the generation stage.
+        """
+        try:
+            for frame in frames:
+                if isinstance(frame, tuple):
+                    self.write(*frame)
+                else:
+                    self.write(frame)
+        except BaseException:
+            if self._writer is not None:
+                try:
+                    self.close()
+                except RuntimeError:
+                    pass
+            raise
+
+        if self._writer is None:
+            logger.error("No frames provided for video creation.")
+            return None
+
+        return self.close()
+
+    # -------------------- Keyframe Transitions --------------------
+
+    @staticmethod
+    def keyframe_transitions(keyframes, transition_frames=12, hold_frames=24):
+        """
+        keyframes: iterable of keyframe paths or BGR arrays (may be a generator)
+
+        Yields (frame, repeat) pairs: each keyframe held for hold_frames,
+        then the cross-dissolve to the next one. Every keyframe is loaded
+        exactly once and blend weights are computed once up front.
+        """
+        weights = np.arange(1, transition_frames, dtype=np.float32) / max(transition_frames, 1)
+
+        current = None
+        for keyframe in keyframes:
+            image = _load_frame(keyframe)
+            if image is None:
+                continue
+
+            if current is not None:
+                if image.shape != current.shape:
+                    image = cv2.resize(image, (current.shape[1], current.shape[0]))
+
+                # The first transition frame (weight 0) is the keyframe itself
+                yield current, hold_frames + (1 if transition_frames > 0 else 0)
+
+                base = current.astype(np.float32)
+                diff = image.astype(np.float32) - base
+                for w in weights:
+                    # addWeighted(current, 1 - w, image, w) as one multiply-add per pixel
+                    yield np.clip(base + w * diff + 0.5, 0, 255).astype(np.uint8), 1
+
+            current = image
+
+        if current is not None:
+            yield current, hold_frames
+
+    def create_video(self, keyframe_paths, transition_frames=12, hold_frames=24):
+        """
+        Creates a video by blending keyframes.
+        keyframe_paths: keyframe paths or in-memory BGR frames (list or generator)
+        """
+        return self.write_frames(self.keyframe_transitions(keyframe_paths, transition_frames, hold_frames))
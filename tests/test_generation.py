@@ -1,12 +1,93 @@
 import unittest
 import os
 import json
+import time
+import shutil
 import numpy as np
+import torch
 from PIL import Image
 
 from src.prompt.prompt_generator import PromptGenerator
 from src.video.video_maker import VideoMaker
-from src.generation.sd_runner import generate_styled_image
+from src.generation.sd_runner import generate_styled_image, StableDiffusionRunner
+from src.generation.worker_pool import GenerationWorkerPool, split_cores
+from src.generation.progress import CancellationToken, GenerationCancelled
+
+
+class _EchoRunner:
+    """Stands in for StableDiffusionRunner inside pool worker processes."""
+
+    def __init__(self, tag="echo"):
+        self.tag = tag
+
+    def generate_styled_image(self, scene_json_path, source_image_path, preset="fast", mode="auto_design", **kwargs):
+        if preset == "broken":
+            raise ValueError("broken preset")
+        if preset == "slow":
+            cancel_token = kwargs["cancel_token"]
+            while not cancel_token.cancelled:
+                time.sleep(0.01)
+            cancel_token.raise_if_cancelled()
+        return None, f"{self.tag}:{os.getpid()}:{source_image_path}:{preset}"
+
+def _tiny_pipe(tmp_dir="tests/tmp/tiny_sd"):
+    """
+    Randomly initialised miniature SD + ControlNet img2img pipeline, so the
+    runner logic can be tested without downloading checkpoints.
+    """
+    from diffusers import (
+        AutoencoderKL, ControlNetModel, UNet2DConditionModel,
+        UniPCMultistepScheduler, StableDiffusionControlNetImg2ImgPipeline
+    )
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+    os.makedirs(tmp_dir, exist_ok=True)
+    vocab = {"<|startoftext|>": 0, "!": 1, "<|endoftext|>": 2}
+    for c in "abcdefghijklmnopqrstuvwxyz,.":
+        vocab[c] = len(vocab)
+        vocab[c + "</w>"] = len(vocab)
+    with open(os.path.join(tmp_dir, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(tmp_dir, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+
+    torch.manual_seed(0)
+    blocks = dict(
+        block_out_channels=(4, 8),
+        layers_per_block=1,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        cross_attention_dim=32,
+        norm_num_groups=2
+    )
+    unet = UNet2DConditionModel(
+        sample_size=16, in_channels=4, out_channels=4,
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"), **blocks
+    )
+    controlnet = ControlNetModel(in_channels=4, conditioning_embedding_out_channels=(16, 32), **blocks)
+    vae = AutoencoderKL(
+        block_out_channels=[4, 8], in_channels=3, out_channels=3, latent_channels=4, norm_num_groups=2,
+        down_block_types=["DownEncoderBlock2D"] * 2, up_block_types=["UpDecoderBlock2D"] * 2
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0, eos_token_id=2, pad_token_id=1, hidden_size=32, intermediate_size=37,
+        num_attention_heads=4, num_hidden_layers=2, vocab_size=len(vocab) + 10, max_position_embeddings=16
+    ))
+    tokenizer = CLIPTokenizer(
+        os.path.join(tmp_dir, "vocab.json"), os.path.join(tmp_dir, "merges.txt"), model_max_length=16
+    )
+
+    return StableDiffusionControlNetImg2ImgPipeline(
+        vae=vae, text_encoder=text_encoder, tokenizer=tokenizer, unet=unet, controlnet=controlnet,
+        scheduler=UniPCMultistepScheduler(), safety_checker=None, feature_extractor=None,
+        requires_safety_checker=False
+    )
+
+
+def _tiny_runner():
+    runner = StableDiffusionRunner(pipe=_tiny_pipe())
+    runner.PRESETS = {"fast": dict(StableDiffusionRunner.PRESETS["fast"], resolution=(64, 64), steps=4)}
+    return runner
+
 
 class TestGenerationStack(unittest.TestCase):
 
@@ -78,6 +159,457 @@ class TestGenerationStack(unittest.TestCase):
 
         self.assertIsNotNone(output_image)
 
+    # ---------------------- # Worker Pool Tests
+    def test_split_cores(self):
+        self.assertEqual(split_cores(list(range(8)), 3), [[0, 1, 2], [3, 4, 5], [6, 7]])
+        self.assertEqual(split_cores([0, 1], 4), [[0], [1]])
+
+    def test_worker_pool_futures(self):
+        with GenerationWorkerPool(num_workers=2, runner_factory=_EchoRunner,
+                                  runner_kwargs={"tag": "warm"}) as pool:
+            futures = [
+                pool.submit(self.dummy_json_path, f"img_{i}.png", preset="fast")
+                for i in range(4)
+            ]
+            failing = pool.submit(self.dummy_json_path, "img.png", preset="broken")
+
+            results = [f.result(timeout=120) for f in futures]
+
+            for i, (image, path) in enumerate(results):
+                self.assertTrue(path.startswith("warm:"))
+                self.assertTrue(path.endswith(f"img_{i}.png:fast"))
+                self.assertNotEqual(path.split(":")[1], str(os.getpid()))
+
+            with self.assertRaises(RuntimeError):
+                failing.result(timeout=120)
+
+    def test_worker_pool_cancel(self):
+        with GenerationWorkerPool(num_workers=1, runner_factory=_EchoRunner) as pool:
+            running = pool.submit(self.dummy_json_path, "slow.png", preset="slow")
+            queued = pool.submit(self.dummy_json_path, "queued.png")
+            last = pool.submit(self.dummy_json_path, "last.png")
+
+            deadline = time.time() + 120
+            while not running.running() and time.time() < deadline:
+                time.sleep(0.01)
+
+            self.assertTrue(pool.cancel(queued))
+            self.assertTrue(pool.cancel(running))
+
+            with self.assertRaises(GenerationCancelled):
+                running.result(timeout=120)
+            self.assertTrue(queued.cancelled())
+            self.assertTrue(last.result(timeout=120)[1].endswith("last.png:fast"))
+            self.assertFalse(pool.cancel(last))
+
+
+    def test_worker_pool_dead_worker(self):
+        with GenerationWorkerPool(num_workers=1, runner_factory=_EchoRunner) as pool:
+            running = pool.submit(self.dummy_json_path, "slow.png", preset="slow")
+            queued = pool.submit(self.dummy_json_path, "queued.png")
+
+            deadline = time.time() + 120
+            while not running.running() and time.time() < deadline:
+                time.sleep(0.01)
+
+            pool._workers[0].kill()
+
+            with self.assertRaisesRegex(RuntimeError, "died"):
+                running.result(timeout=120)
+            with self.assertRaisesRegex(RuntimeError, "No generation worker"):
+                queued.result(timeout=120)
+            with self.assertRaises(RuntimeError):
+                pool.submit(self.dummy_json_path, "img.png")
+
+class TestTinyPipelineRunner(unittest.TestCase):
+    """Runner features exercised against a miniature random-weight pipeline."""
+
+    @classmethod
+    def setUpClass(cls):
+        os.makedirs("tests/tmp/tiny_sd", exist_ok=True)
+        cls.image_path = "tests/tmp/tiny_sd/tiny_room.png"
+        rng = np.random.default_rng(0)
+        Image.fromarray(rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)).save(cls.image_path)
+        cls.runner = _tiny_runner()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/tiny_sd", ignore_errors=True)
+        if os.path.exists("outputs/tiny_room_styled.png"):
+            os.remove("outputs/tiny_room_styled.png")
+
+    def test_generate_variants_batched(self):
+        encodes = []
+        hook = self.runner.pipe.vae.encoder.register_forward_hook(lambda *args: encodes.append(1))
+        paths = [f"tests/tmp/tiny_sd/variant_{i}.png" for i in range(3)]
+
+        results = self.runner.generate_variants(
+            None, self.image_path, seeds=[1, 2, 3], output_paths=paths
+        )
+        hook.remove()
+
+        self.assertEqual(len(encodes), 1)
+        self.assertEqual([p for _, p in results], paths)
+        self.assertTrue(all(os.path.exists(p) for p in paths))
+
+        # Same seed alone reproduces the batched variant
+        single = self.runner.generate_variants(
+            None, self.image_path, variants=["minimal"], seeds=[2],
+            output_paths=["tests/tmp/tiny_sd/single.png"]
+        )
+        np.testing.assert_allclose(
+            np.asarray(single[0][0], dtype=np.float32),
+            np.asarray(results[1][0], dtype=np.float32),
+            atol=2
+        )
+
+    def test_conditioning_cache_skips_encoders(self):
+        runner = _tiny_runner()
+        calls = []
+        runner.pipe.vae.encoder.register_forward_hook(lambda *args: calls.append("vae"))
+        runner.pipe.text_encoder.register_forward_hook(lambda *args: calls.append("clip"))
+
+        first, _ = runner.generate_styled_image(None, self.image_path, mode="generic", style="modern", seed=7)
+        self.assertIn("vae", calls)
+        self.assertIn("clip", calls)
+
+        calls.clear()
+        second, _ = runner.generate_styled_image(None, self.image_path, mode="generic", style="modern", seed=7)
+        self.assertEqual(calls, [])
+        np.testing.assert_array_equal(np.asarray(first), np.asarray(second))
+
+        # A new prompt only re-runs the text encoder
+        runner.generate_styled_image(None, self.image_path, mode="generic", style="luxury", seed=7)
+        self.assertEqual(calls, ["clip"])
+        self.assertGreater(runner.cache.hits, 0)
+
+    def test_onnx_backend_parity(self):
+        from src.generation.onnx_backend import enable_onnx_backend
+        from src.optimizations import module_identity, versioned_cache_dir
+
+        precision = torch.get_float32_matmul_precision()
+        torch.set_float32_matmul_precision("highest")
+        try:
+            runner = _tiny_runner()
+            expected, _ = runner.generate_styled_image(None, self.image_path, mode="generic", seed=3)
+
+            inputs = (torch.randn(2, 4, 32, 32), 10, torch.randn(2, 16, 32), torch.rand(2, 3, 64, 64))
+            with torch.no_grad():
+                guess = runner.pipe.controlnet(*inputs, guess_mode=True, return_dict=False)
+
+            backend = enable_onnx_backend(runner.pipe, "tests/tmp/tiny_sd/onnx", (64, 64))
+            runner.cache.clear()
+            actual, _ = runner.generate_styled_image(None, self.image_path, mode="generic", seed=3)
+
+            # guess_mode is not in the exported graph and runs on PyTorch
+            with torch.no_grad():
+                onnx_guess = runner.pipe.controlnet(*inputs, guess_mode=True, return_dict=False)
+        finally:
+            torch.set_float32_matmul_precision(precision)
+
+        self.assertEqual(backend, "onnx")
+        torch.testing.assert_close(onnx_guess[1], guess[1])
+
+        # Graphs are keyed by the weights they were exported from
+        self.assertEqual(len(os.listdir("tests/tmp/tiny_sd/onnx")), 1)
+        other = _tiny_pipe()
+        torch.nn.init.zeros_(other.unet.conv_out.weight)
+        self.assertNotEqual(module_identity(other.unet), module_identity(runner.pipe.unet))
+        self.assertNotEqual(
+            versioned_cache_dir("onnx", module_identity(other.unet), 17),
+            versioned_cache_dir("onnx", module_identity(runner.pipe.unet), 17)
+        )
+        self.assertEqual(module_identity(_tiny_pipe().unet), module_identity(runner.pipe.unet))
+
+        diff = np.abs(np.asarray(actual, dtype=np.int16) - np.asarray(expected, dtype=np.int16))
+        self.assertLessEqual(diff.max(), 2)
+
+    def test_int8_quantization(self):
+        from src.optimizations import compare_outputs
+
+        fp32 = _tiny_runner()
+        expected, _ = fp32.generate_styled_image(None, self.image_path, mode="generic", seed=5)
+
+        runner = StableDiffusionRunner(pipe=_tiny_pipe(), quantize=True, quantized_dir="tests/tmp/tiny_sd/int8")
+        runner.PRESETS = fp32.PRESETS
+        actual, _ = runner.generate_styled_image(None, self.image_path, mode="generic", seed=5)
+
+        # One folder per model, holding a plain state_dict
+        paths = [os.path.join(root, f) for root, _, files in os.walk("tests/tmp/tiny_sd/int8") for f in files]
+        self.assertEqual(sorted(map(os.path.basename, paths)), ["controlnet_int8.pt", "unet_int8.pt"])
+        self.assertEqual(len({os.path.dirname(path) for path in paths}), 2)
+        self.assertIsInstance(torch.load(paths[0], weights_only=True), dict)
+        self.assertGreater(compare_outputs(expected, actual)["psnr"], 25)
+
+        # Restarts load the cached weights without quantizing again
+        from unittest import mock
+        with mock.patch("torch.ao.quantization.quantize_dynamic") as quantize_dynamic:
+            cached = StableDiffusionRunner(pipe=_tiny_pipe(), quantize=True, quantized_dir="tests/tmp/tiny_sd/int8")
+        quantize_dynamic.assert_not_called()
+        cached.PRESETS = fp32.PRESETS
+        again, _ = cached.generate_styled_image(None, self.image_path, mode="generic", seed=5)
+        self.assertEqual(compare_outputs(actual, again)["psnr"], float("inf"))
+
+    def test_precision_resolution(self):
+        from unittest import mock
+        from src import optimizations
+
+        self.assertEqual(optimizations.resolve_precision("fp32"), "fp32")
+        with mock.patch.object(optimizations, "bf16_supported", return_value=False):
+            self.assertEqual(optimizations.resolve_precision("bf16"), "fp32")
+            self.assertEqual(optimizations.resolve_precision("auto"), "fp32")
+        with mock.patch.object(optimizations, "bf16_supported", return_value=True):
+            self.assertEqual(optimizations.resolve_precision("auto"), "bf16")
+        with self.assertRaises(ValueError):
+            optimizations.resolve_precision("fp16")
+
+    def test_bf16_generation(self):
+        from src.optimizations import bf16_supported, compare_outputs
+
+        if not bf16_supported():
+            self.skipTest("CPU without AVX512-BF16/AMX")
+
+        fp32 = _tiny_runner()
+        expected, _ = fp32.generate_styled_image(None, self.image_path, mode="generic", seed=9)
+
+        runner = StableDiffusionRunner(pipe=_tiny_pipe(), precision="auto")
+        runner.PRESETS = fp32.PRESETS
+        actual, _ = runner.generate_styled_image(None, self.image_path, mode="generic", seed=9)
+
+        self.assertEqual(runner.precision, "bf16")
+        self.assertGreater(compare_outputs(expected, actual)["psnr"], 20)
+
+    def test_style_image_few_steps(self):
+        steps = []
+        hook = self.runner.pipe.unet.register_forward_hook(lambda *args: steps.append(1))
+
+        frame = Image.open(self.image_path)
+        keyframe = self.runner.style_image(frame, "a modern room", seed=1)
+        steps.clear()
+        styled = self.runner.style_image(frame, "a modern room", init_image=keyframe, strength=0.5, steps=2, seed=1)
+        hook.remove()
+
+        # Guidance runs both branches in one batch, so one UNet call per step
+        self.assertEqual(len(steps), 2)
+        self.assertEqual(styled.size, (64, 64))
+
+    def test_turbo_preset_hot_swaps_scheduler_and_adapter(self):
+        from unittest import mock
+        from diffusers import LCMScheduler, UniPCMultistepScheduler
+
+        runner = _tiny_runner()
+        runner.PRESETS = dict(runner.PRESETS, turbo=dict(StableDiffusionRunner.PRESETS["turbo"], resolution=(64, 64)))
+        base_unet = runner.pipe.unet
+
+        batches = []
+        runner.pipe.unet.register_forward_hook(lambda module, args, output: batches.append(args[0].shape[0]))
+
+        # No LoRA weights offline: the adapter falls back to the base weights, once
+        with self.assertLogs("src.generation.sd_runner", level="WARNING"):
+            image, _ = runner.generate_styled_image(None, self.image_path, preset="turbo", mode="generic", seed=1)
+        self.assertEqual(image.size, (64, 64))
+        self.assertIsInstance(runner.pipe.scheduler, LCMScheduler)
+        self.assertEqual(runner._unavailable_adapters, {"lcm"})
+
+        # int(6 * 0.7) steps, guidance off: a single unbatched UNet call per step
+        self.assertEqual(batches, [1] * 4)
+
+        runner._unavailable_adapters.clear()
+        with mock.patch.object(runner.pipe, "load_lora_weights") as load, \
+                mock.patch.object(runner.pipe, "set_adapters") as set_adapters, \
+                mock.patch.object(runner.pipe, "enable_lora"), \
+                mock.patch.object(runner.pipe, "disable_lora") as disable:
+            runner.generate_styled_image(None, self.image_path, preset="turbo", mode="generic", seed=1)
+            runner.generate_styled_image(None, self.image_path, preset="fast", mode="generic", seed=1)
+            self.assertIsInstance(runner.pipe.scheduler, UniPCMultistepScheduler)
+            runner.generate_styled_image(None, self.image_path, preset="turbo", mode="generic", seed=1)
+
+        load.assert_called_once_with("latent-consistency/lcm-lora-sdv1-5", adapter_name="lcm")
+        self.assertEqual(set_adapters.call_count, 2)
+        disable.assert_called_once()
+        self.assertIs(runner.pipe.unet, base_unet)
+
+    def test_feature_cache(self):
+        from src.generation.feature_cache import benchmark_feature_cache
+
+        runner = StableDiffusionRunner(pipe=_tiny_pipe(), feature_cache=True)
+        runner.PRESETS = {"fast": dict(_tiny_runner().PRESETS["fast"], steps=10, cache_interval=1)}
+        cache, unet = runner.feature_cache, runner.pipe.unet
+
+        # Same inputs twice: the shallow path on cached features matches the full UNet
+        sample = torch.randn(2, 4, 8, 8)
+        embeds = torch.randn(2, 16, 32)
+        cache.reset(interval=2)
+        with torch.no_grad():
+            full = unet(sample, 10, encoder_hidden_states=embeds).sample
+            shallow = unet(sample, 10, encoder_hidden_states=embeds).sample
+        self.assertEqual((cache.full_steps, cache.shallow_steps), (1, 1))
+        torch.testing.assert_close(shallow, full, atol=1e-5, rtol=1e-4)
+
+        controlnet_calls = []
+        runner.pipe.controlnet.conv_in.register_forward_hook(lambda *args: controlnet_calls.append(1))
+
+        rows = benchmark_feature_cache(runner, self.image_path, intervals=(1, 3), seed=4)
+
+        # 7 denoising steps (10 at strength 0.7): full UNet on steps 0, 3 and 6
+        self.assertEqual([(r["full_steps"], r["shallow_steps"]) for r in rows], [(7, 0), (3, 4)])
+        # Warmup and reference run the ControlNet every step, the cached run 3 times
+        self.assertEqual(len(controlnet_calls), 7 + 7 + 3)
+        self.assertEqual(rows[0]["psnr"], float("inf"))
+        self.assertGreater(rows[1]["psnr"], 15)
+        self.assertEqual(runner.PRESETS["fast"]["cache_interval"], 1)
+
+    def test_token_merging(self):
+        from src.generation.token_merging import bipartite_soft_matching
+        from src.optimizations import compare_outputs
+
+        # Tokens repeated within each 2x2 cell merge and unmerge losslessly
+        cells = torch.randn(2, 4, 4, 8)
+        x = cells.repeat_interleave(2, dim=1).repeat_interleave(2, dim=2).reshape(2, 64, 8)
+        merge, unmerge = bipartite_soft_matching(x, 8, 8, r=48)
+        self.assertEqual(merge(x).shape, (2, 16, 8))
+        torch.testing.assert_close(unmerge(merge(x)), x)
+
+        expected, _ = self.runner.generate_styled_image(None, self.image_path, mode="generic", seed=6)
+
+        runner = StableDiffusionRunner(pipe=_tiny_pipe(), token_merging=True)
+        runner.PRESETS = {"fast": dict(self.runner.PRESETS["fast"], token_merge_ratio=0.5)}
+        # The tiny UNet only has attention at its second level
+        runner.token_merging.max_downsample = 2
+
+        tokens = []
+        attn = runner.pipe.unet.down_blocks[1].attentions[0].transformer_blocks[0].attn1
+        attn.to_q.register_forward_hook(lambda module, args, output: tokens.append(args[0].shape[1]))
+
+        actual, _ = runner.generate_styled_image(None, self.image_path, mode="generic", seed=6)
+
+        self.assertGreater(runner.token_merging.num_patched, 0)
+        # 32x32 latents (tiny VAE downsamples twice), 16x16 tokens at the attention level, half merged
+        self.assertEqual(set(tokens), {256 - 128})
+        self.assertGreater(compare_outputs(expected, actual)["psnr"], 15)
+
+    def test_attention_modes(self):
+        from diffusers.models.attention_processor import AttnProcessor2_0, SlicedAttnProcessor
+
+        sdpa = StableDiffusionRunner(pipe=_tiny_pipe(), attention="sdpa")
+        sliced = StableDiffusionRunner(pipe=_tiny_pipe(), attention="sliced")
+
+        self.assertTrue(all(isinstance(p, AttnProcessor2_0) for p in sdpa.pipe.unet.attn_processors.values()))
+        self.assertTrue(all(isinstance(p, SlicedAttnProcessor) for p in sliced.pipe.unet.attn_processors.values()))
+        self.assertIn(StableDiffusionRunner(pipe=_tiny_pipe()).attention, ("sdpa", "sliced"))
+
+        with self.assertRaises(ValueError):
+            StableDiffusionRunner(pipe=_tiny_pipe(), attention="flash")
+
+    def test_step_previews(self):
+        previews = []
+        self.runner.style_image(
+            Image.open(self.image_path), "a modern room", seed=1, steps=5, preview_every=2,
+            callback=lambda step, total, preview: previews.append((step, total, preview))
+        )
+
+        # Every second step plus the last one, at latent resolution
+        self.assertEqual([(step, total) for step, total, _ in previews], [(2, 5), (4, 5), (5, 5)])
+        self.assertTrue(all(isinstance(p, Image.Image) and p.size == (32, 32) for _, _, p in previews))
+
+        class _Decoder:
+            dtype = torch.float32
+
+            def decode(self, latents):
+                from types import SimpleNamespace
+                return SimpleNamespace(sample=torch.zeros(1, 3, 64, 64))
+
+        from src.generation.progress import latents_to_preview
+        preview = latents_to_preview(torch.randn(2, 4, 32, 32), decoder=_Decoder())
+        self.assertEqual(preview.size, (64, 64))
+        self.assertEqual(preview.getpixel((0, 0)), (128, 128, 128))
+
+    def test_cancellation(self):
+        steps, decodes = [], []
+        unet_hook = self.runner.pipe.unet.register_forward_hook(lambda *args: steps.append(1))
+        vae_hook = self.runner.pipe.vae.decoder.register_forward_hook(lambda *args: decodes.append(1))
+
+        token = CancellationToken()
+        try:
+            with self.assertRaises(GenerationCancelled):
+                self.runner.style_image(
+                    Image.open(self.image_path), "a modern room", seed=1, cancel_token=token,
+                    steps=4, callback=lambda step, total, preview: step == 2 and token.cancel()
+                )
+            self.assertEqual(len(steps), 2)
+
+            steps.clear()
+            with self.assertRaises(GenerationCancelled):
+                self.runner.generate_styled_image(None, self.image_path, mode="generic", cancel_token=token)
+        finally:
+            unet_hook.remove()
+            vae_hook.remove()
+
+        self.assertEqual(steps, [])
+        self.assertEqual(decodes, [])
+
+    def test_tiled_blending_is_exact(self):
+        from types import SimpleNamespace
+        from src.generation.tiled_diffusion import TiledDiffusion, tile_spans
+
+        self.assertEqual(tile_spans(40, 16, 4, align=4), [(0, 16), (12, 28), (24, 40)])
+        self.assertEqual(tile_spans(12, 16, 4), [(0, 12)])
+
+        # Per-pixel models give the same result tiled or not
+        def unet_forward(sample, timestep, encoder_hidden_states, down_block_additional_residuals=None,
+                         mid_block_additional_residual=None, return_dict=True):
+            return (sample * 2 + down_block_additional_residuals[0],)
+
+        def controlnet_forward(sample, timestep, encoder_hidden_states, controlnet_cond, return_dict=True):
+            return (sample + controlnet_cond[..., ::2, ::2],), sample[..., ::2, ::2]
+
+        unet = SimpleNamespace(forward=unet_forward, down_blocks=[SimpleNamespace(downsamplers=[1]), SimpleNamespace()])
+        controlnet = SimpleNamespace(forward=controlnet_forward)
+        tiling = TiledDiffusion(unet, controlnet, tile_size=16, overlap=4)
+
+        sample, cond = torch.randn(2, 4, 40, 24), torch.randn(2, 4, 80, 48)
+        down, mid = controlnet.forward(sample, 0, None, cond, return_dict=False)
+        noise = unet.forward(sample, 0, None, down_block_additional_residuals=down,
+                             mid_block_additional_residual=mid, return_dict=False)[0]
+
+        torch.testing.assert_close(down[0], sample + cond[..., ::2, ::2])
+        torch.testing.assert_close(mid, sample[..., ::2, ::2])
+        torch.testing.assert_close(noise, sample * 3 + cond[..., ::2, ::2])
+        self.assertEqual(len(tiling.tiles(40, 24)), 3 * 2)
+        self.assertIsNone(tiling.tiles(16, 16))
+
+    def test_tiled_generation(self):
+        runner = StableDiffusionRunner(pipe=_tiny_pipe(), tile_size=32, tile_overlap=8)
+        runner.PRESETS = self.runner.PRESETS
+
+        unet_sizes, vae_sizes = set(), set()
+        runner.pipe.unet.conv_in.register_forward_pre_hook(lambda module, args: unet_sizes.add(args[0].shape[-1]))
+        runner.pipe.vae.decoder.register_forward_pre_hook(lambda module, args: vae_sizes.add(args[0].shape[-1]))
+
+        image, _ = runner.generate_styled_image(None, self.image_path, mode="generic", seed=1)
+
+        # 64px output, 32x32 latents denoised and decoded as 16x16 tiles
+        self.assertEqual(image.size, (64, 64))
+        self.assertEqual(unet_sizes, {16})
+        self.assertEqual(max(vae_sizes), 16)
+        self.assertEqual(runner.tiling.tiled_calls, 2)
+        self.assertGreater(np.asarray(image).std(), 0)
+
+        self.assertGreater(runner.last_peak_rss, 0)
+        self.assertIsNone(self.runner.tiling.tiles(32, 32))
+
+    def test_overlapping_peak_rss_measurements(self):
+        from src.optimizations import start_peak_rss_measurement, finish_peak_rss_measurement
+
+        first = start_peak_rss_measurement()
+        second = start_peak_rss_measurement()
+        self.assertIsNone(finish_peak_rss_measurement(first))
+        self.assertGreater(finish_peak_rss_measurement(second), 0)
+
+    def test_generate_variants_validates_seeds(self):
+        with self.assertRaises(ValueError):
+            self.runner.generate_variants(None, self.image_path, seeds=[1])
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
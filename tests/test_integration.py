@@ -0,0 +1,157 @@
+import unittest
+import os
+import shutil
+import time
+import threading
+import numpy as np
+import torch
+
+from src.orchestrator import PipelineOrchestrator, default_stage_threads
+
+
+class _SlowStage:
+    """Records when each call starts/ends so overlap can be checked."""
+
+    def __init__(self, name, log, delay=0.05):
+        self.name = name
+        self.log = log
+        self.delay = delay
+        self.flushes = 0
+        self.threads = []
+
+    def _record(self, event):
+        self.threads.append(torch.get_num_threads())
+        self.log.append((self.name, event, time.perf_counter(), threading.current_thread().name))
+
+    def run(self, image, *args, **kwargs):
+        self._record("start")
+        time.sleep(self.delay)
+        self._record("end")
+        if self.name == "detector":
+            return [{"bbox": [0, 0, 4, 4], "class_id": 0, "confidence": 0.9}]
+        if self.name == "depth":
+            depth = np.zeros(image.shape[:2], dtype=np.float32)
+            return depth.astype(np.uint8), depth
+
+    def run_batch(self, image, detections, output_dir=None):
+        self._record("start")
+        time.sleep(self.delay)
+        self._record("end")
+        return np.ones((len(detections),) + image.shape[:2], dtype=bool)
+
+    def flush(self):
+        self.flushes += 1
+
+    def build_scene(self, depth_norm, detections, masks, output_path=None):
+        return {"objects": detections}
+
+    def save_scene(self, scene, output_path, depth_norm=None, masks=None):
+        return output_path
+
+    def generate_styled_image(self, scene_json_path, source_image_path, **kwargs):
+        self._record("start")
+        time.sleep(self.delay)
+        self._record("end")
+        return None, source_image_path.replace(".png", "_styled.png")
+
+
+class TestPipelineOrchestrator(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/pipeline", ignore_errors=True)
+
+    def _make(self, log, **kwargs):
+        return PipelineOrchestrator(
+            output_dir="tests/tmp/pipeline",
+            detector=_SlowStage("detector", log),
+            depth_estimator=_SlowStage("depth", log),
+            segmenter=_SlowStage("segmenter", log),
+            scene_builder=_SlowStage("scene", log),
+            generator=_SlowStage("generator", log),
+            **kwargs
+        )
+
+    def test_results_in_order(self):
+        log = []
+        orchestrator = self._make(log)
+        frames = [np.zeros((8, 8, 3), dtype=np.uint8) for _ in range(4)]
+
+        results = orchestrator.run_all(frames)
+
+        self.assertEqual([r["frame_id"] for r in results],
+                         ["frame_0001", "frame_0002", "frame_0003", "frame_0004"])
+        for r in results:
+            self.assertIsNone(r["error"])
+            self.assertTrue(r["styled_path"].endswith("_styled.png"))
+            self.assertTrue(os.path.exists(r["image_path"]))
+
+    def test_stages_overlap(self):
+        log = []
+        orchestrator = self._make(log)
+        frames = [np.zeros((8, 8, 3), dtype=np.uint8) for _ in range(3)]
+
+        orchestrator.run_all(frames)
+
+        # Detection on a later frame must start before generation on an earlier one ends
+        gen_end = [t for name, event, t, _ in log if name == "generator" and event == "end"]
+        det_start = [t for name, event, t, _ in log if name == "detector" and event == "start"]
+        self.assertLess(det_start[1], gen_end[0])
+
+    def test_stage_error_is_reported(self):
+        log = []
+        orchestrator = self._make(log, generate=False)
+        frames = [("bad", "tests/tmp/does_not_exist.png")]
+
+        results = orchestrator.run_all(frames)
+
+        self.assertEqual(len(results), 1)
+        self.assertIn("input", results[0]["error"])
+        self.assertEqual(log, [])
+
+    def test_failing_input_is_raised(self):
+        log = []
+        orchestrator = self._make(log, generate=False)
+
+        def frames():
+            yield np.zeros((8, 8, 3), dtype=np.uint8)
+            raise IOError("could not open video")
+
+        results = []
+        with self.assertRaises(IOError):
+            for result in orchestrator.run(frames()):
+                results.append(result)
+
+        # Frames read before the failure still come out
+        self.assertEqual([r["frame_id"] for r in results], ["frame_0001"])
+
+    def test_close_flushes_and_stops_perception(self):
+        log = []
+        with self._make(log, generate=False) as orchestrator:
+            orchestrator.run_all([np.zeros((8, 8, 3), dtype=np.uint8)])
+            self.assertEqual(orchestrator.segmenter.flushes, 1)
+
+        self.assertEqual(orchestrator.segmenter.flushes, 2)
+        with self.assertRaises(RuntimeError):
+            orchestrator.perception.executor.submit(print)
+
+    def test_stage_thread_budgets(self):
+        log = []
+        budgets = {"perception": 2, "segmentation": 3, "scene": 1, "generation": 5}
+        orchestrator = self._make(log, stage_threads=budgets)
+        frames = [np.zeros((8, 8, 3), dtype=np.uint8) for _ in range(4)]
+
+        saved_threads = torch.get_num_threads()
+        try:
+            orchestrator.run_all(frames)
+        finally:
+            torch.set_num_threads(saved_threads)
+
+        self.assertEqual(set(orchestrator.segmenter.threads), {3})
+        self.assertEqual(set(orchestrator.generator.threads), {5})
+        # Perception splits its own budget between detection and depth
+        self.assertEqual(set(orchestrator.detector.threads + orchestrator.depth_estimator.threads), {1})
+        self.assertTrue(all(v >= 1 for v in default_stage_threads(1).values()))
+
+if __name__ == "__main__":
+    unittest.main()
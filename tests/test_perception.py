@@ -0,0 +1,880 @@
+import unittest
+import os
+import glob
+import json
+import shutil
+import time
+import cv2
+import numpy as np
+import torch
+
+from src.perception import PerceptionRunner, split_thread_budget
+from src.depth.midas_runner import MiDaSRunner
+from src.detection.yolov8_runner import YOLOv8Runner, detections_to_list
+from src.segmentation.sam_runner import SAMRunner
+from src.cache import LRUCache, PerceptionCache, content_hash, pack_masks, unpack_masks
+from src.scene.scene_builder import (
+    SceneBuilder,
+    ScanSceneBuilder,
+    object_depth_stats,
+    object_depth_histograms,
+    box_iou,
+    histogram_median
+)
+from src.scene.scene_format import SceneFile, load_scene, json_to_npz, npz_to_json
+from src.prompt.prompt_generator import PromptGenerator
+from src.input import FrameSampler, frame_signature, compare_signatures, iter_inputs
+from src.optimizations import bf16_supported, resolve_precision, compare_outputs
+
+
+class _FakeDetector:
+    def run(self, image, output_json_path, write_json=False):
+        time.sleep(0.2)
+        return [{"bbox": [0, 0, 4, 4], "class_id": 0, "confidence": 0.9}]
+
+
+class _FakeDepth:
+    def run(self, image, output_path):
+        time.sleep(0.2)
+        depth_norm = np.ones(image.shape[:2], dtype=np.float32)
+        return (depth_norm * 255).astype(np.uint8), depth_norm
+
+
+class TestPerceptionRunner(unittest.TestCase):
+
+    def test_split_thread_budget(self):
+        self.assertEqual(split_thread_budget(8), (4, 4))
+        self.assertEqual(split_thread_budget(8, depth_share=0.75), (6, 2))
+        self.assertEqual(split_thread_budget(1), (1, 1))
+        self.assertEqual(split_thread_budget(4, depth_share=1.0), (3, 1))
+
+    def test_depth_and_detection_run_concurrently(self):
+        runner = PerceptionRunner(_FakeDetector(), _FakeDepth(), threads=4)
+        image = np.zeros((16, 16, 3), dtype=np.uint8)
+
+        start = time.perf_counter()
+        detections, depth_img, depth_norm = runner.run(image, "unused.json", "unused.png")
+        elapsed = time.perf_counter() - start
+        runner.close()
+
+        self.assertEqual(len(detections), 1)
+        self.assertEqual(depth_norm.shape, (16, 16))
+        self.assertEqual(depth_img.dtype, np.uint8)
+        self.assertLess(elapsed, 0.35)
+
+
+def _fake_midas():
+    # Bypass torch.hub, a tiny conv stands in for the depth network
+    runner = MiDaSRunner.__new__(MiDaSRunner)
+    runner.device = torch.device("cpu")
+    runner.backend = "torch"
+    runner.onnx_session = None
+    runner.precision = "fp32"
+    runner.perception_cache = None
+    runner.cache_id = "midas-fake"
+    torch.manual_seed(0)
+    runner.model = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 1, 3, padding=1),
+        torch.nn.Flatten(0, 1)
+    ).eval()
+    runner.transform = lambda img: (
+        torch.from_numpy(img).permute(2, 0, 1).float().unsqueeze(0)[:, :, ::2, ::2] / 255.0
+    )
+    return runner
+
+
+class TestMiDaSBatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Batch-vs-single comparisons need full fp32 matmuls
+        cls.matmul_precision = torch.get_float32_matmul_precision()
+        torch.set_float32_matmul_precision("highest")
+
+    @classmethod
+    def tearDownClass(cls):
+        torch.set_float32_matmul_precision(cls.matmul_precision)
+        shutil.rmtree("tests/tmp/midas", ignore_errors=True)
+
+    def test_run_batch_matches_single_frame(self):
+        runner = _fake_midas()
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 255, (32, 48, 3), dtype=np.uint8) for _ in range(3)]
+        images.append(rng.integers(0, 255, (40, 40, 3), dtype=np.uint8))
+
+        depth_imgs, depth_norms = runner.run_batch(images, batch_size=2)
+
+        for image, depth_img, depth_norm in zip(images, depth_imgs, depth_norms):
+            single_img, single_norm = runner.run(image, "tests/tmp/midas/depth.png")
+            self.assertEqual(depth_norm.shape, image.shape[:2])
+            np.testing.assert_allclose(depth_norm, single_norm, atol=1e-5)
+            self.assertAlmostEqual(float(depth_norm.min()), 0.0, places=5)
+            self.assertAlmostEqual(float(depth_norm.max()), 1.0, places=5)
+
+    def test_onnx_backend_parity(self):
+        runner = _fake_midas()
+        rng = np.random.default_rng(4)
+        images = [rng.integers(0, 255, (32, 48, 3), dtype=np.uint8) for _ in range(2)]
+        _, expected = runner.run_batch(images)
+
+        runner.enable_onnx("tests/tmp/midas/onnx/midas.onnx", example_size=(16, 16))
+        self.assertEqual(runner.backend, "onnx")
+        _, actual = runner.run_batch(images)
+
+        for a, e in zip(actual, expected):
+            np.testing.assert_allclose(a, e, atol=1e-4)
+
+    @unittest.skipUnless(bf16_supported(), "CPU without AVX512-BF16/AMX")
+    def test_bf16_autocast(self):
+        runner = _fake_midas()
+        images = [np.random.default_rng(5).integers(0, 255, (32, 48, 3), dtype=np.uint8)]
+        _, expected = runner.run_batch(images)
+
+        runner.precision = resolve_precision("auto")
+        _, actual = runner.run_batch(images)
+
+        self.assertEqual(runner.precision, "bf16")
+        self.assertEqual(actual[0].dtype, np.float32)
+        self.assertGreater(compare_outputs(expected[0], actual[0])["psnr"], 30)
+
+    def test_torch_compile_with_persistent_cache(self):
+        runner = _fake_midas()
+        images = [np.random.default_rng(6).integers(0, 255, (32, 48, 3), dtype=np.uint8)]
+        _, expected = runner.run_batch(images)
+
+        cache_dir = "tests/tmp/midas/compile_cache"
+        saved_env = dict(os.environ)
+        try:
+            runner.enable_compile(cache_dir, warmup_size=(32, 48))
+            _, actual = runner.run_batch(images)
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_env)
+
+        np.testing.assert_allclose(actual[0], expected[0], atol=1e-4)
+        self.assertTrue(any(files for _, _, files in os.walk(cache_dir)))
+
+    def test_compile_warmup_is_not_cached(self):
+        from unittest import mock
+
+        fake = _fake_midas()
+        transforms = mock.Mock(small_transform=fake.transform)
+        cache = PerceptionCache("tests/tmp/midas/perception_cache")
+        saved_env = dict(os.environ)
+        try:
+            with mock.patch("torch.hub.load", side_effect=[fake.model, transforms]):
+                runner = MiDaSRunner(
+                    torch_compile=True,
+                    compile_cache_dir="tests/tmp/midas/compile_cache",
+                    warmup_size=(32, 48),
+                    perception_cache=cache
+                )
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_env)
+
+        self.assertIs(runner.perception_cache, cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        self.assertEqual(os.listdir("tests/tmp/midas/perception_cache/depth"), [])
+
+    def test_run_batch_optional_writes(self):
+        runner = _fake_midas()
+        images = [np.full((16, 16, 3), i * 40, dtype=np.uint8) for i in range(2)]
+        paths = [f"tests/tmp/midas/depth_{i}.png" for i in range(2)]
+
+        runner.run_batch(images)
+        self.assertFalse(any(os.path.exists(p) for p in paths))
+
+        runner.run_batch(images, output_paths=paths)
+        self.assertTrue(all(os.path.exists(p) for p in paths))
+
+
+class _FakeYOLO:
+    """Returns real ultralytics Results built from fixed box tensors."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, frames):
+        from ultralytics.engine.results import Results
+
+        self.calls.append(len(frames))
+        results = []
+        for i, frame in enumerate(frames):
+            boxes = torch.tensor(
+                [[1.0, 2.0, 10.0, 12.0, 0.9, 56.0], [3.0, 4.0, 8.0, 9.0, 0.5, 57.0]][:i + 1]
+            )
+            results.append(Results(frame, path="", names={56: "chair", 57: "couch"}, boxes=boxes))
+        return results
+
+
+class TestYOLOBatch(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/yolo", ignore_errors=True)
+
+    def _runner(self):
+        runner = YOLOv8Runner.__new__(YOLOv8Runner)
+        runner.model = _FakeYOLO()
+        runner.perception_cache = None
+        runner.cache_id = "yolo-fake"
+        return runner
+
+    def test_run_batch_columnar(self):
+        runner = self._runner()
+        frames = [np.zeros((20, 20, 3), dtype=np.uint8) for _ in range(3)]
+
+        detections = runner.run_batch(frames, batch_size=2)
+
+        self.assertEqual(runner.model.calls, [2, 1])
+        self.assertEqual([len(d["class_id"]) for d in detections], [1, 2, 1])
+        self.assertEqual(detections[1]["bbox"].shape, (2, 4))
+        self.assertEqual(detections[1]["class_id"].tolist(), [56, 57])
+        np.testing.assert_allclose(detections[1]["confidence"], [0.9, 0.5])
+        self.assertFalse(os.path.exists("tests/tmp/yolo"))
+
+    def test_run_keeps_list_layout(self):
+        runner = self._runner()
+        image = np.zeros((20, 20, 3), dtype=np.uint8)
+
+        detections = runner.run(image, "tests/tmp/yolo/detections.json")
+        self.assertFalse(os.path.exists("tests/tmp/yolo/detections.json"))
+
+        self.assertEqual(runner.run(image, "tests/tmp/yolo/detections.json", write_json=True), detections)
+
+        self.assertEqual(detections, [{"bbox": [1.0, 2.0, 10.0, 12.0], "class_id": 56,
+                                       "confidence": detections[0]["confidence"]}])
+        self.assertAlmostEqual(detections[0]["confidence"], 0.9, places=5)
+        self.assertTrue(os.path.exists("tests/tmp/yolo/detections.json"))
+
+    def test_detections_to_list_empty(self):
+        empty = {"bbox": np.zeros((0, 4)), "class_id": np.zeros(0, dtype=np.int64),
+                 "confidence": np.zeros(0)}
+        self.assertEqual(detections_to_list(empty), [])
+
+
+def _tiny_sam(**kwargs):
+    # Randomly initialised single-block SAM, no checkpoint download needed
+    from segment_anything import sam_model_registry
+    from segment_anything.build_sam import _build_sam
+
+    def build(checkpoint=None):
+        torch.manual_seed(0)
+        return _build_sam(
+            encoder_embed_dim=32,
+            encoder_depth=1,
+            encoder_num_heads=1,
+            encoder_global_attn_indexes=[0],
+            checkpoint=checkpoint
+        )
+
+    sam_model_registry["tiny_test"] = build
+    kwargs.setdefault("checkpoint_path", None)
+    return SAMRunner(model_type="tiny_test", **kwargs)
+
+
+def _tiny_checkpoint(path, seed):
+    # Random weights for the tiny SAM, saved like a real checkpoint
+    torch.manual_seed(seed)
+    state_dict = {k: torch.randn_like(v) for k, v in _tiny_sam().predictor.model.state_dict().items()}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(state_dict, path)
+    return path
+
+
+class TestSAMBatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.matmul_precision = torch.get_float32_matmul_precision()
+        torch.set_float32_matmul_precision("highest")
+        cls.runner = _tiny_sam()
+        rng = np.random.default_rng(0)
+        cls.image = rng.integers(0, 255, (48, 64, 3), dtype=np.uint8)
+        cls.detections = [
+            {"bbox": [2.0, 3.0, 30.0, 40.0], "class_id": 56, "confidence": 0.9},
+            {"bbox": [20.0, 10.0, 60.0, 44.0], "class_id": 57, "confidence": 0.7}
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        torch.set_float32_matmul_precision(cls.matmul_precision)
+        shutil.rmtree("tests/tmp/sam", ignore_errors=True)
+
+    def test_run_batch_matches_per_box_predict(self):
+        masks = self.runner.run_batch(self.image, self.detections)
+
+        self.assertEqual(masks.shape, (2, 48, 64))
+        self.assertEqual(masks.dtype, bool)
+        for mask, det in zip(masks, self.detections):
+            expected, _, _ = self.runner.predictor.predict(
+                box=np.array(det["bbox"]),
+                multimask_output=False
+            )
+            np.testing.assert_array_equal(mask, expected[0])
+
+    def test_run_batch_background_export(self):
+        columns = {"bbox": np.array([d["bbox"] for d in self.detections])}
+
+        self.runner.run_batch(self.image, columns, output_dir="tests/tmp/sam")
+        self.runner.flush()
+
+        self.assertTrue(os.path.exists("tests/tmp/sam/obj_01.png"))
+        self.assertTrue(os.path.exists("tests/tmp/sam/obj_02.png"))
+
+    def test_onnx_mask_decoder_parity(self):
+        runner = _tiny_sam()
+        expected = runner.run_batch(self.image, self.detections)
+
+        runner.enable_onnx("tests/tmp/sam/onnx/mask_decoder.onnx")
+        self.assertEqual(runner.backend, "onnx")
+        actual = runner.run_batch(self.image, self.detections + self.detections[:1])
+
+        self.assertEqual(actual.shape, (3, 48, 64))
+        # Allow a handful of pixels to flip right at the mask threshold
+        self.assertLess(np.mean(actual[:2] != expected), 0.005)
+
+    def test_int8_image_encoder(self):
+        from src.optimizations import quantization_quality_check
+
+        encoder = _tiny_sam().predictor.model.image_encoder
+        example = (torch.randn(1, 3, 1024, 1024),)
+        report = quantization_quality_check(encoder, example)
+        self.assertGreater(report["cosine_similarity"], 0.99)
+
+        cache_dir = "tests/tmp/sam/quantized"
+        masks = _tiny_sam(quantize=True, quantized_dir=cache_dir).run_batch(self.image, self.detections)
+        cached = glob.glob(f"{cache_dir}/*/tiny_test_image_encoder_int8.pt")
+        self.assertEqual(len(cached), 1)
+        self.assertIsInstance(torch.load(cached[0], weights_only=True), dict)
+
+        # Second startup loads the cached int8 encoder without quantizing again
+        from unittest import mock
+        with mock.patch("torch.ao.quantization.quantize_dynamic") as quantize_dynamic:
+            runner = _tiny_sam(quantize=True, quantized_dir=cache_dir)
+        quantize_dynamic.assert_not_called()
+        np.testing.assert_array_equal(runner.run_batch(self.image, self.detections), masks)
+        self.assertEqual(runner.embedding_key, "tiny_test-int8")
+
+    def test_run_batch_no_detections(self):
+        masks = self.runner.run_batch(self.image, [])
+        self.assertEqual(masks.shape, (0, 48, 64))
+
+
+class TestSAMEmbeddingCache(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/sam_cache", ignore_errors=True)
+
+    def _count_encoder_calls(self, runner):
+        calls = []
+        runner.predictor.model.image_encoder.register_forward_hook(lambda *args: calls.append(1))
+        return calls
+
+    def test_memory_cache_skips_encoder(self):
+        runner = _tiny_sam()
+        calls = self._count_encoder_calls(runner)
+        image = np.random.default_rng(1).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+        boxes = [{"bbox": [2.0, 3.0, 30.0, 40.0]}]
+
+        first = runner.run_batch(image, boxes)
+        second = runner.run_batch(image, boxes + [{"bbox": [10.0, 10.0, 50.0, 40.0]}])
+
+        self.assertEqual(len(calls), 1)
+        np.testing.assert_array_equal(first[0], second[0])
+
+        runner.run_batch(image[::-1].copy(), boxes)
+        self.assertEqual(len(calls), 2)
+
+    def test_disk_cache_survives_restart(self):
+        image = np.random.default_rng(2).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+        boxes = [{"bbox": [2.0, 3.0, 30.0, 40.0]}]
+
+        first = _tiny_sam(embedding_cache_dir="tests/tmp/sam_cache").run_batch(image, boxes)
+
+        runner = _tiny_sam(embedding_cache_dir="tests/tmp/sam_cache")
+        calls = self._count_encoder_calls(runner)
+        second = runner.run_batch(image, boxes)
+
+        self.assertEqual(len(calls), 0)
+        np.testing.assert_array_equal(first, second)
+
+    def test_disk_cache_is_keyed_by_checkpoint(self):
+        image = np.random.default_rng(3).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+        boxes = [{"bbox": [2.0, 3.0, 30.0, 40.0]}]
+        cache_dir = "tests/tmp/sam_cache/checkpoints"
+        checkpoints = [_tiny_checkpoint(f"tests/tmp/sam_cache/tiny_{seed}.pth", seed) for seed in (0, 1)]
+
+        _tiny_sam(checkpoint_path=checkpoints[0], embedding_cache_dir=cache_dir).run_batch(image, boxes)
+
+        runner = _tiny_sam(checkpoint_path=checkpoints[1], embedding_cache_dir=cache_dir)
+        calls = self._count_encoder_calls(runner)
+        runner.run_batch(image, boxes)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(f.endswith(".npy") and ".tmp" not in f for f in os.listdir(cache_dir)), [True, True])
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_bytes=3 * 800)
+        for key in "abc":
+            cache.put(key, np.zeros(100))
+        cache.get("a")
+        cache.put("d", np.zeros(100))
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.nbytes, 3 * 800)
+
+    def test_oversized_entry_not_cached(self):
+        cache = LRUCache(max_bytes=10)
+        cache.put("big", np.zeros(100))
+        self.assertEqual(len(cache), 0)
+
+    def test_content_hash(self):
+        a = np.arange(12, dtype=np.uint8)
+        self.assertEqual(content_hash(a), content_hash(a.copy()))
+        self.assertNotEqual(content_hash(a), content_hash(a.reshape(3, 4)))
+        self.assertNotEqual(content_hash(a, "vit_b"), content_hash(a, "vit_h"))
+
+        # Frames without detections hash an empty box array
+        empty = np.zeros((0, 4), dtype=np.float32)
+        self.assertEqual(content_hash(empty), content_hash(empty.copy()))
+        self.assertNotEqual(content_hash(empty), content_hash(np.zeros((0, 2), dtype=np.float32)))
+        self.assertNotEqual(PerceptionCache.key(a, "sam", boxes=empty), PerceptionCache.key(a, "sam"))
+
+
+class TestPerceptionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = "tests/tmp/perception_cache"
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self.cache = PerceptionCache(self.cache_dir)
+        self.frames = [np.random.default_rng(i).integers(0, 255, (32, 48, 3), dtype=np.uint8) for i in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_mask_packing_roundtrip(self):
+        masks = np.random.default_rng(0).random((3, 7, 13)) > 0.5
+        packed = pack_masks(masks)
+        self.assertEqual(packed.nbytes, 3 * 12)
+        np.testing.assert_array_equal(unpack_masks(packed, masks.shape), masks)
+
+        empty = np.zeros((0, 7, 13), dtype=bool)
+        self.assertEqual(unpack_masks(pack_masks(empty), empty.shape).shape, (0, 7, 13))
+
+    def test_sam_without_boxes(self):
+        runner = _tiny_sam(perception_cache=self.cache)
+
+        masks = runner.run_batch(self.frames[0], [])
+        cached = runner.run_batch(self.frames[0], [])
+
+        self.assertEqual(masks.shape, (0, 32, 48))
+        self.assertEqual(cached.shape, (0, 32, 48))
+
+    def test_key_covers_model_and_params(self):
+        image = self.frames[0]
+        boxes = np.array([[1.0, 2.0, 3.0, 4.0]])
+        key = PerceptionCache.key(image, "sam-vit_b", boxes=boxes)
+
+        self.assertEqual(key, PerceptionCache.key(image.copy(), "sam-vit_b", boxes=boxes.copy()))
+        self.assertNotEqual(key, PerceptionCache.key(image, "sam-vit_h", boxes=boxes))
+        self.assertNotEqual(key, PerceptionCache.key(image, "sam-vit_b", boxes=boxes + 1))
+        self.assertNotEqual(key, PerceptionCache.key(self.frames[1], "sam-vit_b", boxes=boxes))
+
+    def test_yolo_skips_cached_frames(self):
+        runner = TestYOLOBatch()._runner()
+        runner.perception_cache = self.cache
+
+        first = runner.run_batch(self.frames[:2])
+        second = runner.run_batch(self.frames)
+
+        self.assertEqual(runner.model.calls, [2, 1])
+        for a, b in zip(first, second):
+            np.testing.assert_array_equal(a["bbox"], b["bbox"])
+            np.testing.assert_array_equal(a["class_id"], b["class_id"])
+
+    def test_midas_serves_float16_memmap(self):
+        runner = _fake_midas()
+        runner.perception_cache = self.cache
+        calls = []
+        runner.model.register_forward_hook(lambda *args: calls.append(1))
+
+        _, expected = runner.run_batch(self.frames)
+        depth_imgs, actual = runner.run_batch(self.frames)
+
+        self.assertEqual(len(calls), 1)
+        for a, e, img in zip(actual, expected, depth_imgs):
+            self.assertIsInstance(a, np.memmap)
+            self.assertEqual(a.dtype, np.float16)
+            np.testing.assert_allclose(a, e, atol=1e-3)
+            self.assertEqual(img.dtype, np.uint8)
+
+    def test_sam_masks_skip_encoder_and_decoder(self):
+        runner = _tiny_sam(perception_cache=self.cache)
+        calls = []
+        runner.predictor.model.image_encoder.register_forward_hook(lambda *args: calls.append("encoder"))
+        runner.predictor.model.mask_decoder.register_forward_hook(lambda *args: calls.append("decoder"))
+        boxes = [{"bbox": [2.0, 3.0, 30.0, 28.0]}]
+
+        first = runner.run_batch(self.frames[0], boxes)
+        calls.clear()
+        second = _tiny_sam(perception_cache=PerceptionCache(self.cache_dir)).run_batch(self.frames[0], boxes)
+        third = runner.run_batch(self.frames[0], boxes + boxes)
+
+        np.testing.assert_array_equal(first, second)
+        self.assertEqual(third.shape, (2, 32, 48))
+        # Only the new box set reaches the decoder (its embedding is still in memory)
+        self.assertEqual(calls, ["decoder"])
+        self.assertEqual(len(os.listdir(f"{self.cache_dir}/masks")), 2)
+
+
+    def test_sam_checkpoint_is_part_of_the_key(self):
+        checkpoints = [_tiny_checkpoint(os.path.join(self.cache_dir, f"tiny_{seed}.pth"), seed) for seed in (0, 1)]
+        boxes = [{"bbox": [2.0, 3.0, 30.0, 28.0]}]
+
+        _tiny_sam(checkpoint_path=checkpoints[0], perception_cache=self.cache).run_batch(self.frames[0], boxes)
+        _tiny_sam(checkpoint_path=checkpoints[1], perception_cache=self.cache).run_batch(self.frames[0], boxes)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+        _tiny_sam(checkpoint_path=checkpoints[0], perception_cache=self.cache).run_batch(self.frames[0], boxes)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_midas_weights_are_part_of_the_key(self):
+        from unittest import mock
+
+        cache_ids = []
+        for seed in (0, 0, 1):
+            fake = _fake_midas()
+            torch.manual_seed(seed)
+            fake.model[0].reset_parameters()
+            transforms = mock.Mock(small_transform=fake.transform)
+            with mock.patch("torch.hub.load", side_effect=[fake.model, transforms]):
+                cache_ids.append(MiDaSRunner(perception_cache=self.cache).cache_id)
+
+        self.assertEqual(cache_ids[0], cache_ids[1])
+        self.assertNotEqual(cache_ids[0], cache_ids[2])
+
+
+class TestSceneBuilder(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(3)
+        cls.depth = rng.random((30, 40)).astype(np.float32)
+        cls.masks = np.zeros((3, 30, 40), dtype=bool)
+        cls.masks[0, 2:10, 3:20] = True
+        cls.masks[1, 5:25, 10:35] = True   # overlaps object 0
+        cls.detections = [
+            {"bbox": [0, 0, 1, 1], "class_id": i, "confidence": 0.5} for i in range(3)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/scene", ignore_errors=True)
+
+    def test_object_depth_stats_match_naive(self):
+        stats = object_depth_stats(self.depth, self.masks)
+
+        for i in range(2):
+            values = self.depth[self.masks[i]]
+            self.assertEqual(stats["area"][i], values.size)
+            self.assertAlmostEqual(stats["mean"][i], values.mean(), places=5)
+            self.assertAlmostEqual(stats["median"][i], np.median(values), places=6)
+            self.assertAlmostEqual(stats["min"][i], values.min(), places=6)
+            self.assertAlmostEqual(stats["max"][i], values.max(), places=6)
+
+        # Empty mask
+        self.assertEqual(stats["area"][2], 0)
+        self.assertEqual(stats["mean"][2], 0.0)
+
+    def test_build_scene_in_memory_and_deferred_write(self):
+        builder = SceneBuilder()
+
+        scene = builder.build_scene(self.depth, self.detections, self.masks)
+        self.assertEqual(len(scene["objects"]), 3)
+        self.assertEqual(scene["objects"][1]["pixel_area"], int(self.masks[1].sum()))
+        self.assertFalse(os.path.exists("tests/tmp/scene/scene.json"))
+
+        builder.save_scene(scene, "tests/tmp/scene/scene.json")
+        self.assertTrue(os.path.exists("tests/tmp/scene/scene.json"))
+
+    def test_build_scene_with_columnar_detections(self):
+        builder = SceneBuilder()
+        columns = {
+            "bbox": np.asarray([det["bbox"] for det in self.detections], dtype=np.float32),
+            "class_id": np.asarray([det["class_id"] for det in self.detections]),
+            "confidence": np.asarray([det["confidence"] for det in self.detections], dtype=np.float32)
+        }
+
+        expected = builder.build_scene(self.depth, self.detections, self.masks)
+        scene = builder.build_scene(self.depth, columns, self.masks, output_path="tests/tmp/scene/columnar.json")
+
+        for a, b in zip(scene["objects"], expected["objects"]):
+            self.assertEqual(a["class_id"], b["class_id"])
+            np.testing.assert_allclose(a["bbox"], b["bbox"], rtol=1e-6)
+            self.assertEqual(a["pixel_area"], b["pixel_area"])
+            self.assertEqual(a["median_depth"], b["median_depth"])
+        with open("tests/tmp/scene/columnar.json") as f:
+            self.assertEqual(len(json.load(f)["objects"]), 3)
+
+    def test_build_scene_without_detections(self):
+        masks = np.zeros((0, 30, 40), dtype=bool)
+
+        stats = object_depth_stats(self.depth, masks)
+        self.assertEqual(stats["area"].shape, (0,))
+        self.assertEqual(object_depth_histograms(self.depth, masks).shape, (0, 64))
+        self.assertEqual(SceneBuilder().build_scene(self.depth, [], masks)["objects"], [])
+
+    def test_build_scene_from_mask_paths(self):
+        import cv2
+
+        os.makedirs("tests/tmp/scene", exist_ok=True)
+        paths = []
+        for i, mask in enumerate(self.masks):
+            # Half resolution masks get resized to the depth map
+            path = f"tests/tmp/scene/obj_{i + 1:02d}.png"
+            cv2.imwrite(path, mask[::2, ::2].astype(np.uint8) * 255)
+            paths.append(path)
+
+        scene = SceneBuilder().build_scene(self.depth, self.detections, paths)
+        self.assertGreater(scene["objects"][0]["pixel_area"], 0)
+        self.assertEqual(scene["objects"][2]["average_depth"], 0.0)
+
+
+
+class TestBinarySceneFormat(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/scene_npz", ignore_errors=True)
+
+    def test_npz_scene_with_depth_and_masks(self):
+        builder = SceneBuilder()
+        rng = np.random.default_rng(3)
+        depth = rng.random((30, 40)).astype(np.float32)
+        masks = rng.random((2, 30, 40)) > 0.5
+        detections = [{"bbox": [1.0, 2.0, 3.0, 4.0], "class_id": i, "confidence": 0.25 * (i + 1)} for i in range(2)]
+
+        scene = builder.build_scene(depth, detections, masks, output_path="tests/tmp/scene_npz/scene.npz")
+
+        with SceneFile("tests/tmp/scene_npz/scene.npz") as stored:
+            self.assertEqual(stored.objects["class_id"].tolist(), [0, 1])
+            self.assertEqual(stored.depth.dtype, np.float16)
+            np.testing.assert_allclose(stored.depth, depth, atol=1e-3)
+            np.testing.assert_array_equal(stored.masks, masks)
+            self.assertEqual(stored.meta, {"frame_id": "frame_0001"})
+
+        loaded = load_scene("tests/tmp/scene_npz/scene.npz")
+        self.assertEqual(loaded["frame_id"], scene["frame_id"])
+        for a, b in zip(loaded["objects"], scene["objects"]):
+            self.assertEqual(a.keys(), b.keys())
+            self.assertEqual(a["pixel_area"], b["pixel_area"])
+            self.assertAlmostEqual(a["average_depth"], b["average_depth"], places=6)
+
+    def test_npz_scene_without_objects(self):
+        depth = np.random.default_rng(4).random((30, 40)).astype(np.float32)
+        masks = np.zeros((0, 30, 40), dtype=bool)
+
+        SceneBuilder().build_scene(depth, [], masks, output_path="tests/tmp/scene_npz/empty.npz")
+
+        with SceneFile("tests/tmp/scene_npz/empty.npz") as stored:
+            self.assertEqual(len(stored.objects), 0)
+            self.assertEqual(stored.masks.shape, (0, 30, 40))
+        self.assertEqual(load_scene("tests/tmp/scene_npz/empty.npz")["objects"], [])
+
+    def test_json_roundtrip_and_prompt(self):
+        npz_path = json_to_npz("scene/frame_0001.json", "tests/tmp/scene_npz/frame_0001.npz")
+        json_path = npz_to_json(npz_path, "tests/tmp/scene_npz/frame_0001.json")
+
+        self.assertEqual(load_scene(json_path), load_scene("scene/frame_0001.json"))
+
+        gen = PromptGenerator()
+        self.assertEqual(
+            gen.generate_auto_design_prompt(npz_path),
+            gen.generate_auto_design_prompt("scene/frame_0001.json")
+        )
+
+
+class _BoxSegmenter:
+    """Stands in for SAMRunner: box-shaped masks, counts calls."""
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.calls = []
+
+    def run_batch(self, image, detections):
+        boxes = np.asarray(detections["bbox"]).round().astype(int)
+        self.calls.append(len(boxes))
+        masks = np.zeros((len(boxes),) + self.shape, dtype=bool)
+        for mask, (x1, y1, x2, y2) in zip(masks, boxes):
+            mask[y1:y2, x1:x2] = True
+        return masks
+
+
+class TestScanSceneBuilder(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/scan", ignore_errors=True)
+
+    def _frames(self, count=6):
+        # A chair drifting right, a table from frame 2 on, a one-frame false positive in frame 4
+        rng = np.random.default_rng(7)
+        frames = []
+        for i in range(count):
+            detections = [{"bbox": [10 + 2 * i, 10, 30 + 2 * i, 40], "class_id": 56, "confidence": 0.9}]
+            if i >= 2:
+                detections.append({"bbox": [50, 20, 75, 45], "class_id": 60, "confidence": 0.7})
+            if i == 4:
+                detections.append({"bbox": [0, 0, 5, 5], "class_id": 0, "confidence": 0.3})
+            frames.append((detections, rng.random((50, 80)).astype(np.float32)))
+        return frames
+
+    def test_box_iou_and_histogram_median(self):
+        iou = box_iou([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]])
+        np.testing.assert_allclose(iou, [[1.0, 1 / 3, 0.0]], atol=1e-6)
+
+        values = np.random.default_rng(0).random(10001)
+        hist = np.bincount((values * 128).astype(int), minlength=128)
+        self.assertAlmostEqual(histogram_median(hist), np.median(values), delta=1 / 128)
+        self.assertEqual(histogram_median(np.zeros(8)), 0.0)
+
+    def test_tracks_are_stable_and_segmented_once(self):
+        segmenter = _BoxSegmenter((50, 80))
+        builder = ScanSceneBuilder(segmenter=segmenter, min_hits=2)
+
+        ids = [builder.add_frame(None, dets, depth) for dets, depth in self._frames()]
+
+        self.assertEqual(ids[0], [1])
+        self.assertEqual(ids[2], [1, 2])
+        self.assertEqual(ids[4], [1, 2, 3])
+        self.assertEqual(ids[5], [1, 2])
+
+        # SAM only ran for the first frame of each track
+        self.assertEqual(segmenter.calls, [1, 1, 1])
+        self.assertEqual(builder.num_segmented, 3)
+        self.assertEqual(builder.num_detections, 6 + 4 + 1)
+
+        builder.refresh_every = 2
+        builder.add_frame(None, self._frames()[5][0], self._frames()[5][1])
+        self.assertEqual(segmenter.calls[-1], 2)
+
+    def test_incremental_stats_match_concatenated_frames(self):
+        frames = self._frames()
+        builder = ScanSceneBuilder(segmenter=_BoxSegmenter((50, 80)), depth_bins=512)
+        for dets, depth in frames:
+            builder.add_frame(None, dets, depth)
+
+        scene = builder.build_scene(output_path="tests/tmp/scan/scan.json")
+        self.assertEqual(scene["scan_id"], "scan_0001")
+        self.assertEqual(scene["num_frames"], 6)
+        self.assertEqual([obj["class_id"] for obj in scene["objects"]], [56, 60])
+        self.assertTrue(os.path.exists("tests/tmp/scan/scan.json"))
+
+        # The chair's pixels from every frame, pooled
+        values = np.concatenate([
+            depth[10:40, 10 + 2 * i:30 + 2 * i].ravel() for i, (_, depth) in enumerate(frames)
+        ])
+        chair = scene["objects"][0]
+        self.assertEqual(chair["frames_seen"], 6)
+        self.assertEqual((chair["first_frame"], chair["last_frame"]), ("frame_0001", "frame_0006"))
+        self.assertEqual(chair["bbox"], [20.0, 10.0, 40.0, 40.0])
+        self.assertAlmostEqual(chair["average_depth"], values.mean(), places=5)
+        self.assertAlmostEqual(chair["median_depth"], np.median(values), delta=1 / 512)
+        self.assertAlmostEqual(chair["min_depth"], values.min(), places=6)
+        self.assertAlmostEqual(chair["max_depth"], values.max(), places=6)
+        self.assertEqual(chair["pixel_area"], 20 * 30)
+
+    def test_given_masks_skip_segmenter(self):
+        segmenter = _BoxSegmenter((50, 80))
+        builder = ScanSceneBuilder(segmenter=segmenter, min_hits=1)
+        dets, depth = self._frames()[0]
+        masks = np.zeros((1, 50, 80), dtype=bool)
+        masks[0, 20:30, 15:25] = True
+
+        builder.add_frame(None, dets, depth, masks=masks)
+
+        self.assertEqual(segmenter.calls, [])
+        obj = builder.build_scene()["objects"][0]
+        self.assertEqual(obj["pixel_area"], 100)
+        self.assertAlmostEqual(obj["average_depth"], depth[20:30, 15:25].mean(), places=5)
+
+
+def _scan_frames():
+    """A handheld scan: 4 jittered shots of one view, 3 of a second view, then the first again."""
+    rng = np.random.default_rng(11)
+    views = []
+    for seed in (0, 1):
+        noise = np.random.default_rng(seed).integers(0, 255, (12, 16, 3), dtype=np.uint8)
+        views.append(cv2.resize(noise, (128, 96), interpolation=cv2.INTER_CUBIC))
+
+    frames = []
+    for view, count in ((0, 4), (1, 3), (0, 1)):
+        for _ in range(count):
+            jitter = rng.integers(-2, 3, views[view].shape)
+            frames.append(np.clip(views[view] + jitter, 0, 255).astype(np.uint8))
+    return frames
+
+
+class TestFrameSampler(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/sampler", ignore_errors=True)
+
+    def test_metrics(self):
+        frames = _scan_frames()
+        same = compare_signatures(frame_signature(frames[0]), frame_signature(frames[1]))
+        other = compare_signatures(frame_signature(frames[0]), frame_signature(frames[4]))
+
+        self.assertGreater(same["ssim"], 0.95)
+        self.assertLess(same["hash"], 4)
+        self.assertLess(other["ssim"], 0.5)
+        self.assertGreater(other["hash"], 10)
+
+    def test_drops_near_duplicates(self):
+        sampler = FrameSampler()
+        kept = [index for index, _ in sampler.sample(_scan_frames())]
+
+        self.assertEqual(kept, [0, 4, 7])
+        self.assertEqual((sampler.num_read, sampler.num_forwarded), (8, 3))
+
+    def test_frame_budgets(self):
+        frames = [np.random.default_rng(i).integers(0, 255, (32, 32, 3), dtype=np.uint8) for i in range(8)]
+
+        self.assertEqual([i for i, _ in FrameSampler().sample(frames)], list(range(8)))
+        self.assertEqual([i for i, _ in FrameSampler(max_fps=5).sample(frames, fps=10)], [0, 2, 4, 6])
+        self.assertEqual([i for i, _ in FrameSampler(max_frames=3).sample(frames)], [0, 1, 2])
+        self.assertEqual([i for i, _ in FrameSampler(max_frames=3).sample(frames, total_frames=8)], [0, 3, 6])
+
+    def test_video_input(self):
+        os.makedirs("tests/tmp/sampler", exist_ok=True)
+        path = "tests/tmp/sampler/scan.avi"
+        out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (128, 96))
+        for frame in _scan_frames():
+            out.write(frame)
+        out.release()
+
+        sampler = FrameSampler(queue_size=1)
+        frames = list(iter_inputs(["tests/tmp/dummy.png", path], sampler))
+
+        self.assertEqual(frames[0], "tests/tmp/dummy.png")
+        self.assertEqual([frame_id for frame_id, _ in frames[1:]], ["scan_0001", "scan_0005", "scan_0008"])
+        self.assertEqual(frames[1][1].shape, (96, 128, 3))
+
+        # Abandoning the generator early stops the reader thread
+        first = next(FrameSampler(queue_size=1).sample_video(path))
+        self.assertEqual(first[0], "frame_0001")
+
+        with self.assertRaises(IOError):
+            next(FrameSampler().sample_video("tests/tmp/sampler/missing.mp4"))
+
+
+if __name__ == "__main__":
+    unittest.main()
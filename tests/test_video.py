@@ -0,0 +1,226 @@
+import unittest
+import os
+import sys
+import shutil
+import threading
+import cv2
+import numpy as np
+from PIL import Image
+from unittest import mock
+
+from src.prompt.prompt_generator import PromptGenerator
+from src.video.video_maker import VideoMaker
+from src.video.temporal_styler import (
+    TemporalStyler,
+    compute_flow,
+    warp_with_flow,
+    histogram_distance
+)
+
+
+class _InvertRunner:
+    """Stands in for StableDiffusionRunner: 'styles' a frame by inverting it."""
+
+    PRESETS = {"fast": {"resolution": (64, 48), "steps": 4, "guidance_scale": 1.0, "controlnet_type": "depth"}}
+
+    def __init__(self):
+        self.prompt_gen = PromptGenerator()
+        self.calls = []
+
+    def style_image(self, image, prompt, preset="fast", init_image=None, strength=0.7, steps=None, seed=None):
+        self.calls.append(init_image is not None)
+        source = image if init_image is None else init_image
+        return Image.fromarray(255 - np.asarray(source.convert("RGB").resize(self.PRESETS["fast"]["resolution"])))
+
+
+def _textured(h, w, seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 255, (h // 4, w // 4, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(cv2.resize(noise, (w, h), interpolation=cv2.INTER_CUBIC), (5, 5), 0)
+
+
+def _pan(seed, count, shift=1, size=(48, 64)):
+    """count frames panning right over a larger textured canvas."""
+    canvas = _textured(size[0], size[1] + count * shift, seed)
+    return [canvas[:, i * shift:i * shift + size[1]].copy() for i in range(count)]
+
+
+class TestTemporalStyler(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/temporal", ignore_errors=True)
+
+    def setUp(self):
+        # A slow pan, then a hard cut to a differently colored room
+        second = [np.clip(f.astype(np.int16) + (0, 0, 120), 0, 255).astype(np.uint8) for f in _pan(1, 3)]
+        self.frames = _pan(0, 5) + second
+
+    def test_histogram_distance(self):
+        self.assertAlmostEqual(histogram_distance(self.frames[0], self.frames[0]), 0.0, places=5)
+        self.assertLess(histogram_distance(self.frames[0], self.frames[1]), 0.3)
+        self.assertGreater(histogram_distance(self.frames[0], self.frames[5]), 0.3)
+
+    def test_flow_warp_aligns_frames(self):
+        prev, nxt = _pan(2, 2, shift=2, size=(96, 128))
+        warped = warp_with_flow(prev, compute_flow(cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY),
+                                                  cv2.cvtColor(nxt, cv2.COLOR_BGR2GRAY)))
+
+        interior = (slice(8, -8), slice(8, -8))
+        aligned = np.abs(warped[interior].astype(np.int16) - nxt[interior]).mean()
+        unaligned = np.abs(prev[interior].astype(np.int16) - nxt[interior]).mean()
+        self.assertLess(aligned, unaligned / 3)
+
+    def test_keyframes_on_scene_change(self):
+        styler = TemporalStyler(_InvertRunner())
+        self.assertEqual(styler.select_keyframes(self.frames), [0, 5])
+
+        styler.max_keyframe_gap = 2
+        self.assertEqual(styler.select_keyframes(self.frames), [0, 2, 4, 5, 7])
+
+        # A depth jump alone also starts a keyframe
+        depths = [np.zeros((48, 64))] * 3 + [np.ones((48, 64))] * 5
+        self.assertEqual(TemporalStyler(_InvertRunner()).select_keyframes(self.frames, depths), [0, 3, 5])
+
+    def test_flow_propagation_only_styles_keyframes(self):
+        runner = _InvertRunner()
+        styler = TemporalStyler(runner, method="flow")
+
+        results = list(styler.style_frames(self.frames, "prompt"))
+
+        self.assertEqual(runner.calls, [False, False])
+        self.assertEqual([key for _, key in results], [True, False, False, False, False, True, False, False])
+        self.assertEqual(results[3][0].shape, self.frames[3].shape)
+
+        # Propagated frames follow the pan of the styled keyframe
+        interior = (slice(8, -8), slice(8, -8))
+        error = np.abs(results[3][0][interior].astype(np.int16) - (255 - self.frames[3][interior])).mean()
+        self.assertLess(error, 10)
+
+    def test_img2img_propagation_refines_in_between_frames(self):
+        runner = _InvertRunner()
+        list(TemporalStyler(runner, method="img2img").style_frames(self.frames, "prompt"))
+        self.assertEqual(runner.calls, [False, True, True, True, True, False, True, True])
+
+        with self.assertRaises(ValueError):
+            TemporalStyler(runner, method="optical")
+
+    def test_style_video(self):
+        os.makedirs("tests/tmp/temporal", exist_ok=True)
+        input_path = "tests/tmp/temporal/walkthrough.mp4"
+        out = cv2.VideoWriter(input_path, cv2.VideoWriter_fourcc(*"mp4v"), 10, (64, 48))
+        for frame in self.frames:
+            out.write(frame)
+        out.release()
+
+        output_path, num_keyframes = TemporalStyler(_InvertRunner()).style_video(
+            input_path, "tests/tmp/temporal/styled.mp4", style="modern"
+        )
+
+        cap = cv2.VideoCapture(output_path)
+        self.assertEqual(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), len(self.frames))
+        cap.release()
+        self.assertEqual(num_keyframes, 2)
+
+
+_FAKE_FFMPEG = """#!{python}
+import sys
+sys.stderr.write("frame=1 speed=1x\\n" * {log_lines})
+sys.stderr.flush()
+data = sys.stdin.buffer.read()
+with open(sys.argv[-1], "wb") as f:
+    f.write(data)
+sys.exit({code})
+"""
+
+
+class TestVideoMaker(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.makedirs("tests/tmp/video", exist_ok=True)
+        cls.keyframes = [np.full((48, 64, 3), v, dtype=np.uint8) for v in (0, 100, 250)]
+        cls.keyframes[1][:, :32] = 30
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tests/tmp/video", ignore_errors=True)
+
+    def _fake_ffmpeg(self, name, code=0, log_lines=1):
+        path = os.path.abspath(f"tests/tmp/video/{name}")
+        with open(path, "w") as f:
+            f.write(_FAKE_FFMPEG.format(python=sys.executable, code=code, log_lines=log_lines))
+        os.chmod(path, 0o755)
+        return path
+
+    def test_keyframe_transitions(self):
+        frames = list(VideoMaker.keyframe_transitions(self.keyframes, transition_frames=4, hold_frames=3))
+
+        self.assertEqual(sum(repeat for _, repeat in frames), 3 * 3 + 2 * 4)
+        self.assertEqual(frames[0][1], 4)
+        for i, (frame, repeat) in enumerate(frames[1:4], start=1):
+            expected = cv2.addWeighted(self.keyframes[0], 1 - i / 4, self.keyframes[1], i / 4, 0)
+            self.assertLessEqual(np.abs(frame.astype(np.int16) - expected).max(), 1)
+        self.assertEqual(frames[-1][1], 3)
+
+    def test_paths_decoded_once(self):
+        paths = []
+        for i, frame in enumerate(self.keyframes):
+            paths.append(f"tests/tmp/video/key_{i}.png")
+            cv2.imwrite(paths[-1], frame)
+
+        with mock.patch("src.video.video_maker.cv2.imread", wraps=cv2.imread) as imread:
+            output = VideoMaker("tests/tmp/video/from_paths.mp4", fps=10).create_video(paths, 2, 2)
+
+        self.assertEqual(imread.call_count, 3)
+        cap = cv2.VideoCapture(output)
+        self.assertEqual(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 3 * 2 + 2 * 2)
+        cap.release()
+
+    def test_streaming_write_frames(self):
+        vm = VideoMaker("tests/tmp/video/stream.mp4", fps=10, queue_size=2)
+        generated = (np.full((48, 64, 3), i * 20, dtype=np.uint8) for i in range(10))
+
+        output = vm.write_frames(generated)
+
+        cap = cv2.VideoCapture(output)
+        self.assertEqual(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 10)
+        cap.release()
+        self.assertIsNone(VideoMaker("tests/tmp/video/empty.mp4").write_frames([]))
+
+    def test_ffmpeg_pipe(self):
+        vm = VideoMaker("tests/tmp/video/x264.mp4", fps=10, backend="ffmpeg",
+                        ffmpeg_path=self._fake_ffmpeg("ffmpeg_ok"))
+        self.assertEqual(vm.backend, "ffmpeg")
+
+        output = vm.create_video(self.keyframes, transition_frames=4, hold_frames=3)
+
+        self.assertEqual(os.path.getsize(output), (3 * 3 + 2 * 4) * 48 * 64 * 3)
+
+    def test_ffmpeg_verbose_stderr(self):
+        # More log output than a pipe buffer holds, written before any frame is read
+        vm = VideoMaker("tests/tmp/video/verbose.mp4", fps=10, backend="ffmpeg",
+                        ffmpeg_path=self._fake_ffmpeg("ffmpeg_verbose", log_lines=20000))
+
+        encode = threading.Thread(
+            target=vm.create_video, args=(self.keyframes,), kwargs={"transition_frames": 4, "hold_frames": 3},
+            daemon=True
+        )
+        encode.start()
+        encode.join(timeout=60)
+
+        self.assertFalse(encode.is_alive())
+        self.assertEqual(os.path.getsize("tests/tmp/video/verbose.mp4"), (3 * 3 + 2 * 4) * 48 * 64 * 3)
+
+    def test_ffmpeg_failure_and_fallback(self):
+        vm = VideoMaker("tests/tmp/video/broken.mp4", backend="ffmpeg",
+                        ffmpeg_path=self._fake_ffmpeg("ffmpeg_broken", code=1))
+        with self.assertRaisesRegex(RuntimeError, "code 1: .*speed=1x"):
+            vm.create_video(self.keyframes, transition_frames=2, hold_frames=1)
+
+        vm = VideoMaker("tests/tmp/video/fallback.mp4", backend="ffmpeg", ffmpeg_path="no-such-ffmpeg")
+        self.assertEqual(vm.backend, "opencv")
+
+
+if __name__ == "__main__":
+    unittest.main()